@@ -1,16 +1,36 @@
 import sqlite3
 from pathlib import Path
-import requests
-from datetime import datetime, timedelta
+import httpx
+from datetime import datetime, timedelta, timezone
 from google import genai
 from google.genai import errors
 import json
-from fastapi import HTTPException
+import csv
+import io
+from operator import itemgetter
+from collections import OrderedDict, deque
 import re
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.datastructures import MutableHeaders
 from pydantic import BaseModel
 import os
+import asyncio
+import threading
+import queue
+import hashlib
+import time
+import uuid
+import contextvars
+import random
+import sys
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+try:
+    import orjson   # optional, decodes Shopify's responses several times faster
+except ImportError:
+    orjson = None
 
 # Get environment variables
 env_path = Path(__file__).resolve().parent / "credentials.env"
@@ -22,14 +42,327 @@ class AskRequest(BaseModel):
     question: str
     shopify_token: str
 
-# Run server
-app = FastAPI(title="AI Backend Service")
+class AskBatchRequest(BaseModel):
+    store_id: str
+    questions: list[str]
+    shopify_token: str
+
+# Run server (the background sync scheduler and webhook worker live for the lifetime of the app)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scheduler = asyncio.create_task(sync_scheduler())
+    webhooks = asyncio.create_task(webhook_worker())
+    yield
+    scheduler.cancel()
+    webhooks.cancel()
+    await close_shopify_clients()
+    DB_EXECUTOR.shutdown(wait=False)
+    STORE_ROUTER.close()
+
+app = FastAPI(title="AI Backend Service", lifespan=lifespan)
+
+# Metrics
+# Each stage of a question (and each background sync) is timed into Prometheus
+# histograms, next to counters for Shopify pages, rows upserted, LLM tokens, SQL rows
+# and cache lookups; GET /metrics serves them in the Prometheus text format. The stages
+# of the current request are also returned in a Server-Timing header, tagged with the
+# X-Request-ID the gateway sent (or a new one).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+METRICS = []
+
+def format_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{format_label_value(v)}"' for k, v in labels) + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.series = {}   # sorted label items -> value
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            lines.extend(f"{name}{format_labels(labels)} {value}" for name, labels, value in self.samples())
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name, labels, value) for labels, value in self.series.items()]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            # Cumulative bucket counts, then count and sum
+            counts = self.series.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        samples = []
+        for labels, counts in self.series.items():
+            for bound, n in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", labels + (("le", bound),), n))
+            samples.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), counts[-2]))
+            samples.append((f"{self.name}_count", labels, counts[-2]))
+            samples.append((f"{self.name}_sum", labels, round(counts[-1], 6)))
+        return samples
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route and status")
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent in each stage of answering a question")
+SYNC_SECONDS = Histogram("sync_duration_seconds", "Duration of store syncs")
+SHOPIFY_SECONDS = Histogram("shopify_graphql_request_duration_seconds", "Shopify GraphQL request latency by query")
+SHOPIFY_REQUESTS = Counter("shopify_graphql_requests_total", "Shopify GraphQL requests by query and outcome")
+SHOPIFY_PAGES = Counter("shopify_graphql_pages_total", "Pages read from Shopify GraphQL connections by query")
+ROWS_UPSERTED = Counter("rows_upserted_total", "Rows written by syncs, by table")
+ROWS_CHANGED = Counter("rows_changed_total", "Rows whose values actually changed in syncs, by table")
+LLM_SECONDS = Histogram("llm_request_duration_seconds", "LLM call latency")
+LLM_TOKENS = Counter("llm_tokens_total", "LLM prompt and response tokens")
+SQL_SECONDS = Histogram("sql_query_duration_seconds", "Execution time of generated and vetted SQL")
+SQL_ROWS = Histogram("sql_rows_returned", "Rows returned per SQL query (before truncation)", COUNT_BUCKETS)
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result")
+INTENT_QUESTIONS = Counter("intent_questions_total", "Questions seen by the intent fast path, by outcome")
+WEBHOOK_EVENTS = Counter("webhook_events_total", "Shopify webhooks by topic and outcome")
+SYNC_REQUESTS = Counter("sync_requests_total", "Sync requests by outcome (started, joined, skipped, satisfied)")
+LEASES_LOST = Counter("store_leases_lost_total", "Store leases that could not be renewed while held, by purpose")
+
+# Per-request state: the request ID, the seconds spent in each stage (and the stages
+# still running), the tasks working on it, the SQL it ran and the tokens and rows it
+# used. The dict is shared with the tasks and executor threads the request hands work to.
+REQUEST_CONTEXT = contextvars.ContextVar("request_context", default=None)
+MAX_RECORDED_QUERIES = 50
+
+def new_request_context(request_id: str = None) -> dict:
+    return {
+        "id": request_id or uuid.uuid4().hex,
+        "stages": {},
+        "active": [],
+        "tasks": set(),
+        "queries": [],
+        "counts": {},
+    }
+
+def count_for_request(name: str, amount: int):
+    context = REQUEST_CONTEXT.get()
+    if context is not None:
+        context["counts"][name] = context["counts"].get(name, 0) + amount
+
+def record_request_query(sql: str, plan: list, rows: int, truncated: bool, duration_ms: float):
+    context = REQUEST_CONTEXT.get()
+    if context is not None and len(context["queries"]) < MAX_RECORDED_QUERIES:
+        context["queries"].append({
+            "sql": sql, "plan": plan, "rows": rows, "truncated": truncated, "duration_ms": round(duration_ms, 3),
+        })
+
+@contextmanager
+def timed(stage: str):
+    context = REQUEST_CONTEXT.get()
+    if context is not None:
+        context["active"].append(stage)
+        context["tasks"].add(asyncio.current_task())
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if context is not None:
+            context["active"].remove(stage)
+            context["stages"][stage] = context["stages"].get(stage, 0.0) + elapsed
+
+def server_timing(stages: dict, total: float) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in [*stages.items(), ("total", total)])
+
+class RequestInstrumentation:
+    # Plain ASGI middleware rather than @app.middleware: the endpoint runs in the
+    # request's own task, which the profiler can recognize, and streamed responses
+    # are timed to their last byte
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = dict(scope["headers"]).get(b"x-request-id")
+        context = new_request_context(request_id.decode("latin-1") if request_id else None)
+        REQUEST_CONTEXT.set(context)
+        profile = REQUEST_PROFILER.start(scope, context) if PROFILE_REQUESTS else None
+        started = time.perf_counter()
+        status = 500
+
+        async def send_instrumented(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                # Streamed responses only carry the stages finished before the first byte
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-ID"] = context["id"]
+                headers["Server-Timing"] = server_timing(context["stages"], time.perf_counter() - started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_instrumented)
+        finally:
+            elapsed = time.perf_counter() - started
+            path = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(elapsed, method=scope["method"], path=path, status=status)
+            if profile is not None:
+                REQUEST_PROFILER.finish(profile, path, status, elapsed)
+
+app.add_middleware(RequestInstrumentation)
+
+# Request profiler (opt-in: PROFILE_REQUESTS=1)
+# While a request runs, one thread samples the event loop's thread every
+# PROFILE_INTERVAL_MS. A sample taken while one of the request's tasks is running
+# records its Python stack; one taken while it waits records the stage it waits in
+# (llm_sql, run_sql, ...). Requests slower than PROFILE_SLOW_MS, plus a PROFILE_SAMPLE_RATE
+# fraction of the rest, are kept with their stages, SQL and query plans, tokens and
+# rows in a ring buffer of the last PROFILE_BUFFER_SIZE, served by /api/v1/profiles.
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "2000"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "200"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+def frame_stack(frame) -> list:
+    # Root-first "function (file:line)" entries, without the event loop's own frames
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.endswith(("asyncio/events.py", "asyncio/base_events.py")):
+            break
+        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return stack[::-1]
+
+class RequestProfiler:
+    def __init__(self, interval_ms: float, buffer_size: int):
+        self.interval = interval_ms / 1000
+        self.profiles = {}   # request task -> profile being recorded
+        self.kept = deque(maxlen=buffer_size)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self, scope, context: dict) -> dict:
+        context["tasks"].add(asyncio.current_task())
+        profile = {
+            "context": context,
+            "task": asyncio.current_task(),
+            "loop": asyncio.get_running_loop(),
+            "thread_id": threading.get_ident(),
+            "method": scope["method"],
+            "started_at": datetime.utcnow().isoformat(),
+            "samples": 0,
+            "stacks": {},
+        }
+        with self.lock:
+            self.profiles[profile["task"]] = profile
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="request-profiler", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return profile
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                profiles = list(self.profiles.values())
+                if not profiles:
+                    self.wakeup.clear()
+                    continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                if asyncio.current_task(profile["loop"]) in profile["context"]["tasks"]:
+                    stack = frame_stack(frames.get(profile["thread_id"]))
+                else:
+                    active = profile["context"]["active"]
+                    stack = ["<waiting>", active[-1] if active else "other"]
+                key = ";".join(stack)
+                profile["stacks"][key] = profile["stacks"].get(key, 0) + 1
+                profile["samples"] += 1
+            time.sleep(self.interval)
+
+    def finish(self, profile: dict, path: str, status: int, elapsed: float):
+        with self.lock:
+            self.profiles.pop(profile["task"], None)
+        duration_ms = elapsed * 1000
+        if duration_ms >= PROFILE_SLOW_MS:
+            reason = "slow"
+        elif random.random() < PROFILE_SAMPLE_RATE:
+            reason = "sampled"
+        else:
+            return
+        context = profile["context"]
+        record = {
+            "request_id": context["id"],
+            "method": profile["method"],
+            "path": path,
+            "status": status,
+            "started_at": profile["started_at"],
+            "duration_ms": round(duration_ms, 1),
+            "reason": reason,
+            "stages_ms": {stage: round(s * 1000, 1) for stage, s in context["stages"].items()},
+            "counts": dict(context["counts"]),
+            "queries": list(context["queries"]),
+            "interval_ms": self.interval * 1000,
+            "samples": profile["samples"],
+            "stacks": dict(sorted(profile["stacks"].items(), key=lambda item: -item[1])),
+        }
+        with self.lock:
+            self.kept.append(record)
+
+    def list(self) -> list:
+        summary_keys = ("request_id", "method", "path", "status", "started_at", "duration_ms", "reason", "stages_ms", "counts")
+        with self.lock:
+            return [{k: r[k] for k in summary_keys} for r in reversed(self.kept)]
+
+    def get(self, request_id: str):
+        with self.lock:
+            return next((r for r in reversed(self.kept) if r["request_id"] == request_id), None)
+
+REQUEST_PROFILER = RequestProfiler(PROFILE_INTERVAL_MS, PROFILE_BUFFER_SIZE)
 
 # Database setup
+# shopify.db holds the state shared by all stores (sync cursors, settings, query log);
+# each store's data lives in its own database file (see the store router below).
 BASE_DIR = Path(__file__).resolve().parent
-DB_FILE = BASE_DIR / "shopify.db"
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR))   # where every database file lives
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+DB_FILE = DATA_DIR / "shopify.db"
+
+def init_store_db(conn: sqlite3.Connection):
     c = conn.cursor()
     
     # shop table
@@ -97,6 +430,88 @@ def init_db():
             price REAL
         )
     """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)")
+    # Keys the rollup refresh looks rows up by
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_variants_inventory_item_id ON variants(inventory_item_id)")
+
+def init_db():
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    c = conn.cursor()
+
+    # sync_state table (per-store, per-resource high-water marks for incremental syncs)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            store_id TEXT,
+            resource TEXT,
+            updated_at TEXT,
+            synced_at TEXT,
+            PRIMARY KEY (store_id, resource)
+        )
+    """)
+
+    # store_settings table (per-store sync configuration)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS store_settings (
+            store_id TEXT PRIMARY KEY,
+            ingest_mode TEXT
+        )
+    """)
+
+    # query_log table (executed analytics SQL with timing and plan, mined by the index advisor)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS query_log (
+            id INTEGER PRIMARY KEY,
+            logged_at TEXT,
+            shape_hash TEXT,
+            shape TEXT,
+            sql TEXT,
+            duration_ms REAL,
+            rows INTEGER,
+            plan TEXT,
+            full_scans TEXT,
+            auto_indexes TEXT
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_query_log_shape ON query_log(shape_hash)")
+
+    # advised_indexes table (indexes created by the advisor, dropped again when unused)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS advised_indexes (
+            name TEXT PRIMARY KEY,
+            table_name TEXT,
+            columns TEXT,
+            created_at TEXT,
+            last_used_at TEXT
+        )
+    """)
+
+    # sync_leases table (which worker process may write a store's shard, until expires_at)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS sync_leases (
+            store_id TEXT PRIMARY KEY,
+            owner TEXT,
+            purpose TEXT,
+            acquired_at REAL,
+            expires_at REAL
+        )
+    """)
+
+    # webhook_events table (durable queue of Shopify webhooks, kept for a while after applying for replays)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            id INTEGER PRIMARY KEY,
+            store_id TEXT,
+            topic TEXT,
+            webhook_id TEXT UNIQUE,
+            payload TEXT,
+            received_at TEXT,
+            applied_at TEXT,
+            error TEXT
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_pending ON webhook_events(store_id, applied_at, id)")
 
 
     conn.commit()
@@ -104,33 +519,269 @@ def init_db():
 
 init_db()
 
-# Extra sql helper for inventory 
-def run_ddl(sql: str):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute(sql)
-    conn.commit()
-    conn.close()
+# Materialized rollups
+# inventory_totals and sales_daily are real tables, kept current by the sync pipeline:
+# every committed batch re-aggregates only the variants and order days it touched
+# (see refresh_rollups), so questions read small pre-aggregated tables.
+def create_temp_keys(conn: sqlite3.Connection, name: str, keys):
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY)")
+    conn.execute(f"DELETE FROM temp.{name}")
+    conn.executemany(f"INSERT OR IGNORE INTO temp.{name}(key) VALUES (?)", [(k,) for k in keys])
+
+def refresh_rollups(conn: sqlite3.Connection, changed: dict = None):
+    # changed maps table -> keys written (orders, products, variants, inventory item ids)
+    # and "days" -> days that written orders were stored under before; None rebuilds the
+    # rollups from scratch
+    if changed is None:
+        conn.execute("DELETE FROM inventory_totals")
+        conn.execute("""
+            INSERT INTO inventory_totals(product_id, variant_id, total_available)
+            SELECT v.product_id, v.variant_id, SUM(i.available)
+            FROM inventory i
+            JOIN variants v ON i.inventory_item_id = v.inventory_item_id
+            GROUP BY v.product_id, v.variant_id
+        """)
+        conn.execute("DELETE FROM sales_daily")
+        conn.execute("""
+            INSERT INTO sales_daily(day, product_id, variant_id, vendor, orders, units, revenue)
+            SELECT substr(o.created_at, 1, 10), oi.product_id, oi.variant_id, p.vendor,
+                   COUNT(DISTINCT o.order_id), SUM(oi.quantity), SUM(oi.quantity * oi.price)
+            FROM order_items oi
+            JOIN orders o ON o.order_id = oi.order_id
+            LEFT JOIN products p ON p.product_id = oi.product_id
+            GROUP BY substr(o.created_at, 1, 10), oi.product_id, oi.variant_id
+        """)
+        return
 
-helper = """CREATE VIEW IF NOT EXISTS inventory_totals AS
-    SELECT
-    v.product_id,
-    v.variant_id,
-    SUM(i.available) AS total_available
-    FROM inventory i
-    JOIN variants v ON i.inventory_item_id = v.inventory_item_id
-    GROUP BY v.product_id, v.variant_id;
-"""
-run_ddl(helper)
+    # Inventory totals of written variants and of variants whose inventory levels changed
+    if changed.get("variants") or changed.get("inventory"):
+        create_temp_keys(conn, "changed_variants", changed.get("variants", ()))
+        create_temp_keys(conn, "changed_items", changed.get("inventory", ()))
+        conn.execute("""
+            INSERT OR IGNORE INTO temp.changed_variants(key)
+            SELECT variant_id FROM variants WHERE inventory_item_id IN (SELECT key FROM temp.changed_items)
+        """)
+        conn.execute("DELETE FROM inventory_totals WHERE variant_id IN (SELECT key FROM temp.changed_variants)")
+        conn.execute("""
+            INSERT INTO inventory_totals(product_id, variant_id, total_available)
+            SELECT v.product_id, v.variant_id, SUM(i.available)
+            FROM variants v
+            JOIN inventory i ON i.inventory_item_id = v.inventory_item_id
+            WHERE v.variant_id IN (SELECT key FROM temp.changed_variants)
+            GROUP BY v.product_id, v.variant_id
+        """)
+
+    # Daily sales of every (UTC) day that has or had a written order
+    if changed.get("orders") or changed.get("days"):
+        create_temp_keys(conn, "changed_orders", changed.get("orders", ()))
+        create_temp_keys(conn, "changed_days", changed.get("days", ()))
+        conn.execute("""
+            INSERT OR IGNORE INTO temp.changed_days(key)
+            SELECT substr(created_at, 1, 10) FROM orders WHERE order_id IN (SELECT key FROM temp.changed_orders)
+        """)
+        conn.execute("DELETE FROM sales_daily WHERE day IN (SELECT key FROM temp.changed_days)")
+        conn.execute("""
+            INSERT INTO sales_daily(day, product_id, variant_id, vendor, orders, units, revenue)
+            SELECT d.key, oi.product_id, oi.variant_id, p.vendor,
+                   COUNT(DISTINCT o.order_id), SUM(oi.quantity), SUM(oi.quantity * oi.price)
+            FROM temp.changed_days d
+            JOIN orders o ON o.created_at >= d.key AND o.created_at < d.key || 'U'  -- 'YYYY-MM-DDT...' of that day
+            JOIN order_items oi ON oi.order_id = o.order_id
+            LEFT JOIN products p ON p.product_id = oi.product_id
+            GROUP BY d.key, oi.product_id, oi.variant_id
+        """)
+
+    # Vendor is denormalized into sales_daily
+    if changed.get("products"):
+        create_temp_keys(conn, "changed_products", changed["products"])
+        conn.execute("""
+            UPDATE sales_daily
+            SET vendor = (SELECT vendor FROM products p WHERE p.product_id = sales_daily.product_id)
+            WHERE product_id IN (SELECT key FROM temp.changed_products)
+        """)
+
+def init_rollup_tables(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_totals (
+            product_id TEXT,
+            variant_id TEXT PRIMARY KEY,
+            total_available INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inventory_totals_product_id ON inventory_totals(product_id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day TEXT,
+            product_id TEXT,
+            variant_id TEXT,
+            vendor TEXT,
+            orders INTEGER,
+            units INTEGER,
+            revenue REAL,
+            PRIMARY KEY (day, product_id, variant_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_daily_product_id ON sales_daily(product_id)")
+    # A shard synced before the rollups existed starts with them complete, not filled in
+    # only as its rows change
+    refresh_rollups(conn)
+
+def add_updated_at_columns(conn: sqlite3.Connection):
+    # Shopify's updatedAt of each stored order and product, so a webhook delivered after
+    # a newer one (or after a sync that already read the newer state) doesn't overwrite it
+    conn.execute("ALTER TABLE orders ADD COLUMN updated_at TEXT")
+    conn.execute("ALTER TABLE products ADD COLUMN updated_at TEXT")
+
+# Store router
+# Every store has its own SQLite file under SHARD_DIR, so syncs of different stores
+# write in parallel and a question only ever reads its own store's rows. A shard is
+# opened on first use and brought to the current schema by running the migrations it
+# has not seen yet (tracked in PRAGMA user_version). An LRU keeps at most
+# MAX_OPEN_SHARDS shards open, each with its own pool of read-only connections.
+SHARD_DIR = Path(os.getenv("SHARD_DIR", DATA_DIR / "stores"))
+MAX_OPEN_SHARDS = int(os.getenv("MAX_OPEN_SHARDS", "64"))
+
+# Append only: a shard at version n has run the first n migrations
+SHARD_MIGRATIONS = [
+    init_store_db,
+    init_rollup_tables,
+    add_updated_at_columns,
+]
+
+def migrate_shard(conn: sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(SHARD_MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+
+class Shard:
+    def __init__(self, store_id: str, db_file: Path):
+        self.store_id = store_id
+        self.db_file = db_file
+        self.read_pool = ReadPool(db_file, READ_POOL_SIZE)
+
+    def close(self):
+        self.read_pool.close()
+
+class StoreRouter:
+    def __init__(self, shard_dir: Path, max_open: int):
+        self.shard_dir = shard_dir
+        self.max_open = max_open
+        self.shards = OrderedDict()   # store_id -> Shard, least recently used first
+        self.lock = threading.Lock()
+
+    def shard_file(self, store_id: str) -> Path:
+        # Readable and filesystem-safe, with a hash so distinct ids never share a file
+        safe = re.sub(r"[^A-Za-z0-9._-]", "_", store_id)[:64]
+        digest = hashlib.sha1(store_id.encode()).hexdigest()[:8]
+        return self.shard_dir / f"{safe}-{digest}.db"
+
+    def exists(self, store_id: str) -> bool:
+        return store_id in self.shards or self.shard_file(store_id).exists()
+
+    def get(self, store_id: str) -> Shard:
+        with self.lock:
+            shard = self.shards.get(store_id)
+            if shard is not None:
+                self.shards.move_to_end(store_id)
+                return shard
+
+            db_file = self.shard_file(store_id)
+            self.shard_dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(db_file)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                migrate_shard(conn)
+                apply_advised_indexes(conn)
+            finally:
+                conn.close()
+
+            shard = self.shards[store_id] = Shard(store_id, db_file)
+            while len(self.shards) > self.max_open:
+                _, evicted = self.shards.popitem(last=False)
+                evicted.close()
+            return shard
+
+    def close(self):
+        with self.lock:
+            for shard in self.shards.values():
+                shard.close()
+            self.shards.clear()
+
+STORE_ROUTER = StoreRouter(SHARD_DIR, MAX_OPEN_SHARDS)
+
+def store_db_file(store_id: str) -> Path:
+    return STORE_ROUTER.get(store_id).db_file
 
 # Cache DB
 LAST_SYNC = {}
-
-def should_sync(store_id, minutes=5):
+LAST_WEBHOOK = {}   # store_id -> when its last webhook arrived
+SYNC_INTERVAL_MINUTES = int(os.getenv("SYNC_INTERVAL_MINUTES", "5"))
+# Stores kept current by webhooks are only polled now and then, to catch missed deliveries
+RECONCILE_INTERVAL_MINUTES = int(os.getenv("RECONCILE_INTERVAL_MINUTES", "60"))
+
+def sync_interval_minutes(store_id) -> int:
+    last_webhook = LAST_WEBHOOK.get(store_id)
+    if last_webhook and datetime.utcnow() - last_webhook < timedelta(minutes=RECONCILE_INTERVAL_MINUTES):
+        return RECONCILE_INTERVAL_MINUTES
+    return SYNC_INTERVAL_MINUTES
+
+def should_sync(store_id, minutes=None):
     last = LAST_SYNC.get(store_id)
     if not last:
         return True
-    return datetime.utcnow() - last > timedelta(minutes=minutes)
+    return datetime.utcnow() - last > timedelta(minutes=minutes or sync_interval_minutes(store_id))
+
+# Incremental sync state (persisted so restarts neither re-crawl nor block questions)
+FULL_SYNC_INTERVAL_HOURS = int(os.getenv("FULL_SYNC_INTERVAL_HOURS", "24"))
+INCREMENTAL_RESOURCES = ("orders", "products")
+
+def load_sync_state(store_id: str) -> dict:
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute(
+        "SELECT resource, updated_at, synced_at FROM sync_state WHERE store_id = ?", (store_id,)
+    ).fetchall()
+    conn.close()
+    return {resource: {"updated_at": updated_at, "synced_at": synced_at} for resource, updated_at, synced_at in rows}
+
+def save_sync_state(store_id: str, resource: str, updated_at: str | None, synced_at: datetime):
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("""
+        INSERT INTO sync_state(store_id, resource, updated_at, synced_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(store_id, resource) DO UPDATE SET
+            updated_at=COALESCE(excluded.updated_at, sync_state.updated_at),
+            synced_at=excluded.synced_at
+    """, (store_id, resource, updated_at, synced_at.isoformat()))
+    conn.commit()
+    conn.close()
+
+def reset_sync_state(store_id: str):
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("DELETE FROM sync_state WHERE store_id = ?", (store_id,))
+    conn.commit()
+    conn.close()
+
+def sync_cursors(store_id: str, full: bool = False) -> dict:
+    # Empty cursors mean a full crawl: first sync, on demand, or the periodic reconciliation
+    # that also picks up inventory level changes (those don't bump a product's updatedAt)
+    if full:
+        return {}
+    state = load_sync_state(store_id)
+    last_full = state.get("full", {}).get("synced_at")
+    if not last_full or datetime.utcnow() - datetime.fromisoformat(last_full) > timedelta(hours=FULL_SYNC_INTERVAL_HOURS):
+        return {}
+    return {r: state[r]["updated_at"] for r in INCREMENTAL_RESOURCES if state.get(r, {}).get("updated_at")}
+
+def max_updated_at(raw_connection: dict, current: str | None = None) -> str | None:
+    # Shopify timestamps are ISO-8601 UTC strings, so they compare lexicographically
+    latest = current
+    for edge in raw_connection.get("edges", []):
+        updated_at = (edge.get("node") or {}).get("updatedAt")
+        if updated_at and (latest is None or updated_at > latest):
+            latest = updated_at
+    return latest
 
 # Static variables
 
@@ -181,11 +832,106 @@ db_schema = """
     updated_at TEXT,
     PRIMARY KEY (inventory_item_id, location_id)
     )
+
+    inventory_totals(
+        product_id TEXT,
+        variant_id TEXT PRIMARY KEY,
+        total_available INTEGER
+    )
+    -- available units per variant, summed over all locations
+
+    sales_daily(
+        day TEXT,
+        product_id TEXT,
+        variant_id TEXT,
+        vendor TEXT,
+        orders INTEGER,
+        units INTEGER,
+        revenue REAL,
+        PRIMARY KEY (day, product_id, variant_id)
+    )
+    -- one row per UTC day (YYYY-MM-DD) and variant sold: number of orders, units sold
+    -- and revenue (units * unit price)
+"""
+
+# Nested connections (line items, variants, inventory levels) start small and report
+# their pageInfo; the few parents that overflow are completed with follow-up queries
+# (see complete_orders_page / complete_products_page). Shared fields live in fragments.
+LINE_ITEM_FIELDS = """
+    fragment LineItemFields on LineItem {
+    id
+    quantity
+    originalUnitPriceSet {
+        shopMoney {
+        amount
+        }
+    }
+    product {
+        id
+    }
+    variant {
+        id
+        inventoryItem {
+        id
+        }
+    }
+    }
+    """
+
+INVENTORY_LEVEL_FIELDS = """
+    fragment InventoryLevelFields on InventoryLevel {
+    updatedAt
+    location {
+        id
+        name
+    }
+    quantities(names: ["available"]) {
+        name
+        quantity
+    }
+    }
+    """
+
+VARIANT_FIELDS = """
+    fragment VariantFields on ProductVariant {
+    id
+    sku
+    price
+    inventoryItem {
+        id
+        inventoryLevels(first: $levelsFirst) {
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+        edges {
+            node {
+            ...InventoryLevelFields
+            }
+        }
+        }
+    }
+    }
+    """ + INVENTORY_LEVEL_FIELDS
+
+# Rules for the SQL generating prompt (part of the SQL cache's schema version)
+SQL_RULES = """
+        Rules:
+        - Generate ONLY valid SQLite SQL
+        - SELECT queries only
+        - Use only the tables and columns provided
+        - Do NOT explain the query
+        - Do NOT include markdown
+        - Do NOT include comments
+        - If the question cannot be answered, return: INVALID
+        - use 'inventory_totals' to access inventory levels
+        - use 'sales_daily' for revenue, units sold and top sellers; use orders / order_items only for per-order detail
+        - if you are asked about product types, refer to product.title
 """
 
 # Orders query (fetch line items and customer)
 ORDERS_QUERY = """
-    query Orders($first: Int!, $after: String, $query: String) {
+    query Orders($first: Int!, $after: String, $query: String, $lineItemsFirst: Int!) {
     orders(first: $first, after: $after, query: $query) {
     pageInfo {
       hasNextPage
@@ -195,28 +941,18 @@ ORDERS_QUERY = """
       node {
         id
         createdAt
+        updatedAt
         customer {
           id
         }
-        lineItems(first: 50) {
+        lineItems(first: $lineItemsFirst) {
+          pageInfo {
+            hasNextPage
+            endCursor
+          }
           edges {
             node {
-              id
-              quantity
-              originalUnitPriceSet {
-                shopMoney {
-                  amount
-                }
-              }
-              product {
-                id
-              }
-              variant {
-                id
-                inventoryItem {
-                  id
-                }
-              }
+              ...LineItemFields
             }
           }
         }
@@ -224,12 +960,12 @@ ORDERS_QUERY = """
     }
     }
     }
-    """
+    """ + LINE_ITEM_FIELDS
 
 # Products query (includes variants and inventory levels)
 PRODUCTS_QUERY = """
-    query Products($first: Int!, $after: String) {
-    products(first: $first, after: $after) {
+    query Products($first: Int!, $after: String, $query: String, $variantsFirst: Int!, $levelsFirst: Int!) {
+    products(first: $first, after: $after, query: $query) {
         pageInfo {
         hasNextPage
         endCursor
@@ -241,30 +977,15 @@ PRODUCTS_QUERY = """
             vendor
             productType
             createdAt
-            variants(first: 50) {
+            updatedAt
+            variants(first: $variantsFirst) {
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
             edges {
                 node {
-                id
-                sku
-                price
-                inventoryItem {
-                    id
-                    inventoryLevels(first: 10) {
-                    edges {
-                        node {
-                        updatedAt
-                        location {
-                            id
-                            name
-                        }
-                        quantities(names: ["available"]) {
-                            name
-                            quantity
-                        }
-                        }
-                    }
-                    }
-                }
+                ...VariantFields
                 }
             }
             }
@@ -272,7 +993,62 @@ PRODUCTS_QUERY = """
         }
     }
     }
-    """
+    """ + VARIANT_FIELDS
+
+# Follow-up queries for parents whose nested connection overflowed
+ORDER_LINE_ITEMS_QUERY = """
+    query OrderLineItems($id: ID!, $first: Int!, $after: String) {
+    order(id: $id) {
+        lineItems(first: $first, after: $after) {
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+        edges {
+            node {
+            ...LineItemFields
+            }
+        }
+        }
+    }
+    }
+    """ + LINE_ITEM_FIELDS
+
+PRODUCT_VARIANTS_QUERY = """
+    query ProductVariants($id: ID!, $first: Int!, $after: String, $levelsFirst: Int!) {
+    product(id: $id) {
+        variants(first: $first, after: $after) {
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+        edges {
+            node {
+            ...VariantFields
+            }
+        }
+        }
+    }
+    }
+    """ + VARIANT_FIELDS
+
+INVENTORY_LEVELS_QUERY = """
+    query InventoryLevels($id: ID!, $first: Int!, $after: String) {
+    inventoryItem(id: $id) {
+        inventoryLevels(first: $first, after: $after) {
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+        edges {
+            node {
+            ...InventoryLevelFields
+            }
+        }
+        }
+    }
+    }
+    """ + INVENTORY_LEVEL_FIELDS
 
 # Shop query (single object)
 SHOP_QUERY = """
@@ -290,8 +1066,36 @@ SHOP_QUERY = """
 
 
 # Fetch data from shopify
-def fetch_shopify_graphql(store_id: str, token: str, query: str, variables: dict = None):
-    url = f"https://{store_id}/admin/api/2024-01/graphql.json"
+# Overridable so syncs can run against a local fake Shopify
+SHOPIFY_GRAPHQL_URL = os.getenv("SHOPIFY_GRAPHQL_URL", "https://{store_id}/admin/api/2024-01/graphql.json")
+SHOPIFY_TIMEOUT_SECONDS = float(os.getenv("SHOPIFY_TIMEOUT_SECONDS", "30"))
+SHOPIFY_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SHOPIFY_CONNECT_TIMEOUT_SECONDS", "10"))
+SHOPIFY_MAX_CONNECTIONS = int(os.getenv("SHOPIFY_MAX_CONNECTIONS", "10"))
+
+# Shopify's page and bulk-export JSON goes through orjson when it is installed
+json_loads = orjson.loads if orjson else json.loads
+
+# One pooled keep-alive client per store, so a sync pays for the TLS handshake once
+SHOPIFY_CLIENTS = {}
+
+def get_shopify_client(store_id: str) -> httpx.AsyncClient:
+    client = SHOPIFY_CLIENTS.get(store_id)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(SHOPIFY_TIMEOUT_SECONDS, connect=SHOPIFY_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=SHOPIFY_MAX_CONNECTIONS, max_keepalive_connections=SHOPIFY_MAX_CONNECTIONS),
+        )
+        SHOPIFY_CLIENTS[store_id] = client
+    return client
+
+async def close_shopify_clients():
+    clients = list(SHOPIFY_CLIENTS.values())
+    SHOPIFY_CLIENTS.clear()
+    await asyncio.gather(*(c.aclose() for c in clients))
+
+async def post_shopify_graphql(store_id: str, token: str, query: str, variables: dict = None):
+    # Raw request; callers go through fetch_shopify_graphql for throttling and retries
+    url = SHOPIFY_GRAPHQL_URL.format(store_id=store_id)
     headers = {
         "X-Shopify-Access-Token": token,
         "Content-Type": "application/json"
@@ -300,78 +1104,348 @@ def fetch_shopify_graphql(store_id: str, token: str, query: str, variables: dict
     if variables:
         payload["variables"] = variables
 
-    r = requests.post(url, headers=headers, json=payload)
+    try:
+        r = await get_shopify_client(store_id).post(url, headers=headers, json=payload)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Shopify GraphQL API timed out")
+    if r.status_code == 429:
+        raise HTTPException(status_code=429, detail="Shopify GraphQL API rate limited", headers={"Retry-After": r.headers.get("Retry-After", "1")})
     if r.status_code != 200:
         raise HTTPException(status_code=401, detail=f"Shopify GraphQL API error: {r.text}")
-    return r.json()
+    return json_loads(r.content)
+
+# Cost-aware throttling
+# Shopify meters GraphQL with a leaky bucket per store. Every response reports the
+# bucket (extensions.cost.throttleStatus) and what the query cost; the governor mirrors
+# the bucket locally, paces requests so they never exceed it, and sizes pages so each
+# one costs about as much as the bucket can afford.
+MAX_QUERY_COST = 1000           # Shopify rejects single queries above this cost
+MAX_PAGE_SIZE = 250
+THROTTLE_MAX_RETRIES = int(os.getenv("THROTTLE_MAX_RETRIES", "8"))
+PAGE_BUCKET_SHARE = float(os.getenv("PAGE_BUCKET_SHARE", "0.5"))   # leaves room for the other resource's pages
+
+def cost_key(query: str, variables: dict = None) -> tuple:
+    # A query's cost per outer node depends on its nested page sizes (lineItemsFirst,
+    # variantsFirst, ...), so costs are learned per query and nested sizes
+    neutral = ("first", "after", "id", "query")
+    return (query, tuple(sorted((k, v) for k, v in (variables or {}).items() if k not in neutral)))
+
+class ThrottleGovernor:
+    def __init__(self):
+        self.maximum = 1000.0
+        self.available = 1000.0
+        self.restore_rate = 50.0
+        self.updated = time.monotonic()
+        self.node_cost = {}   # cost_key -> requested cost per outer node, learned from responses
+        self.in_flight = {}   # reservation number -> cost reserved by a request still in flight
+        self.sent = 0
+        self.probes = {}      # cost_key -> event set when the probe for its unknown cost returns
+        self.recorded = asyncio.Event()   # set by every response, which may change the limits
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.maximum, self.available + (now - self.updated) * self.restore_rate)
+        self.updated = now
+
+    def estimate(self, key: tuple, first: int | None) -> float:
+        per_node = self.node_cost.get(key)
+        if per_node is None:
+            return 0.0  # unknown until its probe returns
+        return per_node * (first or 1) + 1
+
+    def page_size(self, key: tuple, default: int) -> int:
+        per_node = self.node_cost.get(key)
+        if per_node is None:
+            return default
+        budget = min(MAX_QUERY_COST, self.maximum * PAGE_BUCKET_SHARE) - 1
+        return max(1, min(MAX_PAGE_SIZE, int(budget // per_node)))
+
+    async def wait_for_cost(self, key: tuple) -> bool:
+        # True when the caller has to probe the cost of this query shape: the first
+        # request of an unknown shape is the probe, the others wait for its response
+        while key not in self.node_cost:
+            event = self.probes.get(key)
+            if event is None:
+                self.probes[key] = asyncio.Event()
+                return True
+            await event.wait()
+        return False
 
-def fetch_all_graphql(store_id: str, token: str, query: str, variables: dict = None, data_path: list = None):
-    combined = []
-    after = None
+    async def acquire(self, key: tuple, first: int | None, probe: bool) -> int:
+        # Reserves the request's estimated cost (for a probe, the most any query may
+        # cost), sleeping until the bucket has restored enough; returns the reservation
+        # number for record() and release()
+        cost = min(MAX_QUERY_COST, self.maximum) if probe else self.estimate(key, first)
+        async with self.lock:
+            self._refill()
+            # Responses arriving meanwhile may change the figures (the first one replaces the
+            # standard plan's defaults with the store's own), so check again after each
+            while min(cost, self.maximum) > self.available:
+                self.recorded.clear()
+                try:
+                    await asyncio.wait_for(self.recorded.wait(), (min(cost, self.maximum) - self.available) / self.restore_rate)
+                except asyncio.TimeoutError:
+                    pass
+                self._refill()
+            self.available -= cost
+            self.sent += 1
+            self.in_flight[self.sent] = cost
+        return self.sent
+
+    def release(self, key: tuple, reservation: int | None, probe: bool):
+        # Called once per wait_for_cost, whether the request was sent and succeeded or not
+        self.in_flight.pop(reservation, None)
+        if probe:
+            self.probes.pop(key).set()
+
+    def record(self, key: tuple, first: int | None, response: dict, reservation: int):
+        # The local bucket is charged what the query actually cost (nothing when it was
+        # throttled). Once the store's bucket size is known the server's figure can only
+        # lower it: responses come back in any order, and any of the other requests in
+        # flight may or may not be charged in it, so all of their reservations are
+        # subtracted from it.
+        cost = (response.get("extensions") or {}).get("cost") or {}
+        throttle = cost.get("throttleStatus") or {}
+        self._refill()
+        if is_throttled(response):
+            charged = 0.0
+        else:
+            charged = cost.get("actualQueryCost")
+            charged = float(charged if charged is not None else cost.get("requestedQueryCost") or 0)
+        self.available += self.in_flight.get(reservation, 0.0) - charged
+        if throttle:
+            maximum = float(throttle.get("maximumAvailable", self.maximum))
+            others = sum(c for r, c in self.in_flight.items() if r != reservation)
+            reported = float(throttle.get("currentlyAvailable", self.available)) - others
+            # Until the first response the figures are the standard plan's defaults
+            self.available = reported if maximum != self.maximum else min(self.available, reported)
+            self.maximum = maximum
+            self.restore_rate = float(throttle.get("restoreRate", self.restore_rate)) or 1.0
+        if cost.get("requestedQueryCost") is not None:
+            self.node_cost[key] = max(float(cost["requestedQueryCost"]) - 1, 1.0) / (first or 1)
+        self.recorded.set()
+
+    def retry_delay(self, key: tuple, first: int | None) -> float:
+        self._refill()
+        needed = self.estimate(key, first) or self.maximum * 0.1
+        return max((needed - self.available) / self.restore_rate, 1.0 / self.restore_rate)
+
+THROTTLE_GOVERNORS = {}
+
+def get_throttle_governor(store_id: str) -> ThrottleGovernor:
+    return THROTTLE_GOVERNORS.setdefault(store_id, ThrottleGovernor())
+
+def query_name(query: str) -> str:
+    match = re.search(r"\b(?:query|mutation)\s+(\w+)", query)
+    return match.group(1) if match else "anonymous"
+
+def is_throttled(response: dict) -> bool:
+    return any((e.get("extensions") or {}).get("code") == "THROTTLED" for e in response.get("errors") or [])
+
+async def fetch_shopify_graphql(store_id: str, token: str, query: str, variables: dict = None):
+    # Paced by the store's governor; throttled requests are retried, any other GraphQL
+    # error fails the request instead of silently returning partial data
+    governor = get_throttle_governor(store_id)
+    first = (variables or {}).get("first")
+    key = cost_key(query, variables)
+    name = query_name(query)
+    for attempt in range(THROTTLE_MAX_RETRIES + 1):
+        probe = await governor.wait_for_cost(key)
+        reservation, error = None, None
+        try:
+            if first:
+                # A probe asks for a single node; once the cost is known no page asks for
+                # more than the bucket can afford
+                first = 1 if probe else min(first, governor.page_size(key, first))
+                variables = {**variables, "first": first}
+            reservation = await governor.acquire(key, first, probe)
+            started = time.perf_counter()
+            response = await post_shopify_graphql(store_id, token, query, variables)
+            governor.record(key, first, response, reservation)
+        except HTTPException as e:
+            error = e
+        finally:
+            governor.release(key, reservation, probe)
+        if error is not None:
+            SHOPIFY_REQUESTS.inc(query=name, outcome=str(error.status_code))
+            if error.status_code != 429 or attempt == THROTTLE_MAX_RETRIES:
+                raise error
+            await asyncio.sleep(float(error.headers.get("Retry-After", "1")))
+            continue
 
-    while True:
+        SHOPIFY_SECONDS.observe(time.perf_counter() - started, query=name)
+        SHOPIFY_REQUESTS.inc(query=name, outcome="throttled" if is_throttled(response) else "ok")
+        if not is_throttled(response):
+            if "errors" in response:
+                raise HTTPException(status_code=502, detail=f"Shopify GraphQL errors: {response['errors']}")
+            return response
+        if attempt < THROTTLE_MAX_RETRIES:
+            if first:
+                # The page may simply be too expensive for the bucket: re-size it from the
+                # cost Shopify just reported before waiting for the bucket to refill
+                first = min(first, governor.page_size(key, first))
+                variables = {**variables, "first": first}
+            await asyncio.sleep(governor.retry_delay(key, first))
+    raise HTTPException(status_code=503, detail="Shopify GraphQL API kept throttling the sync")
+
+async def iter_graphql_pages(store_id: str, token: str, query: str, variables: dict = None, data_path: list = None):
+    # The next page is requested before the current one is handed out, so Shopify
+    # latency overlaps with normalizing and writing the current page
+    governor = get_throttle_governor(store_id)
+
+    def fetch_page(after):
         vars_copy = variables.copy() if variables else {}
         if after:
             vars_copy["after"] = after
+        if "first" in vars_copy:
+            # Page size follows the learned cost per node (the given first is the initial guess)
+            vars_copy["first"] = governor.page_size(cost_key(query, vars_copy), vars_copy["first"])
+        return asyncio.create_task(fetch_shopify_graphql(store_id, token, query, vars_copy))
 
-        response = fetch_shopify_graphql(store_id, token, query, vars_copy)
-
-        if "errors" in response:
-            print("GraphQL errors:", response["errors"])
-            break
-
-        data = response.get("data", {})
-        if data_path:
-            for key in data_path:
-                if key not in data:
-                    print(f"Key missing in response: {key}")
-                    data = {}
-                    break
-                data = data.get(key, {})
-
-        edges = data.get("edges", [])
-        combined.extend(edges)
-
-        page_info = data.get("pageInfo", {})
-        if page_info.get("hasNextPage"):
-            after = page_info.get("endCursor")
-        else:
-            break
-
-    return {"edges": combined}
-
-def build_time_filter(days: int):
-    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
-    return {"created_at_min": since}
-
-def ingest_shopify_data(store_id: str, token: str, createdAtMin=None):
-    raw_data = {}
-
-    # Orders
-    variables = {"first": 50}
+    pending = fetch_page(None)
+    try:
+        while pending:
+            response = await pending
+            pending = None
+
+            data = response.get("data", {})
+            for key in data_path or []:
+                if not isinstance(data, dict) or key not in data:
+                    # An empty page here would end the sync as if the store had no more rows
+                    raise HTTPException(
+                        status_code=502,
+                        detail=f"Shopify response to {query_name(query)} has no {'.'.join(data_path)}",
+                    )
+                data = data[key]
+
+            page_info = data.get("pageInfo", {})
+            if page_info.get("hasNextPage"):
+                pending = fetch_page(page_info.get("endCursor"))
+
+            SHOPIFY_PAGES.inc(query=query_name(query))
+            yield data.get("edges", [])
+    finally:
+        if pending:
+            pending.cancel()
+
+def build_search_query(createdAtMin=None, updatedAtMin=None):
+    filters = []
     if createdAtMin:
-        variables["query"] = f"created_at:>={createdAtMin}"
-    raw_data["orders"] = fetch_all_graphql(
-        store_id, token, ORDERS_QUERY, variables, data_path=["orders"]
-    )
-
-    # Products (variants include inventoryItem.id)
-    raw_data["products"] = fetch_all_graphql(
-        store_id, token, PRODUCTS_QUERY, {"first": 50}, data_path=["products"]
-    )
-
-    # Shop (single object, no pagination)
-    raw_shop = fetch_shopify_graphql(store_id, token, SHOP_QUERY)
-    raw_data["shop"] = raw_shop.get("data", {})
-
-    return raw_data
+        filters.append(f"created_at:>={createdAtMin}")
+    if updatedAtMin:
+        filters.append(f"updated_at:>='{updatedAtMin}'")
+    return " AND ".join(filters) or None
+
+def orders_variables(cursors: dict, createdAtMin=None) -> dict:
+    variables = {"first": 50, "lineItemsFirst": NESTED_FIRST["lineItemsFirst"]}
+    search = build_search_query(createdAtMin, cursors.get("orders"))
+    if search:
+        variables["query"] = search
+    return variables
+
+def products_variables(cursors: dict) -> dict:
+    variables = {"first": 50, "variantsFirst": NESTED_FIRST["variantsFirst"], "levelsFirst": NESTED_FIRST["levelsFirst"]}
+    search = build_search_query(updatedAtMin=cursors.get("products"))
+    if search:
+        variables["query"] = search
+    return variables
+
+async def gather_or_cancel(*coros):
+    # Like asyncio.gather, but the first failure cancels the remaining coroutines
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+# Nested connection sizes: the initial size per page and the cap it may grow to when
+# many parents of a page overflow it
+NESTED_FIRST = {
+    "lineItemsFirst": int(os.getenv("LINE_ITEMS_FIRST", "10")),
+    "variantsFirst": int(os.getenv("VARIANTS_FIRST", "10")),
+    "levelsFirst": int(os.getenv("INVENTORY_LEVELS_FIRST", "5")),
+}
+NESTED_FIRST_MAX = {"lineItemsFirst": 100, "variantsFirst": 100, "levelsFirst": 50}
+NESTED_GROW_RATIO = 0.25
+FOLLOW_UP_FIRST = 100
+
+def grow_nested_first(variables: dict, key: str, overflowing: int, parents: int):
+    # Follow-ups are cheap for a few parents; when many overflow, larger nested pages are cheaper
+    if parents and overflowing > parents * NESTED_GROW_RATIO:
+        variables[key] = min(NESTED_FIRST_MAX[key], variables[key] * 2)
+
+async def complete_connection(store_id: str, token: str, query: str, variables: dict, data_path: list, connection: dict):
+    # Appends the remaining pages of a nested connection to it, in place
+    page_info = connection.get("pageInfo") or {}
+    if not page_info.get("hasNextPage"):
+        return
+    variables = {**variables, "first": FOLLOW_UP_FIRST, "after": page_info.get("endCursor")}
+    async for edges in iter_graphql_pages(store_id, token, query, variables, data_path):
+        connection["edges"].extend(edges)
+    connection["pageInfo"] = {"hasNextPage": False}
+
+async def complete_orders_page(store_id: str, token: str, variables: dict, edges: list):
+    overflowing = [
+        e["node"] for e in edges
+        if e.get("node") and (e["node"].get("lineItems", {}).get("pageInfo") or {}).get("hasNextPage")
+    ]
+    await gather_or_cancel(*(
+        complete_connection(store_id, token, ORDER_LINE_ITEMS_QUERY, {"id": o["id"]}, ["order", "lineItems"], o["lineItems"])
+        for o in overflowing
+    ))
+    grow_nested_first(variables, "lineItemsFirst", len(overflowing), len(edges))
+
+async def complete_products_page(store_id: str, token: str, variables: dict, edges: list):
+    products = [e["node"] for e in edges if e.get("node")]
+    overflowing = [p for p in products if (p.get("variants", {}).get("pageInfo") or {}).get("hasNextPage")]
+    await gather_or_cancel(*(
+        complete_connection(
+            store_id, token, PRODUCT_VARIANTS_QUERY, {"id": p["id"], "levelsFirst": variables["levelsFirst"]},
+            ["product", "variants"], p["variants"],
+        )
+        for p in overflowing
+    ))
+    grow_nested_first(variables, "variantsFirst", len(overflowing), len(products))
+
+    # Inventory levels of every variant, including the ones fetched just above
+    items = [
+        v_edge["node"]["inventoryItem"]
+        for p in products for v_edge in p.get("variants", {}).get("edges", [])
+        if (v_edge.get("node") or {}).get("inventoryItem")
+    ]
+    overflowing = [i for i in items if (i.get("inventoryLevels", {}).get("pageInfo") or {}).get("hasNextPage")]
+    await gather_or_cancel(*(
+        complete_connection(store_id, token, INVENTORY_LEVELS_QUERY, {"id": i["id"]}, ["inventoryItem", "inventoryLevels"], i["inventoryLevels"])
+        for i in overflowing
+    ))
+    grow_nested_first(variables, "levelsFirst", len(overflowing), len(items))
 
 # Normalize the raw data
+# Rows are built as tuples in their table's UPSERT_SQL column order, which BulkWriter
+# binds as they are; order_id / product_id are each tuple's first field.
 
 def strip_gid(gid: str | None):
     if not gid:
         return None
-    return gid.split("/")[-1]
+    return gid.rpartition("/")[2]
+
+# The products, variants, customers and locations rows refer to recur on every page;
+# a plain dict, emptied when full, is cheaper per hit than an LRU
+GID_CACHE = {}
+GID_CACHE_SIZE = 100_000
+
+def ref_gid(gid: str | None):
+    try:
+        return GID_CACHE[gid]
+    except KeyError:
+        if len(GID_CACHE) >= GID_CACHE_SIZE:
+            GID_CACHE.clear()
+        stripped = GID_CACHE[gid] = strip_gid(gid)
+        return stripped
 
 
 def normalize_shop(raw_shop):
@@ -388,36 +1462,73 @@ def normalize_shop(raw_shop):
     }
 
 
+# Row builders shared by the paginated (nested edges) and bulk (flat JSONL) parsers
+def order_row(o):
+    # (order_id, created_at, customer_id, updated_at)
+    customer = o.get("customer")
+    return (
+        strip_gid(o.get("id")),
+        o.get("createdAt"),
+        ref_gid(customer.get("id")) if customer else None,
+        o.get("updatedAt"),
+    )
+
+
+def order_item_row(order_id, li):
+    # (order_id, product_id, variant_id, quantity, price)
+    product = li.get("product")
+    variant = li.get("variant")
+    money = (li.get("originalUnitPriceSet") or {}).get("shopMoney") or {}
+    return (
+        order_id,
+        ref_gid(product.get("id")) if product else None,
+        ref_gid(variant.get("id")) if variant else None,
+        int(li.get("quantity", 0)),
+        float(money.get("amount", 0)),
+    )
+
+
+def product_row(p):
+    # (product_id, title, vendor, product_type, created_at, updated_at)
+    return (
+        strip_gid(p.get("id")), p.get("title"), p.get("vendor"), p.get("productType"), p.get("createdAt"),
+        p.get("updatedAt"),
+    )
+
+
+def variant_row(product_id, v, inventory_item_id):
+    # (variant_id, product_id, sku, price, inventory_item_id); sku may be None
+    return (strip_gid(v.get("id")), product_id, v.get("sku"), float(v.get("price", 0)), inventory_item_id)
+
+
+def inventory_row(inventory_item_id, il):
+    # (inventory_item_id, location_id, available, updated_at)
+    available_qty = 0
+    for q in il.get("quantities") or ():
+        if q.get("name") == "available":
+            available_qty = int(q.get("quantity", 0))
+
+    return (inventory_item_id, ref_gid((il.get("location") or {}).get("id")), available_qty, il.get("updatedAt"))
+
+
 def normalize_orders(raw_orders):
     orders = []
     order_items = []
+    add_order, add_item = orders.append, order_items.append
 
-    for edge in raw_orders.get("edges", []):
+    for edge in raw_orders.get("edges", ()):
         o = edge.get("node")
         if not o:
             continue
 
-        order_id = strip_gid(o.get("id"))
-        orders.append({
-            "order_id": order_id,
-            "created_at": o.get("createdAt"),
-            "customer_id": strip_gid(o.get("customer", {}).get("id")) if o.get("customer") else None
-        })
+        order = order_row(o)
+        add_order(order)
 
-        for li_edge in o.get("lineItems", {}).get("edges", []):
+        order_id = order[0]
+        for li_edge in (o.get("lineItems") or {}).get("edges", ()):
             li = li_edge.get("node")
-            if not li:
-                continue
-
-            price = float(li.get("originalUnitPriceSet", {}).get("shopMoney", {}).get("amount", 0))
-
-            order_items.append({
-                "order_id": order_id,
-                "product_id": strip_gid(li.get("product", {}).get("id")) if li.get("product") else None,
-                "variant_id": strip_gid(li.get("variant", {}).get("id")) if li.get("variant") else None,
-                "quantity": int(li.get("quantity", 0)),
-                "price": price
-            })
+            if li:
+                add_item(order_item_row(order_id, li))
 
     return {"orders": orders, "order_items": order_items}
 
@@ -426,25 +1537,20 @@ def normalize_products(raw_products):
     products = []
     variants = []
     inventory = []
+    add_variant, add_level = variants.append, inventory.append
 
-    for edge in raw_products.get("edges", []):
+    for edge in raw_products.get("edges", ()):
         p = edge.get("node")
         if not p:
             continue
 
-        product_id = strip_gid(p.get("id"))
-
         # Product
-        products.append({
-            "product_id": product_id,
-            "title": p.get("title"),
-            "vendor": p.get("vendor"),
-            "product_type": p.get("productType"),
-            "created_at": p.get("createdAt")
-        })
+        product = product_row(p)
+        products.append(product)
+        product_id = product[0]
 
         # Variants + Inventory
-        for v_edge in p.get("variants", {}).get("edges", []):
+        for v_edge in (p.get("variants") or {}).get("edges", ()):
             v = v_edge.get("node")
             if not v:
                 continue
@@ -454,155 +1560,1057 @@ def normalize_products(raw_products):
             if not inventory_item_id:
                 continue
             # Variant
-            variants.append({
-                "variant_id": strip_gid(v.get("id")),
-                "product_id": product_id,
-                "sku": v.get("sku"),  # may be None
-                "price": float(v.get("price", 0)),
-                "inventory_item_id": inventory_item_id
-            })
-            
+            add_variant(variant_row(product_id, v, inventory_item_id))
 
             # Inventory per location
-            for il_edge in inventory_item.get("inventoryLevels", {}).get("edges", []):
-                il = il_edge.get("node", {})
+            for il_edge in (inventory_item.get("inventoryLevels") or {}).get("edges", ()):
+                add_level(inventory_row(inventory_item_id, il_edge.get("node") or {}))
 
-                location = il.get("location", {})
-                location_id = strip_gid(location.get("id"))
+    return {"products": products, "variants": variants, "inventory": inventory}
 
-                qty_list = il.get("quantities", [])
-                available_qty = 0
+# Insert / Upsert Functions for Database
+# Every sync goes through one BulkWriter: a single connection and transaction, rows
+# written with chunked executemany instead of one execute + commit per row. Upserts
+# skip rows that are unchanged, so the writer can tell which tables really changed.
+UPSERT_SQL = {
+    "shop": (("shop_id", "name", "currency", "timezone", "created_at"), """
+        INSERT INTO shop(shop_id, name, currency, timezone, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(shop_id) DO UPDATE SET
+            name=excluded.name,
+            currency=excluded.currency,
+            timezone=excluded.timezone,
+            created_at=excluded.created_at
+        WHERE (name, currency, timezone, created_at)
+            IS NOT (excluded.name, excluded.currency, excluded.timezone, excluded.created_at)
+    """),
+    "orders": (("order_id", "created_at", "customer_id", "updated_at"), """
+        INSERT INTO orders(order_id, created_at, customer_id, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(order_id) DO UPDATE SET
+            created_at=excluded.created_at,
+            customer_id=excluded.customer_id,
+            updated_at=excluded.updated_at
+        WHERE (created_at, customer_id, updated_at)
+            IS NOT (excluded.created_at, excluded.customer_id, excluded.updated_at)
+            AND ifnull(excluded.updated_at >= updated_at, 1)
+    """),
+    "order_items": (("order_id", "product_id", "variant_id", "quantity", "price"), """
+        INSERT INTO order_items(order_id, product_id, variant_id, quantity, price)
+        VALUES (?, ?, ?, ?, ?)
+    """),
+    "products": (("product_id", "title", "vendor", "product_type", "created_at", "updated_at"), """
+        INSERT INTO products(product_id, title, vendor, product_type, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(product_id) DO UPDATE SET
+            title=excluded.title,
+            vendor=excluded.vendor,
+            product_type=excluded.product_type,
+            created_at=excluded.created_at,
+            updated_at=excluded.updated_at
+        WHERE (title, vendor, product_type, created_at, updated_at)
+            IS NOT (excluded.title, excluded.vendor, excluded.product_type, excluded.created_at, excluded.updated_at)
+            AND ifnull(excluded.updated_at >= updated_at, 1)
+    """),
+    "variants": (("variant_id", "product_id", "sku", "price", "inventory_item_id"), """
+        INSERT INTO variants(variant_id, product_id, sku, price, inventory_item_id)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(variant_id) DO UPDATE SET
+            product_id=excluded.product_id,
+            sku=excluded.sku,
+            price=excluded.price,
+            inventory_item_id=excluded.inventory_item_id
+        WHERE (product_id, sku, price, inventory_item_id)
+            IS NOT (excluded.product_id, excluded.sku, excluded.price, excluded.inventory_item_id)
+    """),
+    "inventory": (("inventory_item_id", "location_id", "available", "updated_at"), """
+        INSERT INTO inventory(inventory_item_id, location_id, available, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(inventory_item_id, location_id) DO UPDATE SET
+            available=excluded.available,
+            updated_at=excluded.updated_at
+        WHERE (available, updated_at) IS NOT (excluded.available, excluded.updated_at)
+            AND ifnull(excluded.updated_at >= updated_at, 1)
+    """),
+}
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "5000"))
+
+class BulkWriter:
+    def __init__(self, db_file: Path, chunk_size: int = BULK_CHUNK_SIZE):
+        self.db_file = db_file
+        self.chunk_size = chunk_size
+        self.conn = None
+        self.rows = {}
+        self.rows_changed = {}
+        self.changed = {"orders": set(), "products": set(), "variants": set(), "inventory": set(), "days": set()}
+        self.started = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        # Async syncs drive the writer from worker threads, one call at a time
+        self.conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+        # Load-time pragmas: WAL (persistent) and a relaxed fsync policy for this connection
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA cache_size=-65536")
+        self.started = time.monotonic()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self
+
+    def refresh_rollups(self):
+        refresh_rollups(self.conn, self.changed)
+        for keys in self.changed.values():
+            keys.clear()
+
+    def commit(self):
+        # A writer whose store lease was lost raises here; closing the connection then
+        # rolls the open transaction back
+        check_lease()
+        self.conn.execute("COMMIT")
+
+    def checkpoint(self):
+        # Commit what has been written so far (making it queryable) and keep loading
+        self.refresh_rollups()
+        self.commit()
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.refresh_rollups()
+                self.commit()
+            else:
+                self.conn.execute("ROLLBACK")
+        finally:
+            self.elapsed = time.monotonic() - self.started
+            self.conn.close()
+            self.conn = None
+        if exc_type is None:
+            for table, n in self.rows.items():
+                ROWS_UPSERTED.inc(n, table=table)
+            for table, n in self.rows_changed.items():
+                ROWS_CHANGED.inc(n, table=table)
+            count_for_request("rows_upserted", sum(self.rows.values()))
+
+    async def __aenter__(self):
+        return await asyncio.to_thread(self.__enter__)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.to_thread(self.__exit__, exc_type, exc, tb)
+
+    def write(self, table: str, rows: list):
+        # Rows are tuples in the table's column order, as the row builders emit them;
+        # dicts keyed by column name are accepted too
+        if not rows:
+            return
+        columns, sql = UPSERT_SQL[table]
+        if isinstance(rows[0], dict):
+            rows = list(map(itemgetter(*columns), rows))
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            if table == "orders":
+                # An order whose created_at moved leaves its old day's sales to re-aggregate
+                create_temp_keys(self.conn, "written_orders", [t[0] for t in chunk])
+                self.changed["days"].update(day for day, in self.conn.execute("""
+                    SELECT substr(created_at, 1, 10) FROM orders WHERE order_id IN (SELECT key FROM temp.written_orders)
+                """))
+            before = self.conn.total_changes
+            self.conn.executemany(sql, chunk)
+            self.rows_changed[table] = self.rows_changed.get(table, 0) + self.conn.total_changes - before
+            if table in self.changed:
+                # Rollups are keyed by each table's first column
+                self.changed[table].update(t[0] for t in chunk)
+            elif table == "order_items":
+                # A bulk chunk can carry line items of an order written in an earlier chunk
+                self.changed["orders"].update(t[0] for t in chunk)
+        self.rows[table] = self.rows.get(table, 0) + len(rows)
+
+    def replace_order_items(self, orders: list, items: list):
+        # orders are the order rows just written. An order whose upsert lost to a newer
+        # stored row (a page fetched before a later orders/updated webhook) keeps its items:
+        # the row then still holds the newer updated_at.
+        stored = self.stored_updated_at("orders", [o[0] for o in orders])
+        outdated = {o[0] for o in orders if stored.get(o[0]) != o[-1]}
+        # order_items has no key, so each written order's line items are compared as a
+        # whole with the stored ones and replaced only when they differ; re-fetching an
+        # unchanged order (every incremental sync re-reads its boundary order) changes nothing
+        # order_id -> {item tuple: count}
+        new = {o[0]: {} for o in orders if o[0] not in outdated}
+        for item in items:
+            if item[0] in outdated:
+                continue
+            order_items = new.setdefault(item[0], {})
+            order_items[item] = order_items.get(item, 0) + 1
+        stored = {}
+        for start in range(0, len(new), self.chunk_size):
+            create_temp_keys(self.conn, "written_orders", list(new)[start:start + self.chunk_size])
+            for row in self.conn.execute("""
+                SELECT order_id, product_id, variant_id, quantity, price FROM order_items
+                WHERE order_id IN (SELECT key FROM temp.written_orders)
+            """):
+                order_items = stored.setdefault(row[0], {})
+                order_items[row] = order_items.get(row, 0) + 1
+        differing = [order_id for order_id, order_items in new.items() if stored.get(order_id, {}) != order_items]
+
+        ids = [(order_id,) for order_id in differing]
+        before = self.conn.total_changes
+        for start in range(0, len(ids), self.chunk_size):
+            self.conn.executemany("DELETE FROM order_items WHERE order_id = ?", ids[start:start + self.chunk_size])
+        self.rows_changed["order_items"] = self.rows_changed.get("order_items", 0) + self.conn.total_changes - before
+        self.write("order_items", [item for order_id in differing for item, n in new[order_id].items() for _ in range(n)])
+
+    def stored_updated_at(self, table: str, keys) -> dict:
+        # key -> updated_at of the given orders / products as currently stored
+        key = UPSERT_SQL[table][0][0]
+        keys = list(keys)
+        stored = {}
+        for start in range(0, len(keys), self.chunk_size):
+            create_temp_keys(self.conn, "stored_keys", keys[start:start + self.chunk_size])
+            stored.update(self.conn.execute(
+                f"SELECT {key}, updated_at FROM {table} WHERE {key} IN (SELECT key FROM temp.stored_keys)"
+            ))
+        return stored
+
+    def stats(self) -> dict:
+        total = sum(self.rows.values())
+        elapsed = self.elapsed or (time.monotonic() - self.started)
+        return {
+            "rows_written": total,
+            "rows_by_table": dict(self.rows),
+            "rows_changed_by_table": dict(self.rows_changed),
+            "seconds": round(elapsed, 3),
+            "rows_per_s": round(total / elapsed) if elapsed else None,
+        }
 
-                for q in qty_list:
-                    if q.get("name") == "available":
-                        available_qty = int(q.get("quantity", 0))
+# Streaming ingestion: fetch a page, normalize it, upsert it, release it
+# Producers (one per resource, running concurrently) put raw pages on a small bounded
+# queue; a single consumer normalizes and writes them in a worker thread, so the
+# writer's connection is never used concurrently and memory stays at a few pages.
+PIPELINE_QUEUE_PAGES = int(os.getenv("PIPELINE_QUEUE_PAGES", "4"))
+
+def load_orders_page(w: BulkWriter, edges: list, state: dict):
+    page = {"edges": edges}
+    normalized_orders = normalize_orders(page)
+    w.write("orders", normalized_orders["orders"])
+    w.replace_order_items(normalized_orders["orders"], normalized_orders["order_items"])
+    w.checkpoint()
+    state["orders"] = max_updated_at(page, state.get("orders"))
+
+def load_products_page(w: BulkWriter, edges: list, state: dict):
+    page = {"edges": edges}
+    normalized_products = normalize_products(page)
+    w.write("products", normalized_products["products"])
+    w.write("variants", normalized_products["variants"])
+    w.write("inventory", normalized_products["inventory"])
+    w.checkpoint()
+    state["products"] = max_updated_at(page, state.get("products"))
+
+def load_shop(w: BulkWriter, raw_shop: dict, state: dict):
+    shop = normalize_shop(raw_shop)
+    if shop:
+        w.write("shop", [shop])
+
+async def run_ingest_pipeline(w: BulkWriter, producers: list) -> dict:
+    # producers are async generators of (loader, payload); returns the loaders' shared
+    # state, which holds the updated_at high-water mark per resource
+    queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_PAGES)
+    done = object()
+    state = {}
+
+    async def produce(items):
+        async for item in items:
+            await queue.put(item)
+
+    async def produce_all():
+        try:
+            await gather_or_cancel(*(produce(p) for p in producers))
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(done)
 
-                inventory.append({
-                    "inventory_item_id": inventory_item_id,
-                    "location_id": location_id,
-                    "available": available_qty,
-                    "updated_at": il.get("updatedAt")
-                })
+    feeder = asyncio.create_task(produce_all())
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            loader, payload = item
+            await asyncio.to_thread(loader, w, payload, state)
+    finally:
+        feeder.cancel()
+        await asyncio.gather(feeder, return_exceptions=True)
+    return state
+
+async def graphql_pages(loader, complete, store_id: str, token: str, query: str, variables: dict, data_path: list):
+    # complete fills in overflowing nested connections before the page is handed on; it
+    # may also grow the nested sizes in variables for the pages that follow
+    async for edges in iter_graphql_pages(store_id, token, query, variables, data_path):
+        await complete(store_id, token, variables, edges)
+        yield loader, edges
+
+async def shop_object(store_id: str, token: str):
+    response = await fetch_shopify_graphql(store_id, token, SHOP_QUERY)
+    yield load_shop, response.get("data", {})
+
+async def ingest_and_store(store_id: str, token: str, cursors: dict = None, createdAtMin=None):
+    # Returns the writer stats and the updated_at high-water mark seen per resource.
+    # Each page is committed on its own, so the first rows are queryable before the crawl ends.
+    cursors = cursors or {}
+    async with BulkWriter(await asyncio.to_thread(store_db_file, store_id)) as w:
+        state = await run_ingest_pipeline(w, [
+            graphql_pages(load_orders_page, complete_orders_page, store_id, token, ORDERS_QUERY, orders_variables(cursors, createdAtMin), ["orders"]),
+            graphql_pages(load_products_page, complete_products_page, store_id, token, PRODUCTS_QUERY, products_variables(cursors), ["products"]),
+            shop_object(store_id, token),
+        ])
+    return w.stats(), {r: state.get(r) for r in INCREMENTAL_RESOURCES}
+
+# Bulk Operations ingestion: one bulkOperationRunQuery per resource instead of
+# cursor pagination, with the JSONL result stream-parsed straight into the writer
+BULK_POLL_SECONDS = float(os.getenv("BULK_POLL_SECONDS", "2"))
+BULK_TIMEOUT_SECONDS = int(os.getenv("BULK_TIMEOUT_SECONDS", "3600"))
+BULK_RUN_MUTATION = """
+    mutation BulkRun($query: String!) {
+    bulkOperationRunQuery(query: $query) {
+        bulkOperation {
+        id
+        status
+        }
+        userErrors {
+        field
+        message
+        }
+    }
+    }
+    """
 
+BULK_STATUS_QUERY = """
+    query BulkStatus($id: ID!) {
+    node(id: $id) {
+        ... on BulkOperation {
+        id
+        status
+        errorCode
+        objectCount
+        url
+        }
+    }
+    }
+    """
 
+def bulk_orders_query(search: str = None):
+    args = f"(query: {json.dumps(search)})" if search else ""
+    return f"""
+    {{
+    orders{args} {{
+    edges {{
+      node {{
+        id
+        createdAt
+        updatedAt
+        customer {{
+          id
+        }}
+        lineItems {{
+          edges {{
+            node {{
+              id
+              quantity
+              originalUnitPriceSet {{
+                shopMoney {{
+                  amount
+                }}
+              }}
+              product {{
+                id
+              }}
+              variant {{
+                id
+              }}
+            }}
+          }}
+        }}
+      }}
+    }}
+    }}
+    }}
+    """
 
+def bulk_products_query(search: str = None):
+    args = f"(query: {json.dumps(search)})" if search else ""
+    return f"""
+    {{
+    products{args} {{
+        edges {{
+        node {{
+            id
+            title
+            vendor
+            productType
+            createdAt
+            updatedAt
+            variants {{
+            edges {{
+                node {{
+                id
+                sku
+                price
+                inventoryItem {{
+                    id
+                    inventoryLevels {{
+                    edges {{
+                        node {{
+                        updatedAt
+                        location {{
+                            id
+                        }}
+                        quantities(names: ["available"]) {{
+                            name
+                            quantity
+                        }}
+                        }}
+                    }}
+                    }}
+                }}
+                }}
+            }}
+            }}
+        }}
+        }}
+    }}
+    }}
+    """
 
-    return {"products": products, "variants": variants, "inventory": inventory}
+async def run_bulk_operation(store_id: str, token: str, bulk_query: str) -> str | None:
+    # Submits the bulk query and polls until it finishes; returns the JSONL url
+    # (None when the query matched nothing)
+    response = await fetch_shopify_graphql(store_id, token, BULK_RUN_MUTATION, {"query": bulk_query})
+    result = (response.get("data") or {}).get("bulkOperationRunQuery") or {}
+    if response.get("errors") or result.get("userErrors") or not result.get("bulkOperation"):
+        raise HTTPException(status_code=502, detail=f"Bulk operation rejected: {response.get('errors') or result.get('userErrors')}")
+
+    operation_id = result["bulkOperation"]["id"]
+    deadline = time.monotonic() + BULK_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        response = await fetch_shopify_graphql(store_id, token, BULK_STATUS_QUERY, {"id": operation_id})
+        status = (response.get("data") or {}).get("node") or {}
+        if status.get("status") == "COMPLETED":
+            return status.get("url")
+        if status.get("status") in ("FAILED", "CANCELED", "EXPIRED"):
+            raise HTTPException(status_code=502, detail=f"Bulk operation {status['status'].lower()}: {status.get('errorCode')}")
+        await asyncio.sleep(BULK_POLL_SECONDS)
+    raise HTTPException(status_code=504, detail="Bulk operation timed out")
+
+async def iter_jsonl_chunks(store_id: str, url: str, chunk_size: int):
+    # Streams the result file and hands out chunks of parsed lines; the file is never
+    # held in memory as a whole. The signed url needs no Shopify token. Children follow
+    # their parent in the file, and a chunk only ends before a top-level object, so
+    # every order or product arrives together with all of its nested lines.
+    chunk = []
+    async with get_shopify_client(store_id).stream("GET", url, timeout=httpx.Timeout(300, connect=SHOPIFY_CONNECT_TIMEOUT_SECONDS)) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            obj = json_loads(line)
+            if len(chunk) >= chunk_size and "__parentId" not in obj:
+                yield chunk
+                chunk = []
+            chunk.append(obj)
+    if chunk:
+        yield chunk
+
+def gid_type(gid: str | None) -> str | None:
+    # "gid://shopify/ProductVariant/1" -> "ProductVariant"
+    parts = (gid or "").split("/")
+    return parts[-2] if len(parts) > 1 else None
+
+def load_bulk_orders(w: BulkWriter, lines: list, state: dict):
+    # A chunk holds each of its orders with all of their line items (see iter_jsonl_chunks)
+    orders, order_items = [], []
+    latest = state.get("orders")
+    for obj in lines:
+        parent = obj.get("__parentId")
+        if parent is None:
+            orders.append(order_row(obj))
+            updated_at = obj.get("updatedAt")
+            if updated_at and (latest is None or updated_at > latest):
+                latest = updated_at
+        else:
+            order_items.append(order_item_row(strip_gid(parent), obj))
+    w.write("orders", orders)
+    w.replace_order_items(orders, order_items)
+    w.checkpoint()
+    state["orders"] = latest
+
+def load_bulk_products(w: BulkWriter, lines: list, state: dict):
+    # Inventory levels hang off a variant's inventoryItem, so their __parentId is the
+    # variant; each variant's inventory item is remembered to resolve them
+    products, variants, inventory = [], [], []
+    latest = state.get("products")
+    variant_items = state.setdefault("variant_items", {})
+    for obj in lines:
+        parent = obj.get("__parentId")
+        if parent is None:
+            products.append(product_row(obj))
+            updated_at = obj.get("updatedAt")
+            if updated_at and (latest is None or updated_at > latest):
+                latest = updated_at
+        elif gid_type(obj.get("id")) == "ProductVariant":
+            inventory_item_id = strip_gid((obj.get("inventoryItem") or {}).get("id"))
+            if inventory_item_id:
+                variant_items[obj["id"]] = inventory_item_id
+                variants.append(variant_row(strip_gid(parent), obj, inventory_item_id))
+        else:
+            inventory_item_id = strip_gid(parent) if gid_type(parent) == "InventoryItem" else variant_items.get(parent)
+            if inventory_item_id:
+                inventory.append(inventory_row(inventory_item_id, obj))
+    w.write("products", products)
+    w.write("variants", variants)
+    w.write("inventory", inventory)
+    w.checkpoint()
+    state["products"] = latest
+
+async def bulk_exports(store_id: str, token: str, cursors: dict, createdAtMin=None, chunk_size: int = BULK_CHUNK_SIZE):
+    # Shopify runs one bulk query per shop at a time, so orders and products are exported
+    # one after the other (the shop object is fetched alongside)
+    exports = [
+        (load_bulk_orders, bulk_orders_query(build_search_query(createdAtMin, cursors.get("orders")))),
+        (load_bulk_products, bulk_products_query(build_search_query(updatedAtMin=cursors.get("products")))),
+    ]
+    for loader, bulk_query in exports:
+        url = await run_bulk_operation(store_id, token, bulk_query)
+        if url:
+            async for chunk in iter_jsonl_chunks(store_id, url, chunk_size):
+                yield loader, chunk
+
+async def ingest_bulk_and_store(store_id: str, token: str, cursors: dict = None, createdAtMin=None):
+    # Same contract as ingest_and_store
+    cursors = cursors or {}
+    async with BulkWriter(await asyncio.to_thread(store_db_file, store_id)) as w:
+        state = await run_ingest_pipeline(w, [
+            bulk_exports(store_id, token, cursors, createdAtMin, w.chunk_size),
+            shop_object(store_id, token),
+        ])
+    return w.stats(), {r: state.get(r) for r in INCREMENTAL_RESOURCES}
+
+# Per-store ingestion mode: "pages" (cursor pagination) or "bulk" (Bulk Operations)
+INGEST_MODES = {"pages": ingest_and_store, "bulk": ingest_bulk_and_store}
+DEFAULT_INGEST_MODE = os.getenv("INGEST_MODE", "pages")
+
+def get_ingest_mode(store_id: str) -> str:
+    conn = sqlite3.connect(DB_FILE)
+    row = conn.execute("SELECT ingest_mode FROM store_settings WHERE store_id = ?", (store_id,)).fetchone()
+    conn.close()
+    return row[0] if row and row[0] else DEFAULT_INGEST_MODE
 
-# Insert / Upsert Functions for Database
+def set_ingest_mode(store_id: str, mode: str):
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("""
+        INSERT INTO store_settings(store_id, ingest_mode) VALUES (?, ?)
+        ON CONFLICT(store_id) DO UPDATE SET ingest_mode=excluded.ingest_mode
+    """, (store_id, mode))
+    conn.commit()
+    conn.close()
 
-def insert_shop(shop):
+# Background sync scheduler
+# Stores are registered on their first question and refreshed off the request path,
+# so questions are always answered from the last committed snapshot.
+SCHEDULER_TICK_SECONDS = int(os.getenv("SYNC_SCHEDULER_TICK_SECONDS", "15"))
+MAX_CONCURRENT_SYNCS = int(os.getenv("MAX_CONCURRENT_SYNCS", "4"))
+SYNC_SLOTS = asyncio.Semaphore(MAX_CONCURRENT_SYNCS)   # shared by scheduled and triggered syncs
+
+KNOWN_STORES = {}    # store_id -> latest shopify token
+SYNC_STATUS = {}     # store_id -> status of the last / running sync
+SYNC_LOCKS = {}      # store_id -> asyncio lock held while this process holds the store's lease
+SYNC_JOBS = {}       # store_id -> (in-flight sync task, full) in this process
+SCHEDULED_SYNCS = {}   # store_id -> scheduled sync tasks not finished yet
+
+def get_sync_lock(store_id: str) -> asyncio.Lock:
+    return SYNC_LOCKS.setdefault(store_id, asyncio.Lock())
+
+# Sync coordination
+# Every uvicorn worker runs its own scheduler, so writing a store's shard (a sync or a
+# webhook batch) requires the store's lease in the control database. The holder renews
+# it while it works; a worker that dies leaves a lease that expires after
+# SYNC_LEASE_SECONDS. Completed syncs are recorded in sync_state, which every worker
+# reads, so a sync another worker just finished is not repeated.
+SYNC_LEASE_SECONDS = int(os.getenv("SYNC_LEASE_SECONDS", "60"))
+LEASE_POLL_SECONDS = 0.5
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+# The lease held by the current task ({"store_id", "lost"}); worker threads started
+# with asyncio.to_thread see it too
+HELD_LEASE = contextvars.ContextVar("held_lease", default=None)
+
+def acquire_lease(store_id: str, purpose: str) -> bool:
+    now = time.time()
     conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO shop(shop_id, name, currency, timezone, created_at)
+    cur = conn.execute("""
+        INSERT INTO sync_leases(store_id, owner, purpose, acquired_at, expires_at)
         VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(shop_id) DO UPDATE SET
-            name=excluded.name,
-            currency=excluded.currency,
-            timezone=excluded.timezone,
-            created_at=excluded.created_at
-    """, (shop["shop_id"], shop["name"], shop["currency"], shop["timezone"], shop["created_at"]))
+        ON CONFLICT(store_id) DO UPDATE SET
+            owner=excluded.owner,
+            purpose=excluded.purpose,
+            acquired_at=excluded.acquired_at,
+            expires_at=excluded.expires_at
+        WHERE sync_leases.expires_at < ? OR sync_leases.owner = excluded.owner
+    """, (store_id, WORKER_ID, purpose, now, now + SYNC_LEASE_SECONDS, now))
     conn.commit()
     conn.close()
+    return cur.rowcount == 1
 
+def renew_lease(store_id: str) -> bool:
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.execute(
+        "UPDATE sync_leases SET expires_at = ? WHERE store_id = ? AND owner = ?",
+        (time.time() + SYNC_LEASE_SECONDS, store_id, WORKER_ID),
+    )
+    conn.commit()
+    conn.close()
+    return cur.rowcount == 1
 
-def insert_orders(orders):
+def release_lease(store_id: str):
     conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    for o in orders:
-        c.execute("""
-            INSERT INTO orders(order_id, created_at, customer_id)
-            VALUES (?, ?, ?)
-            ON CONFLICT(order_id) DO UPDATE SET
-                created_at=excluded.created_at,
-                customer_id=excluded.customer_id
-        """, (o["order_id"], o["created_at"], o["customer_id"]))
+    conn.execute("DELETE FROM sync_leases WHERE store_id = ? AND owner = ?", (store_id, WORKER_ID))
     conn.commit()
     conn.close()
 
+def load_leases() -> dict:
+    # Unexpired leases: store_id -> {owner, purpose, ...}
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM sync_leases WHERE expires_at >= ?", (time.time(),)).fetchall()
+    conn.close()
+    return {r["store_id"]: dict(r) for r in rows}
+
+def check_lease():
+    # Called before each commit to a shard: once the lease has expired another worker
+    # may be writing the shard, so the holder stops instead of committing over it
+    lease = HELD_LEASE.get()
+    if lease is not None and lease["lost"]:
+        raise HTTPException(status_code=409, detail=f"Lost the lease of {lease['store_id']}, stopped writing it")
 
-def insert_order_items(items):
+async def keep_lease(lease: dict, purpose: str):
+    while True:
+        await asyncio.sleep(SYNC_LEASE_SECONDS / 3)
+        if not await asyncio.to_thread(renew_lease, lease["store_id"]):
+            lease["lost"] = True
+            LEASES_LOST.inc(purpose=purpose)
+            return
+
+@asynccontextmanager
+async def store_lease(store_id: str, purpose: str):
+    # Exclusive right to write the store's shard, across every worker process
+    async with get_sync_lock(store_id):
+        while not await asyncio.to_thread(acquire_lease, store_id, purpose):
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+        lease = {"store_id": store_id, "lost": False}
+        held = HELD_LEASE.set(lease)
+        renewer = asyncio.create_task(keep_lease(lease, purpose))
+        try:
+            yield
+        finally:
+            renewer.cancel()
+            HELD_LEASE.reset(held)
+            await asyncio.to_thread(release_lease, store_id)
+
+def refresh_last_syncs():
+    # Picks up syncs that other workers completed
     conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    for i in items:
-        c.execute("""
-            INSERT OR REPLACE INTO order_items(order_id, product_id, variant_id, quantity, price)
-            VALUES (?, ?, ?, ?, ?)
-        """, (i["order_id"], i["product_id"], i["variant_id"], i["quantity"], i["price"]))
-    conn.commit()
+    rows = conn.execute("SELECT store_id, MAX(synced_at) FROM sync_state GROUP BY store_id").fetchall()
     conn.close()
+    for store_id, synced_at in rows:
+        if synced_at:
+            synced = datetime.fromisoformat(synced_at)
+            if store_id not in LAST_SYNC or synced > LAST_SYNC[store_id]:
+                LAST_SYNC[store_id] = synced
+
+def synced_since(store_id: str, since: datetime, full: bool) -> bool:
+    state = load_sync_state(store_id)
+    if full:
+        synced = [state.get("full", {}).get("synced_at")]
+    else:
+        synced = [s["synced_at"] for s in state.values()]
+    return any(s and datetime.fromisoformat(s) >= since for s in synced)
+
+def register_store(store_id: str, token: str):
+    KNOWN_STORES[store_id] = token
+    if store_id not in LAST_SYNC and not STORE_ROUTER.exists(store_id):
+        # Cursors without data (a new or deleted shard) would skip the initial full crawl
+        reset_sync_state(store_id)
+    elif store_id not in LAST_SYNC:
+        synced = [s["synced_at"] for s in load_sync_state(store_id).values() if s["synced_at"]]
+        if synced:
+            LAST_SYNC[store_id] = datetime.fromisoformat(max(synced))
+    SYNC_STATUS.setdefault(store_id, {
+        "state": "pending",
+        "mode": None,
+        "ingest_mode": None,
+        "last_write": None,
+        "last_started": None,
+        "last_finished": None,
+        "last_duration_s": None,
+        "last_error": None,
+        "sync_count": 0,
+    })
+
+async def sync_store(store_id: str, token: str, wait: bool = True, full: bool = False, initial: bool = False) -> bool:
+    # Single flight: a caller that finds the store's sync in flight joins it, or returns
+    # False at once if wait is False; a full sync asked for during an incremental one
+    # runs after it. The job is shielded, so a caller that goes away doesn't cancel it.
+    requested_at = datetime.utcnow()
+    while (job := SYNC_JOBS.get(store_id)) is not None:
+        task, job_full = job
+        if not wait:
+            SYNC_REQUESTS.inc(outcome="skipped")
+            return False
+        if job_full or not full:
+            SYNC_REQUESTS.inc(outcome="joined")
+            return await asyncio.shield(task)
+        await asyncio.wait([task])
+
+    task = asyncio.create_task(run_sync(store_id, token, full, initial, requested_at))
+    SYNC_JOBS[store_id] = (task, full)
+
+    def finished(t):
+        if SYNC_JOBS.get(store_id, (None,))[0] is t:
+            del SYNC_JOBS[store_id]
+        if not t.cancelled():
+            t.exception()   # joiners re-raise it; don't warn when nobody is left to
+
+    task.add_done_callback(finished)
+    return await asyncio.shield(task)
+
+async def run_sync(store_id: str, token: str, full: bool, initial: bool, requested_at: datetime) -> bool:
+    # An initial sync is skipped once the store has a snapshot, any other once a sync
+    # (of the same kind) has completed since it was requested, e.g. by another worker
+    async with store_lease(store_id, "sync"):
+        await asyncio.to_thread(refresh_last_syncs)
+        if initial and store_id in LAST_SYNC:
+            SYNC_REQUESTS.inc(outcome="satisfied")
+            return True
+        if not initial and await asyncio.to_thread(synced_since, store_id, requested_at, full):
+            SYNC_REQUESTS.inc(outcome="satisfied")
+            return True
+        SYNC_REQUESTS.inc(outcome="started")
+
+        status = SYNC_STATUS[store_id]
+        started = time.monotonic()
+        status["state"] = "syncing"
+        status["last_started"] = datetime.utcnow().isoformat()
+        try:
+            cursors = await asyncio.to_thread(sync_cursors, store_id, full)
+            status["mode"] = "incremental" if cursors else "full"
+            status["ingest_mode"] = await asyncio.to_thread(get_ingest_mode, store_id)
+            status["last_write"], marks = await INGEST_MODES[status["ingest_mode"]](store_id, token, cursors)
+
+            synced_at = datetime.utcnow()
+            for resource in INCREMENTAL_RESOURCES:
+                await asyncio.to_thread(save_sync_state, store_id, resource, marks.get(resource), synced_at)
+            if not cursors:
+                await asyncio.to_thread(save_sync_state, store_id, "full", None, synced_at)
+            LAST_SYNC[store_id] = synced_at
+            bump_table_generations(store_id, status["last_write"]["rows_changed_by_table"])
+            status["state"] = "idle"
+            status["last_error"] = None
+            status["sync_count"] += 1
+        except Exception as e:
+            status["state"] = "error"
+            status["last_error"] = str(getattr(e, "detail", e))
+            print(f"Sync failed for {store_id}:", status["last_error"])
+            raise
+        finally:
+            status["last_finished"] = datetime.utcnow().isoformat()
+            status["last_duration_s"] = round(time.monotonic() - started, 3)
+            SYNC_SECONDS.observe(time.monotonic() - started, mode=status["mode"], outcome=status["state"])
+
+        # Refresh planner statistics and workload-driven indexes for the new data
+        try:
+            await asyncio.to_thread(maintain_indexes, store_id)
+        except sqlite3.Error as e:
+            print("Index maintenance failed:", e)
+    return True
 
+async def ensure_snapshot(store_id: str, token: str):
+    # Only a store without any committed snapshot makes the caller wait for a sync
+    register_store(store_id, token)
+    if store_id not in LAST_SYNC:
+        await sync_store(store_id, token, wait=True, initial=True)
 
-def insert_products(products):
+async def _scheduled_sync(store_id: str, full: bool = False):
+    try:
+        async with SYNC_SLOTS:
+            # A forced full sync waits for a running one instead of being skipped
+            await sync_store(store_id, KNOWN_STORES[store_id], wait=full, full=full)
+    except Exception as e:
+        # Retried on a later tick
+        print(f"Scheduled sync failed for {store_id}: {type(e).__name__}: {getattr(e, 'detail', e)}")
+    finally:
+        SCHEDULED_SYNCS[store_id] -= 1
+        if not SCHEDULED_SYNCS[store_id]:
+            del SCHEDULED_SYNCS[store_id]
+
+def schedule_sync(store_id: str, full: bool = False):
+    SCHEDULED_SYNCS[store_id] = SCHEDULED_SYNCS.get(store_id, 0) + 1
+    asyncio.create_task(_scheduled_sync(store_id, full))
+
+async def sync_scheduler():
+    while True:
+        # Syncs finished by other workers count too, and a store another worker is
+        # writing is left to it rather than queueing for its lease
+        try:
+            await asyncio.to_thread(refresh_last_syncs)
+            leases = await asyncio.to_thread(load_leases)
+        except sqlite3.Error as e:
+            print("Sync scheduler could not read the control database:", e)
+            leases = {}
+        for store_id in list(KNOWN_STORES):
+            lease = leases.get(store_id)
+            if lease and lease["owner"] != WORKER_ID:
+                continue
+            if store_id in SCHEDULED_SYNCS or not should_sync(store_id):
+                continue
+            schedule_sync(store_id)
+        await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+def sync_status(store_id: str) -> dict:
+    status = dict(SYNC_STATUS[store_id])
+    last = LAST_SYNC.get(store_id)
+    status["last_sync"] = last.isoformat() if last else None
+    status["age_s"] = round((datetime.utcnow() - last).total_seconds(), 1) if last else None
+    lease = load_leases().get(store_id)
+    status["lease"] = {
+        "owner": lease["owner"],
+        "purpose": lease["purpose"],
+        "this_worker": lease["owner"] == WORKER_ID,
+        "held_s": round(time.time() - lease["acquired_at"], 1),
+    } if lease else None
+    return status
+
+# Webhook deltas
+# The gateway verifies Shopify's webhooks and forwards them here. Each one is first
+# committed to the webhook_events queue (deduplicated by Shopify's webhook id) and
+# acknowledged; a worker then applies each store's pending events in batches, holding
+# the store's lease, through the same normalize_orders / normalize_products row logic
+# as a sync. Applied events are kept for WEBHOOK_RETENTION_HOURS so they can be replayed.
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "500"))
+WEBHOOK_TICK_SECONDS = int(os.getenv("WEBHOOK_TICK_SECONDS", "30"))
+WEBHOOK_RETENTION_HOURS = int(os.getenv("WEBHOOK_RETENTION_HOURS", "72"))
+WEBHOOK_WAKEUP = asyncio.Event()
+
+class WebhookEvent(BaseModel):
+    store_id: str
+    topic: str
+    webhook_id: str | None = None
+    payload: dict
+
+def utc_timestamp(value: str | None) -> str | None:
+    # Webhooks carry shop-local offsets; the tables hold UTC like the GraphQL API returns
+    if not value:
+        return value
+    return datetime.fromisoformat(value).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# REST payloads -> the GraphQL node shapes the normalizers take
+def order_node(o: dict) -> dict:
+    return {
+        "id": str(o["id"]),
+        "createdAt": utc_timestamp(o.get("created_at")),
+        "updatedAt": utc_timestamp(o.get("updated_at")),
+        "customer": {"id": str(o["customer"]["id"])} if o.get("customer") else None,
+        "lineItems": {"edges": [
+            {"node": {
+                "quantity": li.get("quantity", 0),
+                "originalUnitPriceSet": {"shopMoney": {"amount": li.get("price") or 0}},
+                "product": {"id": str(li["product_id"])} if li.get("product_id") else None,
+                "variant": {"id": str(li["variant_id"])} if li.get("variant_id") else None,
+            }}
+            for li in o.get("line_items", [])
+        ]},
+    }
+
+def product_node(p: dict) -> dict:
+    # products/update carries no inventory levels; those come with inventory_levels/update
+    return {
+        "id": str(p["id"]),
+        "title": p.get("title"),
+        "vendor": p.get("vendor"),
+        "productType": p.get("product_type"),
+        "createdAt": utc_timestamp(p.get("created_at")),
+        "updatedAt": utc_timestamp(p.get("updated_at")),
+        "variants": {"edges": [
+            {"node": {
+                "id": str(v["id"]),
+                "sku": v.get("sku"),
+                "price": v.get("price") or 0,
+                "inventoryItem": {"id": str(v["inventory_item_id"])} if v.get("inventory_item_id") else None,
+            }}
+            for v in p.get("variants", [])
+        ]},
+    }
+
+def inventory_level_node(level: dict) -> dict:
+    return {
+        "location": {"id": str(level["location_id"])},
+        "quantities": [{"name": "available", "quantity": level.get("available") or 0}],
+        "updatedAt": utc_timestamp(level.get("updated_at")),
+    }
+
+WEBHOOK_TOPICS = {
+    "orders/create": "orders",
+    "orders/updated": "orders",
+    "products/update": "products",
+    "inventory_levels/update": "inventory",
+}
+
+def enqueue_webhook(event: WebhookEvent) -> bool:
+    # False for a delivery that is already queued (Shopify retries and may send twice)
     conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    for p in products:
-        c.execute("""
-            INSERT INTO products(product_id, title, vendor, product_type, created_at)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(product_id) DO UPDATE SET
-                title=excluded.title,
-                vendor=excluded.vendor,
-                product_type=excluded.product_type,
-                created_at=excluded.created_at
-        """, (p["product_id"], p["title"], p["vendor"], p["product_type"], p["created_at"]))
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO webhook_events(store_id, topic, webhook_id, payload, received_at) VALUES (?, ?, ?, ?, ?)",
+        (event.store_id, event.topic, event.webhook_id, json.dumps(event.payload), datetime.utcnow().isoformat()),
+    )
     conn.commit()
     conn.close()
+    return cur.rowcount == 1
 
+def pending_webhook_stores() -> list:
+    conn = sqlite3.connect(DB_FILE)
+    stores = [r[0] for r in conn.execute("SELECT DISTINCT store_id FROM webhook_events WHERE applied_at IS NULL")]
+    conn.close()
+    return stores
 
-def insert_variants(variants):
+def load_pending_webhooks(store_id: str, limit: int) -> list:
     conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    for v in variants:
-        c.execute("""
-            INSERT INTO variants(variant_id, product_id, sku, price, inventory_item_id)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(variant_id) DO UPDATE SET
-                product_id=excluded.product_id,
-                sku=excluded.sku,
-                price=excluded.price,
-                inventory_item_id=excluded.inventory_item_id
-        """, (v["variant_id"], v["product_id"], v["sku"], v["price"], v["inventory_item_id"]))
+    events = conn.execute(
+        "SELECT id, topic, payload FROM webhook_events WHERE store_id = ? AND applied_at IS NULL ORDER BY id LIMIT ?",
+        (store_id, limit),
+    ).fetchall()
+    conn.close()
+    return events
+
+def older(node: dict, updated_at: str | None) -> bool:
+    # Timestamps are all UTC in the same format, so they compare as strings
+    return bool(node.get("updatedAt") and updated_at and node["updatedAt"] < updated_at)
+
+def keep_newest(nodes: dict, key, node: dict):
+    # Shopify doesn't guarantee delivery order; of two events for the same
+    # order / product / inventory level the one with the later updated_at wins
+    if key not in nodes or not older(node, nodes[key].get("updatedAt")):
+        nodes[key] = node
+
+def write_webhook_batch(store_id: str, events: list):
+    orders, products, levels, errors = {}, {}, {}, {}
+    for event_id, topic, payload in events:
+        try:
+            data = json.loads(payload)
+            kind = WEBHOOK_TOPICS[topic]
+            if kind == "orders":
+                keep_newest(orders, str(data["id"]), order_node(data))
+            elif kind == "products":
+                keep_newest(products, str(data["id"]), product_node(data))
+            else:
+                keep_newest(levels, (str(data["inventory_item_id"]), str(data["location_id"])), inventory_level_node(data))
+        except (ValueError, KeyError, TypeError) as e:
+            errors[event_id] = f"{type(e).__name__}: {e}"
+
+    # Variants without an inventory item are skipped by normalize_products, as in a sync
+    inventory = [inventory_row(item_id, node) for (item_id, _), node in levels.items()]
+
+    with BulkWriter(store_db_file(store_id)) as w:
+        # The upserts' updated_at guard covers the rows themselves and replace_order_items
+        # the line items; products older than the stored ones are dropped with their variants
+        stored = w.stored_updated_at("products", products)
+        products = [p for product_id, p in products.items() if not older(p, stored.get(product_id))]
+        normalized_orders = normalize_orders({"edges": [{"node": o} for o in orders.values()]})
+        normalized_products = normalize_products({"edges": [{"node": p} for p in products]})
+
+        w.write("orders", normalized_orders["orders"])
+        w.replace_order_items(normalized_orders["orders"], normalized_orders["order_items"])
+        w.write("products", normalized_products["products"])
+        w.write("variants", normalized_products["variants"])
+        w.write("inventory", inventory)
+    return w.stats(), errors
+
+def mark_webhooks_applied(event_ids: list, errors: dict):
+    conn = sqlite3.connect(DB_FILE)
+    now = datetime.utcnow().isoformat()
+    conn.executemany(
+        "UPDATE webhook_events SET applied_at = ?, error = ? WHERE id = ?",
+        [(now, errors.get(event_id), event_id) for event_id in event_ids],
+    )
     conn.commit()
     conn.close()
 
-
-def insert_inventory(items):
+def prune_webhooks():
     conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    for i in items:
-        c.execute("""
-            INSERT INTO inventory(inventory_item_id, location_id, available, updated_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(inventory_item_id, location_id) DO UPDATE SET
-                available=excluded.available,
-                updated_at=excluded.updated_at
-        """, (i["inventory_item_id"], i["location_id"], i["available"], i["updated_at"]))
+    cutoff = (datetime.utcnow() - timedelta(hours=WEBHOOK_RETENTION_HOURS)).isoformat()
+    conn.execute("DELETE FROM webhook_events WHERE applied_at IS NOT NULL AND applied_at < ?", (cutoff,))
     conn.commit()
     conn.close()
 
-# Master normalize_all_raw_data
-def normalize_all_raw_data(raw_data: dict):
-    # Orders
-    if "orders" in raw_data:
-        normalized_orders = normalize_orders(raw_data["orders"])
-        insert_orders(normalized_orders["orders"])
-        insert_order_items(normalized_orders["order_items"])
-
-    # Products + Variants + Inventory
-    if "products" in raw_data:
-        normalized_products = normalize_products(raw_data["products"])
-        insert_products(normalized_products["products"])
-        insert_variants(normalized_products["variants"])
-        insert_inventory(normalized_products["inventory"])
-       
-
-    # Shop
-    if "shop" in raw_data:
-        shop = normalize_shop(raw_data["shop"])
-        if shop:
-            insert_shop(shop)
+def load_last_webhooks():
+    conn = sqlite3.connect(DB_FILE)
+    for store_id, received_at in conn.execute("SELECT store_id, MAX(received_at) FROM webhook_events GROUP BY store_id"):
+        LAST_WEBHOOK[store_id] = datetime.fromisoformat(received_at)
+    conn.close()
+
+async def apply_webhooks(store_id: str):
+    # Holding the store's lease keeps deltas and syncs from writing the shard at the same time
+    async with store_lease(store_id, "webhooks"):
+        while True:
+            events = await asyncio.to_thread(load_pending_webhooks, store_id, WEBHOOK_BATCH_SIZE)
+            if not events:
+                return
+            stats, errors = await asyncio.to_thread(write_webhook_batch, store_id, events)
+            await asyncio.to_thread(mark_webhooks_applied, [e[0] for e in events], errors)
+            bump_table_generations(store_id, stats["rows_changed_by_table"])
+            for event_id, topic, _ in events:
+                WEBHOOK_EVENTS.inc(topic=topic, outcome="failed" if event_id in errors else "applied")
+            for event_id, error in errors.items():
+                print(f"Skipped webhook {event_id} for {store_id}: {error}")
+
+async def webhook_worker():
+    await asyncio.to_thread(load_last_webhooks)
+    while True:
+        try:
+            await asyncio.wait_for(WEBHOOK_WAKEUP.wait(), WEBHOOK_TICK_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        WEBHOOK_WAKEUP.clear()
+        for store_id in await asyncio.to_thread(pending_webhook_stores):
+            try:
+                await apply_webhooks(store_id)
+            except Exception as e:
+                print(f"Applying webhooks failed for {store_id}, retrying later:", e)
+        await asyncio.to_thread(prune_webhooks)
+
+def webhook_status(store_id: str = None) -> list:
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("""
+        SELECT store_id,
+               SUM(applied_at IS NULL) AS pending,
+               SUM(applied_at IS NOT NULL AND error IS NULL) AS applied,
+               SUM(error IS NOT NULL) AS failed,
+               MAX(received_at) AS last_received_at
+        FROM webhook_events
+        WHERE ? IS NULL OR store_id = ?
+        GROUP BY store_id
+    """, (store_id, store_id)).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def replay_webhooks(store_id: str, since: str) -> int:
+    # Re-queues every kept event received at or after since
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.execute(
+        "UPDATE webhook_events SET applied_at = NULL, error = NULL WHERE store_id = ? AND received_at >= ?",
+        (store_id, since),
+    )
+    conn.commit()
+    conn.close()
+    return cur.rowcount
 
 # Validate llm's sql query response      
 def is_safe_sql(sql: str) -> bool:
@@ -618,17 +2626,411 @@ def is_safe_sql(sql: str) -> bool:
 
     return True
 
+# SQLite calls on the request path run on their own bounded pool, so hundreds of
+# in-flight questions neither block the event loop nor crowd out sync work.
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="sqlite")
+
+async def run_in_db_executor(fn, *args):
+    # Runs in the caller's context, like asyncio.to_thread, so the work counts for its request
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(DB_EXECUTOR, context.run, fn, *args)
+
+# Read-only connection pool
+# Questions read through each shard's pool of read-only (mode=ro, query_only) connections, so
+# they never block on, or interfere with, a running sync. Each connection has a
+# bounded page cache and keeps temporary sort/index data on disk. Every query gets a
+# time and VM-step budget, enforced by a progress handler; a query that runs over is
+# interrupted and fails with QueryBudgetExceeded.
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", str(DB_EXECUTOR_WORKERS)))
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "5"))
+QUERY_MAX_VM_STEPS = int(os.getenv("QUERY_MAX_VM_STEPS", "500000000"))
+QUERY_CACHE_KIB = int(os.getenv("QUERY_CACHE_KIB", "16384"))
+PROGRESS_CHECK_STEPS = 10000   # VM instructions between budget checks
+
+class QueryBudgetExceeded(sqlite3.OperationalError):
+    pass
+
+class ReadPool:
+    CLOSED = object()   # left in the idle queue by close() to wake threads waiting on it
+
+    def __init__(self, db_file, size: int):
+        self.db_file = db_file
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(f"{Path(self.db_file).as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{QUERY_CACHE_KIB}")
+        conn.execute("PRAGMA temp_store = FILE")
+        conn.execute("PRAGMA mmap_size = 0")
+        return conn
+
+    def acquire(self, timeout_seconds: float = QUERY_TIMEOUT_SECONDS):
+        # Open connections lazily up to size, then wait for one to be released
+        with self.lock:
+            create = self.idle.empty() and self.created < self.size
+            if create:
+                self.created += 1
+        if not create:
+            try:
+                conn = self.idle.get(timeout=timeout_seconds)
+            except queue.Empty:
+                raise QueryBudgetExceeded(
+                    f"Query cancelled: no read connection was free within {timeout_seconds:g}s"
+                ) from None
+            if conn is not self.CLOSED:
+                return conn
+            # The shard was evicted: pass the wakeup on and use a connection of our own,
+            # which release() closes
+            self.idle.put(conn)
+            return self._connect()
+        try:
+            return self._connect()
+        except sqlite3.Error:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def release(self, conn):
+        conn.set_progress_handler(None, 0)
+        with self.lock:
+            if not self.closed:
+                self.idle.put(conn)
+                return
+        conn.close()   # the shard was evicted while this query ran
+
+    @contextmanager
+    def connection(self, timeout_seconds: float = QUERY_TIMEOUT_SECONDS, max_steps: int = QUERY_MAX_VM_STEPS):
+        deadline = time.monotonic() + timeout_seconds
+        conn = self.acquire(timeout_seconds)
+        budget = {"steps": 0, "exceeded": None}
+
+        def check_budget():
+            budget["steps"] += PROGRESS_CHECK_STEPS
+            if budget["steps"] > max_steps:
+                budget["exceeded"] = f"{max_steps} VM steps"
+            elif time.monotonic() > deadline:
+                budget["exceeded"] = f"{timeout_seconds:g}s"
+            return 1 if budget["exceeded"] else 0   # non-zero interrupts the running statement
+
+        conn.set_progress_handler(check_budget, PROGRESS_CHECK_STEPS)
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            if budget["exceeded"]:
+                raise QueryBudgetExceeded(
+                    f"Query cancelled: it exceeded its execution budget of {budget['exceeded']}"
+                ) from e
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            while True:
+                try:
+                    conn = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                if conn is not self.CLOSED:
+                    conn.close()
+            self.idle.put(self.CLOSED)
+
+# Result shaping
+# A query never returns more than RESULT_ROW_LIMIT rows: the SQL is wrapped in a LIMIT and
+# read with fetchmany. When it had more, the full result is summarized inside SQLite
+# (row count, numeric totals, most frequent values) instead of being loaded.
+RESULT_ROW_LIMIT = int(os.getenv("RESULT_ROW_LIMIT", "200"))
+RESULT_TOP_N = int(os.getenv("RESULT_TOP_N", "5"))
+RESULT_TOP_COLUMNS = 3
+FETCH_BATCH_SIZE = 100
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def summarize_result(c, sql: str, columns: list, rows: list, params: tuple = ()) -> dict:
+    numeric = [
+        i for i, _ in enumerate(columns)
+        if any(r[i] is not None for r in rows)
+        and all(r[i] is None or (isinstance(r[i], (int, float)) and not isinstance(r[i], bool)) for r in rows)
+    ]
+    text = [i for i, _ in enumerate(columns) if i not in numeric][:RESULT_TOP_COLUMNS]
+
+    aggregates = ["COUNT(*)"]
+    for i in numeric:
+        col = quote_identifier(columns[i])
+        aggregates += [f"SUM({col})", f"MIN({col})", f"MAX({col})", f"AVG({col})"]
+    values = c.execute(f"SELECT {', '.join(aggregates)} FROM (\n{sql}\n)", params).fetchone()
+
+    summary = {"total_rows": values[0], "totals": {}, "top_values": {}}
+    for n, i in enumerate(numeric):
+        total, low, high, avg = values[1 + 4 * n:5 + 4 * n]
+        summary["totals"][columns[i]] = {
+            "sum": total, "min": low, "max": high, "avg": round(avg, 4) if avg is not None else None,
+        }
+    for i in text:
+        col = quote_identifier(columns[i])
+        top = [
+            list(r) for r in c.execute(
+                f"SELECT {col}, COUNT(*) AS n FROM (\n{sql}\n) GROUP BY {col} ORDER BY n DESC LIMIT ?",
+                (*params, RESULT_TOP_N),
+            )
+        ]
+        if top and top[0][1] > 1:   # all-distinct columns (ids, titles) say nothing
+            summary["top_values"][columns[i]] = top
+    return summary
+
 # Run query if it passes the check
-def run_sql(sql: str):
+def run_sql(store_id: str, sql: str, params: tuple = (), limit: int = RESULT_ROW_LIMIT) -> dict:
+    sql = sql.strip().rstrip(";").strip()
+    with STORE_ROUTER.get(store_id).read_pool.connection() as conn:
+        c = conn.cursor()
+        try:
+            plan = [r[3] for r in c.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            started = time.perf_counter()
+            # One row past the limit tells us whether the result was cut off
+            c.execute(f"SELECT * FROM (\n{sql}\n) LIMIT ?", (*params, limit + 1))
+            columns = [d[0] for d in c.description]
+            rows = []
+            while len(rows) <= limit:
+                batch = c.fetchmany(min(FETCH_BATCH_SIZE, limit + 1 - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+            duration_ms = (time.perf_counter() - started) * 1000
+
+            truncated = len(rows) > limit
+            rows = rows[:limit]
+            summary = summarize_result(c, sql, columns, rows, params) if truncated else None
+        finally:
+            c.close()   # resets the statement, so no read snapshot stays open in the pool
+
+    total_rows = summary["total_rows"] if truncated else len(rows)
+    SQL_SECONDS.observe(duration_ms / 1000)
+    SQL_ROWS.observe(total_rows)
+    record_request_query(sql, plan, total_rows, truncated, duration_ms)
+    log_query(sql, duration_ms, len(rows), plan)
+    return {"columns": columns, "rows": rows, "truncated": truncated, "summary": summary}
+
+def encode_result_csv(result: dict) -> str:
+    # Header plus one line per row: far fewer tokens than indented JSON objects
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(result["columns"])
+    writer.writerows(result["rows"])
+    return buf.getvalue()
+
+def estimate_tokens(text: str) -> int:
+    # Rough rule of thumb for English/CSV text: ~4 characters per token
+    return (len(text) + 3) // 4
+
+# Workload-driven index advisor
+# Every query run_sql executes is logged with its timing and query plan. After each sync
+# the log is mined for repeated full scans and automatic (temporary) indexes, the
+# recommended indexes are created, advised indexes unused for a long time are dropped,
+# and ANALYZE refreshes the planner statistics.
+INDEX_ADVISOR_MIN_HITS = int(os.getenv("INDEX_ADVISOR_MIN_HITS", "3"))
+INDEX_ADVISOR_DROP_DAYS = int(os.getenv("INDEX_ADVISOR_DROP_DAYS", "30"))
+QUERY_LOG_RETENTION_DAYS = int(os.getenv("QUERY_LOG_RETENTION_DAYS", "14"))
+# Queries waiting for the next flush; only the latest are kept while no sync flushes them
+QUERY_LOG_BUFFER_SIZE = int(os.getenv("QUERY_LOG_BUFFER_SIZE", "10000"))
+
+_query_log_buffer = deque(maxlen=QUERY_LOG_BUFFER_SIZE)
+_query_log_lock = threading.Lock()
+
+SQL_KEYWORDS = {
+    "on", "where", "join", "left", "right", "inner", "outer", "cross", "natural", "group",
+    "order", "limit", "having", "union", "using", "as", "select", "from", "and", "or",
+}
+
+def query_shape(sql: str) -> str:
+    # Literals become ? so the same question with other values groups together
+    shape = re.sub(r"'(?:[^']|'')*'", "?", sql.strip().lower())
+    shape = re.sub(r"\b\d+(?:\.\d+)?\b", "?", shape)
+    return re.sub(r"\s+", " ", shape).rstrip(";")
+
+def table_aliases(sql: str) -> dict:
+    # alias (or table name) -> table, from the FROM / JOIN clauses
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:from|join)\s+(\w+)(?:\s+(?:as\s+)?(\w+))?", sql, re.IGNORECASE):
+        aliases[table.lower()] = table.lower()
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+def filtered_columns(sql: str, alias: str, table: str, columns: set) -> list:
+    # Columns of one table filtered in WHERE clauses (equality and range comparisons,
+    # prefix LIKEs), i.e. the ones an index could turn a scan into a search on. Join
+    # columns are left out: SQLite reports those as automatic indexes.
+    sql = " ".join(re.findall(r"\bwhere\b(.*?)(?=\bgroup\s+by\b|\border\s+by\b|\blimit\b|\bhaving\b|$)", sql, re.IGNORECASE | re.DOTALL))
+    found = []
+    prefix = rf"(?:\b{re.escape(alias)}\.)"
+    pattern = rf"{prefix}?\b(\w+)\s*(?:=|<|>|<=|>=|\bin\b|\bbetween\b|\blike\s+'[^%_])"
+    reverse = rf"(?:=|<|>|<=|>=)\s*{prefix}?\b(\w+)\b"
+    for col in re.findall(pattern, sql, re.IGNORECASE) + re.findall(reverse, sql, re.IGNORECASE):
+        col = col.lower()
+        if col in columns and col not in found:
+            found.append(col)
+    return found
+
+def index_candidates(sql: str, plan: list, schema: dict) -> tuple[list, list]:
+    # Returns (full scans, automatic indexes) as (table, columns) pairs
+    aliases = table_aliases(sql)
+    scans, automatic = [], []
+    for detail in plan:
+        m = re.match(r"(?:SCAN|SEARCH) (\w+)", detail)
+        if not m:
+            continue
+        table = aliases.get(m.group(1).lower(), m.group(1).lower())
+        if table not in schema:
+            continue
+        auto = re.search(r"AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \(([^)]*)\)", detail)
+        if auto:
+            cols = [c.split("=")[0].split(">")[0].split("<")[0].strip() for c in auto.group(1).split(" AND ")]
+            automatic.append((table, tuple(cols)))
+        elif detail.startswith("SCAN") and "USING" not in detail:
+            cols = filtered_columns(sql, m.group(1), table, schema[table])
+            if cols:
+                scans.append((table, (cols[0],)))
+    return scans, automatic
+
+def log_query(sql: str, duration_ms: float, rows: int, plan: list):
+    with _query_log_lock:
+        _query_log_buffer.append((datetime.utcnow().isoformat(), query_shape(sql), sql, round(duration_ms, 3), rows, "\n".join(plan)))
+
+def flush_query_log(conn: sqlite3.Connection):
+    with _query_log_lock:
+        entries = list(_query_log_buffer)
+        _query_log_buffer.clear()
+    schema = SHARD_COLUMNS
+    records = []
+    for logged_at, shape, sql, duration_ms, rows, plan in entries:
+        scans, automatic = index_candidates(sql, plan.split("\n"), schema)
+        records.append((
+            logged_at, hashlib.sha1(shape.encode()).hexdigest(), shape, sql, duration_ms, rows, plan,
+            json.dumps(scans), json.dumps(automatic),
+        ))
+    conn.executemany("""
+        INSERT INTO query_log(logged_at, shape_hash, shape, sql, duration_ms, rows, plan, full_scans, auto_indexes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, records)
+    conn.commit()
+
+def table_columns(conn: sqlite3.Connection) -> dict:
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    return {t: {r[1] for r in conn.execute(f"PRAGMA table_info({t})")} for t in tables}
+
+def shard_schema_columns() -> dict:
+    # Every shard has the same schema; read it off an empty in-memory shard
+    conn = sqlite3.connect(":memory:")
+    migrate_shard(conn)
+    columns = table_columns(conn)
+    conn.close()
+    return columns
+
+SHARD_COLUMNS = shard_schema_columns()
+
+def advised_index_name(table: str, columns) -> str:
+    return f"idx_advised_{table}_{'_'.join(columns)}"
+
+def apply_advised_indexes(conn: sqlite3.Connection):
+    # Make a shard's advised indexes match the advised_indexes table
+    control = sqlite3.connect(DB_FILE)
+    advised = {name: (table, columns) for name, table, columns in control.execute(
+        "SELECT name, table_name, columns FROM advised_indexes"
+    )}
+    control.close()
+    existing = {r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\\_advised\\_%' ESCAPE '\\'"
+    )}
+    for name in existing - advised.keys():
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+        print(f"Index advisor: dropped unused {name}")
+    for name in advised.keys() - existing:
+        table, columns = advised[name]
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns.replace(',', ', ')})")
+        print(f"Index advisor: created {name}")
+    conn.commit()
+
+def maintain_indexes(store_id: str):
+    # The workload is mined across all stores (they share one schema); the resulting
+    # index set is applied to this store's shard, the others pick it up on their next
+    # sync or when they are opened
     conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    flush_query_log(conn)
+    now = datetime.utcnow()
+    since = (now - timedelta(days=QUERY_LOG_RETENTION_DAYS)).isoformat()
+    conn.execute("DELETE FROM query_log WHERE logged_at < ?", (since,))
+
+    # Count every recommendation across the retained workload
+    hits = {}
+    for full_scans, auto_indexes in conn.execute("SELECT full_scans, auto_indexes FROM query_log"):
+        for table, columns in json.loads(full_scans) + json.loads(auto_indexes):
+            hits[(table, tuple(columns))] = hits.get((table, tuple(columns)), 0) + 1
+
+    for (table, columns), count in hits.items():
+        if count < INDEX_ADVISOR_MIN_HITS or not set(columns) <= SHARD_COLUMNS.get(table, set()):
+            continue
+        name = advised_index_name(table, columns)
+        added = conn.execute("""
+            INSERT INTO advised_indexes(name, table_name, columns, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO NOTHING
+        """, (name, table, ",".join(columns), now.isoformat(), now.isoformat())).rowcount
+        if added:
+            print(f"Index advisor: advised {name} ({count} queries)")
+
+    # Advised indexes are kept while plans keep using them
+    for (name,) in conn.execute("SELECT name FROM advised_indexes").fetchall():
+        used = conn.execute("SELECT MAX(logged_at) FROM query_log WHERE plan LIKE ?", (f"%INDEX {name}%",)).fetchone()[0]
+        if used:
+            conn.execute("UPDATE advised_indexes SET last_used_at = MAX(last_used_at, ?) WHERE name = ?", (used, name))
+    stale = (now - timedelta(days=INDEX_ADVISOR_DROP_DAYS)).isoformat()
+    conn.execute("DELETE FROM advised_indexes WHERE last_used_at < ?", (stale,))
+    conn.commit()
+    conn.close()
 
-    c.execute(sql)
-    rows = c.fetchall()
+    shard = sqlite3.connect(store_db_file(store_id))
+    apply_advised_indexes(shard)
+    # Bounded ANALYZE so statistics stay cheap to refresh after every sync
+    shard.execute("PRAGMA analysis_limit=1000")
+    shard.execute("ANALYZE")
+    shard.commit()
+    shard.close()
 
+def query_report(limit: int = 20) -> dict:
+    conn = sqlite3.connect(DB_FILE)
+    flush_query_log(conn)
+    conn.row_factory = sqlite3.Row
+    shapes = conn.execute("""
+        SELECT shape, COUNT(*) AS executions, ROUND(AVG(duration_ms), 3) AS avg_ms,
+               ROUND(MAX(duration_ms), 3) AS max_ms, ROUND(SUM(duration_ms), 3) AS total_ms,
+               MAX(logged_at) AS last_seen
+        FROM query_log
+        GROUP BY shape_hash
+        ORDER BY avg_ms DESC
+        LIMIT ?
+    """, (limit,)).fetchall()
+    report = []
+    for s in shapes:
+        latest = conn.execute(
+            "SELECT plan, full_scans, auto_indexes FROM query_log WHERE shape = ? ORDER BY logged_at DESC LIMIT 1", (s["shape"],)
+        ).fetchone()
+        report.append({
+            **dict(s),
+            "plan": latest["plan"].split("\n"),
+            "full_scans": json.loads(latest["full_scans"]),
+            "automatic_indexes": json.loads(latest["auto_indexes"]),
+        })
+    indexes = [dict(r) for r in conn.execute("SELECT * FROM advised_indexes ORDER BY created_at")]
     conn.close()
-    return [dict(r) for r in rows]
+    return {"slowest_shapes": report, "advised_indexes": indexes}
 
 # Google LLM
 API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -637,89 +3039,918 @@ try:
     client = genai.Client(api_key=API_KEY)
 except:
     raise HTTPException(500, detail=f"Error from llm client: {API_KEY}")
-def ask_google_llm(prompt: str) -> str:
+LLM_MODEL = "gemini-2.5-flash"
+
+def record_llm_call(call: str, started: float, prompt: str, text: str, usage=None):
+    # Token counts come from the response's usage metadata, estimated when it is missing
+    LLM_SECONDS.observe(time.perf_counter() - started, call=call)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt)
+    response_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(text or "")
+    LLM_TOKENS.inc(prompt_tokens, kind="prompt")
+    LLM_TOKENS.inc(response_tokens, kind="response")
+    count_for_request("prompt_tokens", prompt_tokens)
+    count_for_request("response_tokens", response_tokens)
+
+async def ask_google_llm(prompt: str) -> str:
+    started = time.perf_counter()
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
+        response = await client.aio.models.generate_content(
+            model=LLM_MODEL,
             contents=prompt
         )    
     except errors.ClientError as e:
         raise HTTPException(500, detail="LLM quota exceeded. Please retry shortly.")
 
+    record_llm_call("generate", started, prompt, response.text, response.usage_metadata)
     return response.text
+
+async def stream_google_llm(prompt: str):
+    # Yields the answer text chunk by chunk as the model generates it
+    started = time.perf_counter()
+    parts, usage = [], None
+    try:
+        stream = await client.aio.models.generate_content_stream(
+            model=LLM_MODEL,
+            contents=prompt
+        )
+        async for chunk in stream:
+            usage = chunk.usage_metadata or usage
+            if chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
+    except errors.ClientError as e:
+        raise HTTPException(500, detail="LLM quota exceeded. Please retry shortly.")
+    record_llm_call("stream", started, prompt, "".join(parts), usage)
     
+# Question -> SQL cache
+# The first LLM call only depends on the question and the schema/rules it is shown, so
+# its SQL is cached under (normalized question, schema version). Entries live in an
+# in-memory LRU with a TTL and, optionally, in a SQLite file so they survive restarts.
+CACHE_DB_FILE = DATA_DIR / "llm_cache.db"
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "2048"))
+SQL_CACHE_TTL_SECONDS = int(os.getenv("SQL_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SQL_CACHE_PERSIST = os.getenv("SQL_CACHE_PERSIST", "1") == "1"
+
+SCHEMA_VERSION = hashlib.sha256((db_schema + SQL_RULES).encode()).hexdigest()[:16]
+
+class LRUCache:
+    def __init__(self, name: str, max_entries: int, ttl_seconds: int, db_file=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_file = db_file
+        self.entries = OrderedDict()   # key -> (value, expires_at)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        if db_file:
+            conn = sqlite3.connect(db_file)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    cache TEXT,
+                    key TEXT,
+                    value TEXT,
+                    expires_at REAL,
+                    PRIMARY KEY (cache, key)
+                )
+            """)
+            conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+            conn.close()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] < now:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+                return entry[0]
+
+        entry = self._load(key, now)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return entry[0]
+
+    def put(self, key: str, value):
+        entry = (value, time.time() + self.ttl_seconds)
+        with self.lock:
+            self._remember(key, entry)
+        if self.db_file:
+            conn = sqlite3.connect(self.db_file)
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries(cache, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.name, key, json.dumps(value), entry[1]),
+            )
+            conn.commit()
+            conn.close()
+
+    def delete(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.db_file:
+            conn = sqlite3.connect(self.db_file)
+            conn.execute("DELETE FROM cache_entries WHERE cache = ? AND key = ?", (self.name, key))
+            conn.commit()
+            conn.close()
+
+    def discard_if(self, predicate):
+        # Drops in-memory entries whose value matches predicate (persisted ones expire)
+        with self.lock:
+            for key in [k for k, (value, _) in self.entries.items() if predicate(value)]:
+                del self.entries[key]
+
+    def _remember(self, key: str, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load(self, key: str, now: float):
+        if not self.db_file:
+            return None
+        conn = sqlite3.connect(self.db_file)
+        row = conn.execute(
+            "SELECT value, expires_at FROM cache_entries WHERE cache = ? AND key = ?", (self.name, key)
+        ).fetchone()
+        conn.close()
+        if not row or row[1] < now:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+SQL_CACHE = LRUCache("sql", SQL_CACHE_SIZE, SQL_CACHE_TTL_SECONDS, CACHE_DB_FILE if SQL_CACHE_PERSIST else None)
+
+def normalize_question(question: str) -> str:
+    # Case, whitespace and trailing punctuation don't change the SQL
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip(" ?!.")
+
+def sql_cache_key(question: str) -> str:
+    return hashlib.sha256(f"{SCHEMA_VERSION}\n{normalize_question(question)}".encode()).hexdigest()
+
+# Answer cache
+# The phrased answer only depends on the question, the SQL and its result rows, so it is
+# cached per store under a hash of the three. Each entry also remembers the generation of
+# every table of its store that its SQL reads; a sync that changes one of them bumps its
+# generation, which drops the dependent entries.
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "4096"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+ANSWER_CACHE = LRUCache("answer", ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS)
+
+# Rollup tables change whenever their source tables do
+ROLLUP_SOURCES = {
+    "inventory_totals": ("variants", "inventory"),
+    "sales_daily": ("orders", "order_items", "products"),
+}
+TABLE_GENERATIONS = {}   # (store_id, table) -> number of syncs that changed it
+
+def tables_read(sql: str) -> list:
+    return sorted({t for t in table_aliases(sql).values() if t in UPSERT_SQL or t in ROLLUP_SOURCES})
+
+def bump_table_generations(store_id: str, rows_changed_by_table: dict):
+    changed = {t for t, n in rows_changed_by_table.items() if n}
+    changed |= {rollup for rollup, sources in ROLLUP_SOURCES.items() if changed & set(sources)}
+    for table in changed:
+        TABLE_GENERATIONS[(store_id, table)] = TABLE_GENERATIONS.get((store_id, table), 0) + 1
+    if changed:
+        ANSWER_CACHE.discard_if(
+            lambda value: value["store_id"] == store_id and bool(changed & set(value["generations"]))
+        )
+
+def answer_cache_key(store_id: str, question: str, sql: str, result: dict) -> str:
+    result_hash = hashlib.sha256(json.dumps(result, sort_keys=True, default=str).encode()).hexdigest()
+    return hashlib.sha256(f"{store_id}\n{normalize_question(question)}\n{sql}\n{result_hash}".encode()).hexdigest()
+
+def get_cached_answer(key: str):
+    entry = ANSWER_CACHE.get(key)
+    if entry is None:
+        return None
+    if any(TABLE_GENERATIONS.get((entry["store_id"], t), 0) != g for t, g in entry["generations"].items()):
+        ANSWER_CACHE.delete(key)
+        return None
+    return entry["answer"]
+
+def cache_answer(key: str, store_id: str, sql: str, answer: str):
+    generations = {t: TABLE_GENERATIONS.get((store_id, t), 0) for t in tables_read(sql)}
+    ANSWER_CACHE.put(key, {"answer": answer, "store_id": store_id, "generations": generations})
+
+# Intent fast path
+# Frequent question shapes are matched locally against a library of templates and
+# answered with vetted, parameterized SQL and a fixed phrasing, without either LLM call.
+# A template has to match the whole normalized question (after polite filler and a
+# trailing time range are taken off), and its formatter can still decline once it sees
+# the data, e.g. when the entity asked about matches no product. Everything else goes to
+# the LLM path.
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "1") == "1"
+INTENT_MAX_TOP_N = 50
+# Longer lookbacks ("the last 100 years") are left to the LLM
+INTENT_MAX_RANGE_DAYS = 10 * 365
+INTENT_STATS = {"questions": 0, "hits": 0, "declined": 0, "by_intent": {}}
+_intent_stats_lock = threading.Lock()
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twelve": 12, "twenty": 20, "thirty": 30,
+}
+# Counts in a question are digits or one of the number words, never any other word
+NUMBER_RE = r"\d+|" + "|".join(NUMBER_WORDS)
+UNIT_DAYS = {"day": 1, "week": 7, "month": 30, "year": 365}
+# Plural nouns that are not product names
+NON_PRODUCT_ENTITIES = {"orders", "customers", "variants", "locations", "sales", "stores", "shops"}
+
+FILLER_RE = re.compile(r"^(?:(?:please|hey|hi|can you|could you|tell me|show me|give me|i want to know|so)\s+)+")
+TIME_RANGE_RE = re.compile(
+    r"\s+(?:(?:in|over|during|for|from)\s+)?(?:the\s+)?"
+    r"(?P<phrase>today|yesterday|this (?:week|month|year)|(?:last|past)\s+(?:(?P<n>" + NUMBER_RE + r")\s+)?(?P<unit>day|week|month|year)s?)$"
+)
+
+def parse_number(word):
+    if word is None:
+        return 1
+    return int(word) if word.isdigit() else NUMBER_WORDS.get(word)
+
+def parse_time_range(question: str, today):
+    # Returns (question without the range, (start_day, end_day, label) or None), or None
+    # when the trailing range can't be understood
+    m = TIME_RANGE_RE.search(question)
+    if not m:
+        return question, None
+    phrase = m.group("phrase")
+    tomorrow = today + timedelta(days=1)
+    if phrase == "today":
+        start, end = today, tomorrow
+    elif phrase == "yesterday":
+        start, end = today - timedelta(days=1), today
+    elif phrase == "this week":
+        start, end = today - timedelta(days=today.weekday()), tomorrow
+    elif phrase == "this month":
+        start, end = today.replace(day=1), tomorrow
+    elif phrase == "this year":
+        start, end = today.replace(month=1, day=1), tomorrow
+    elif m.group("n") is None and phrase.startswith("last") and m.group("unit") in ("month", "year"):
+        # "last month" / "last year" is the previous calendar month / year
+        if m.group("unit") == "month":
+            end = today.replace(day=1)
+            start = (end - timedelta(days=1)).replace(day=1)
+            label = f"in {start:%B %Y}"
+        else:
+            start, end = today.replace(year=today.year - 1, month=1, day=1), today.replace(month=1, day=1)
+            label = f"in {start.year}"
+        return question[:m.start()], (start.isoformat(), end.isoformat(), label)
+    else:
+        n = parse_number(m.group("n"))
+        if not n or n * UNIT_DAYS[m.group("unit")] > INTENT_MAX_RANGE_DAYS:
+            return None
+        # The last N days end with today, so they start N - 1 days before it
+        start, end = tomorrow - timedelta(days=n * UNIT_DAYS[m.group("unit")]), tomorrow
+        if m.group("unit") in ("month", "year"):
+            # Counted as 30 / 365 days, so the answer names the dates it covers
+            label = f"from {start.isoformat()} to {today.isoformat()}"
+            return question[:m.start()], (start.isoformat(), end.isoformat(), label)
+    label = phrase if phrase in ("today", "yesterday") or phrase.startswith("this") else f"in the {phrase}"
+    return question[:m.start()], (start.isoformat(), end.isoformat(), label)
+
+def range_filter(column: str, time_range) -> tuple:
+    # Days and ISO timestamps compare correctly as strings
+    if not time_range:
+        return "1 = 1", ()
+    return f"{column} >= ? AND {column} < ?", time_range[:2]
+
+def range_label(time_range) -> str:
+    return f" {time_range[2]}" if time_range else ""
+
+def like_pattern(text: str) -> str:
+    return "%" + re.sub(r"([%_\\])", r"\\\1", text) + "%"
+
+def format_money(amount, currency) -> str:
+    return f"{amount or 0:,.2f}" + (f" {currency}" if currency else "")
+
+def build_product_count(m, time_range):
+    if time_range:
+        return None
+    sql = "SELECT COUNT(*) AS products FROM products"
+    return sql, (), lambda r: f"You have {r['rows'][0][0]:,} products."
+
+def build_inventory_count(m, time_range):
+    entity = m.group("entity").strip()
+    if time_range or entity in NON_PRODUCT_ENTITIES or entity in ("products", "items", "units"):
+        return None
+    singular = entity[:-1] if entity.endswith("s") and not entity.endswith("ss") else entity
+    sql = """
+        SELECT COUNT(DISTINCT p.product_id) AS products, COALESCE(SUM(it.total_available), 0) AS available
+        FROM products p
+        LEFT JOIN inventory_totals it ON it.product_id = p.product_id
+        WHERE p.title LIKE ? ESCAPE '\\' OR p.product_type LIKE ? ESCAPE '\\'
+    """
+    pattern = like_pattern(singular)
+
+    def answer(result):
+        products, available = result["rows"][0]
+        if not products:
+            return None   # not a product we know; let the LLM interpret the question
+        return f"You have {available:,} {entity} in stock across {products:,} product{'s' if products != 1 else ''}."
+    return sql, (pattern, pattern), answer
+
+def build_total_inventory(m, time_range):
+    if time_range:
+        return None
+    sql = "SELECT COALESCE(SUM(total_available), 0) AS available FROM inventory_totals"
+    return sql, (), lambda r: f"You have {r['rows'][0][0]:,} units in stock."
+
+def build_order_count(m, time_range):
+    where, params = range_filter("created_at", time_range)
+    sql = f"SELECT COUNT(*) AS orders FROM orders WHERE {where}"
+    return sql, params, lambda r: f"You received {r['rows'][0][0]:,} orders{range_label(time_range)}."
+
+def build_revenue(m, time_range):
+    where, params = range_filter("day", time_range)
+    sql = f"""
+        SELECT ROUND(COALESCE(SUM(revenue), 0), 2) AS revenue, COALESCE(SUM(units), 0) AS units,
+               (SELECT currency FROM shop LIMIT 1) AS currency
+        FROM sales_daily
+        WHERE {where}
+    """
+
+    def answer(result):
+        revenue, units, currency = result["rows"][0]
+        return f"Your revenue{range_label(time_range)} was {format_money(revenue, currency)} from {units:,} units sold."
+    return sql, params, answer
+
+def build_top_products(m, time_range):
+    n = parse_number(m.group("n")) if m.group("n") else 5
+    if not n or n > INTENT_MAX_TOP_N:
+        return None
+    metric = "revenue" if m.group("metric") in ("revenue", "sales") else "units"
+    where, params = range_filter("s.day", time_range)
+    sql = f"""
+        SELECT COALESCE(p.title, s.product_id) AS product, SUM(s.units) AS units,
+               ROUND(SUM(s.revenue), 2) AS revenue, (SELECT currency FROM shop LIMIT 1) AS currency
+        FROM sales_daily s
+        LEFT JOIN products p ON p.product_id = s.product_id
+        WHERE {where}
+        GROUP BY s.product_id
+        ORDER BY {metric} DESC, product
+        LIMIT ?
+    """
+
+    def answer(result):
+        if not result["rows"]:
+            return f"There were no sales{range_label(time_range)}."
+        by = "revenue" if metric == "revenue" else "units sold"
+        lines = [
+            f"{i}. {product}: {units:,} units, {format_money(revenue, currency)}"
+            for i, (product, units, revenue, currency) in enumerate(result["rows"], start=1)
+        ]
+        return f"Top {len(lines)} products by {by}{range_label(time_range)}:\n" + "\n".join(lines)
+    return sql, (*params, n), answer
+
+def build_out_of_stock(m, time_range):
+    if time_range:
+        return None
+    sql = """
+        SELECT p.title AS product
+        FROM products p
+        JOIN inventory_totals it ON it.product_id = p.product_id
+        GROUP BY p.product_id
+        HAVING SUM(it.total_available) <= 0
+        ORDER BY p.title
+    """
+
+    def answer(result):
+        total = result["summary"]["total_rows"] if result["truncated"] else len(result["rows"])
+        if not total:
+            return "No products are out of stock."
+        names = [r[0] for r in result["rows"][:20]]
+        more = f", and {total - len(names):,} more" if total > len(names) else ""
+        return f"{total:,} product{'s are' if total != 1 else ' is'} out of stock: {', '.join(names)}{more}."
+    return sql, (), answer
+
+INTENTS = [
+    ("product_count", re.compile(
+        r"(?:how many (?:different |distinct )?products (?:do i have|do we have|are there|have i got)"
+        r"|(?:what is |what's )?(?:the )?(?:number|count) of (?:my )?products)"
+    ), build_product_count),
+    ("total_inventory", re.compile(
+        r"(?:how much (?:inventory|stock) do (?:i|we) have|how many (?:units|items) (?:do (?:i|we) have )?in stock"
+        r"|(?:what is |what's )?(?:my |our )?total (?:inventory|stock))"
+    ), build_total_inventory),
+    ("order_count", re.compile(
+        r"how many orders(?: (?:did (?:i|we) (?:get|receive)|have (?:i|we) (?:had|received|got)|were (?:placed|made)|do (?:i|we) have))?"
+    ), build_order_count),
+    ("inventory_count", re.compile(
+        r"how many (?P<entity>[a-z0-9][a-z0-9 '-]*?)"
+        r" (?:do (?:i|we) have(?: (?:left|available|in stock))?|are (?:left|available|in stock))"
+    ), build_inventory_count),
+    ("revenue", re.compile(
+        r"(?:what (?:is|was|were) )?(?:my |our |the )?(?:total )?(?:revenue|sales|income)"
+        r"|how much (?:revenue |money )?did (?:i|we) (?:make|earn|sell)"
+    ), build_revenue),
+    ("top_products", re.compile(
+        r"(?:what (?:are|were) |show |list )?(?:my |our |the )?(?:top|best[- ]selling)(?: (?P<n>" + NUMBER_RE + r"))?"
+        r" (?:best[- ]selling )?products?(?: by (?P<metric>units(?: sold)?|quantity|revenue|sales))?"
+        r"|(?:what are |show )?(?:my |our |the )?best ?sellers"
+    ), build_top_products),
+    ("out_of_stock", re.compile(
+        r"(?:which|what) products are (?:out of stock|sold out)|(?:list |show )?(?:my |all )?(?:out of stock|sold out) products"
+    ), build_out_of_stock),
+]
+
+def match_intent(question: str):
+    # (name, sql, params, answer) of the first template that fits, or None
+    text = FILLER_RE.sub("", normalize_question(question))
+    parsed = parse_time_range(text, datetime.utcnow().date())
+    if parsed is None:
+        return None
+    text, time_range = parsed
+    for name, pattern, build in INTENTS:
+        m = pattern.fullmatch(text)
+        if m:
+            built = build(m, time_range)
+            if built:
+                return (name, *built)
+    return None
+
+def record_intent(name, answered: bool):
+    with _intent_stats_lock:
+        INTENT_STATS["questions"] += 1
+        if answered:
+            INTENT_STATS["hits"] += 1
+            INTENT_STATS["by_intent"][name] = INTENT_STATS["by_intent"].get(name, 0) + 1
+        elif name:
+            INTENT_STATS["declined"] += 1
+    INTENT_QUESTIONS.inc(outcome="answered" if answered else "declined" if name else "unmatched")
+
+def intent_stats() -> dict:
+    with _intent_stats_lock:
+        questions = INTENT_STATS["questions"]
+        return {
+            **INTENT_STATS,
+            "by_intent": dict(INTENT_STATS["by_intent"]),
+            "hit_rate": round(INTENT_STATS["hits"] / questions, 3) if questions else None,
+        }
+
+async def answer_intent(store_id: str, question: str):
+    # The fast-path answer ({"intent", "sql", "answer", "meta"}), or None to use the LLM
+    if not INTENT_FAST_PATH:
+        return None
+    match = match_intent(question)
+    if not match:
+        record_intent(None, False)
+        return None
+    name, sql, params, phrase = match
+    try:
+        result = await run_in_db_executor(run_sql, store_id, sql, params)
+    except sqlite3.Error as e:
+        print(f"Intent {name} failed, falling back to the LLM:", e)
+        record_intent(name, False)
+        return None
+    answer = phrase(result)
+    record_intent(name, answer is not None)
+    if answer is None:
+        return None
+    meta = result_meta(result)
+    meta["intent"] = name
+    return {"intent": name, "sql": " ".join(sql.split()), "answer": answer, "meta": meta}
+
 # Main code
-@app.post("/api/v1/ask")
-def ask(req: AskRequest):
-    if not req.store_id or not req.question or not req.shopify_token:
-        raise HTTPException(status_code=400, detail="Missing fields")
+# Prompt building and query execution shared by the single and batch endpoints
+NO_DATA_ANSWER = "Data is unavailable for this question."
 
-    # Initialize all variables
-    store_id = req.store_id
-    token = req.shopify_token
-    question = req.question
-    
-    prompt1 = f"""
+def build_sql_prompt(question: str) -> str:
+    return f"""
         You are an analytics assistant. You must refer to the database schema below and adhere to the rules based on the given question.
         {db_schema}
-        Rules:
-        - Generate ONLY valid SQLite SQL
-        - SELECT queries only
-        - Use only the tables and columns provided
-        - Do NOT explain the query
-        - Do NOT include markdown
-        - Do NOT include comments
-        - If the question cannot be answered, return: INVALID
-        - use 'inventory_totals' to access inventory levels
-        - if you are asked about product types, refer to product.title
+        {SQL_RULES}
 
         {question}
         """
-    # Start collecting user's data
-    if should_sync(store_id):
-        raw_data = ingest_shopify_data(store_id, token)
-        normalize_all_raw_data(raw_data)
-        LAST_SYNC[store_id] = datetime.utcnow()
 
-    # Send first prompt to llm. This returns a sql statement to query local db
-    sql = ask_google_llm(prompt1).strip()
+def result_meta(result: dict) -> dict:
+    return {
+        "rows_total": result["summary"]["total_rows"] if result["truncated"] else len(result["rows"]),
+        "rows_in_prompt": len(result["rows"]),
+        "truncated": result["truncated"],
+    }
+
+def describe_result(result: dict, meta: dict) -> str:
+    # Rows as CSV, plus the summary over all rows when only part of them is listed
+    text = f"""
+        Query result (CSV, first line is the header):
+        {encode_result_csv(result)}"""
+    if result["truncated"]:
+        text += f"""
+        The query returned {meta['rows_total']} rows; only the first {meta['rows_in_prompt']} are listed above.
+        Summary over all rows (JSON):
+        {json.dumps(result['summary'], default=str)}
+        """
+    meta["result_tokens_est"] = estimate_tokens(text)
+    return text
+
+def build_answer_prompt(question: str, sql: str, result_text: str) -> str:
+    return f"""
+        You are an analytics assistant.
+
+        User question:
+        {question}
+
+        SQL that was executed:
+        {sql}
+        {result_text}
+        Rules:
+        - Use ONLY the data in the result.
+        - Do NOT invent numbers.
+        - If only part of the rows is listed, use the summary for counts and totals.
+        - Respond in plain English. The answer must be simple and to the point.
+        """
+
+async def execute_sql(store_id: str, cache_key: str, sql: str) -> dict:
+    # Bounded execution; large results come with a summary
+    try:
+        return await run_in_db_executor(run_sql, store_id, sql)
+    except sqlite3.Error as e:
+        await run_in_db_executor(SQL_CACHE.delete, cache_key)  # don't keep serving SQL that fails
+        if isinstance(e, QueryBudgetExceeded):
+            raise HTTPException(status_code=422, detail=str(e)) from e
+        raise
+
+# One question runs as a sequence of events: progress ("status", "sql", "rows"), answer
+# text ("token") and finally ("answer", {"answer", "meta"}). /ask only keeps the result, /ask/stream
+# forwards every event to the client as server-sent events.
+async def answer_events(req: AskRequest, stream: bool = False):
+    # Initialize all variables
+    store_id = req.store_id
+    token = req.shopify_token
+    question = req.question
+
+    # Make sure the store has a snapshot; later refreshes run in the background scheduler
+    yield "status", {"stage": "syncing"}
+    with timed("sync"):
+        await ensure_snapshot(store_id, token)
+
+    # Common question shapes are answered from vetted SQL, without the LLM
+    with timed("intent"):
+        fast = await answer_intent(store_id, question)
+    if fast:
+        yield "sql", {"sql": fast["sql"], "cached": False, "intent": fast["intent"]}
+        yield "rows", dict(fast["meta"])
+        if stream:
+            yield "token", {"text": fast["answer"]}
+        yield "answer", {"answer": fast["answer"], "meta": fast["meta"]}
+        return
+
+    # Send first prompt to llm (unless the question was seen before). This returns a sql statement to query local db
+    yield "status", {"stage": "generating_sql"}
+    cache_key = sql_cache_key(question)
+    sql = await run_in_db_executor(SQL_CACHE.get, cache_key)
+    cached = sql is not None
+    if sql is None:
+        with timed("llm_sql"):
+            sql = (await ask_google_llm(build_sql_prompt(question))).strip()
+        if sql == "INVALID" or is_safe_sql(sql):
+            await run_in_db_executor(SQL_CACHE.put, cache_key, sql)
 
     # Validate the sql statement
     if sql == "INVALID":
         print("Question cannot be answered")
+        yield "answer", None
         return
 
     if not is_safe_sql(sql):
         raise ValueError("Unsafe SQL")
+    yield "sql", {"sql": sql, "cached": cached}
 
     # Execute the sql statement
-    rows = run_sql(sql)
-
-    if not rows:
-        return {"answer": "Data is unavailable for this question."}
+    with timed("run_sql"):
+        result = await execute_sql(store_id, cache_key, sql)
+    meta = result_meta(result)
+    yield "rows", dict(meta)
+
+    if not result["rows"]:
+        if stream:
+            yield "token", {"text": NO_DATA_ANSWER}
+        yield "answer", {"answer": NO_DATA_ANSWER, "meta": meta}
+        return
 
     # Second prompt to get plain English answer based on the sql query output
-    prompt2 = f"""
-        You are an analytics assistant.
+    prompt2 = build_answer_prompt(question, sql, describe_result(result, meta))
+    meta["prompt_tokens_est"] = estimate_tokens(prompt2)
+
+    # Same question, SQL and result as before (and no sync touched its tables since): reuse the answer
+    answer_key = answer_cache_key(store_id, question, sql, result)
+    answer = get_cached_answer(answer_key)
+    meta["answer_cached"] = answer is not None
+    if answer is not None:
+        if stream:
+            yield "token", {"text": answer}
+        yield "answer", {"answer": answer, "meta": meta}
+        return
 
-        User question:
+    # Ask llm to construct final answer
+    yield "status", {"stage": "answering"}
+    with timed("llm_answer"):
+        if stream:
+            parts = []
+            async for text in stream_google_llm(prompt2):
+                parts.append(text)
+                yield "token", {"text": text}
+            answer = "".join(parts)
+        else:
+            answer = await ask_google_llm(prompt2)
+    cache_answer(answer_key, store_id, sql, answer)
+    meta["answer_tokens_est"] = estimate_tokens(answer)
+
+    yield "answer", {"answer": answer, "meta": meta}
+
+# Batches
+# Questions asked together for one store share a single snapshot check, one LLM call
+# that writes the SQL of every uncached question, parallel execution on the read pool,
+# and one LLM call that phrases every answer not found in the answer cache. If the
+# model's reply can't be parsed as the expected JSON array, the affected questions fall
+# back to one call each.
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "20"))
+
+def parse_json_list(text: str, length: int):
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != length or not all(isinstance(i, str) for i in items):
+        return None
+    return [i.strip() for i in items]
+
+async def generate_sql_batch(questions: list) -> list:
+    numbered = "\n".join(f"        {n}. {q}" for n, q in enumerate(questions, start=1))
+    prompt = f"""
+        You are an analytics assistant. You must refer to the database schema below and adhere to the rules for each of the numbered questions.
+        {db_schema}
+        {SQL_RULES}
+        Return ONLY a JSON array with one string per question, in the same order: the question's SQL, or INVALID.
+
+{numbered}
+        """
+    statements = parse_json_list(await ask_google_llm(prompt), len(questions))
+    if statements is None:
+        statements = [s.strip() for s in await asyncio.gather(*(ask_google_llm(build_sql_prompt(q)) for q in questions))]
+    return statements
+
+async def phrase_answers_batch(items: list) -> list:
+    # items: (question, sql, result_text)
+    sections = "\n".join(
+        f"""
+        Question {n}:
         {question}
 
         SQL that was executed:
         {sql}
-
-        Query result (JSON):
-        {json.dumps(rows, indent=2)}
+        {result_text}"""
+        for n, (question, sql, result_text) in enumerate(items, start=1)
+    )
+    prompt = f"""
+        You are an analytics assistant. Answer each of the numbered questions below from its own query result.
+        {sections}
 
         Rules:
-        - Use ONLY the data in the result.
+        - Use ONLY the data in each question's result.
         - Do NOT invent numbers.
-        - Respond in plain English. The answer must be simple and to the point.
+        - If only part of the rows is listed, use the summary for counts and totals.
+        - Respond in plain English. Each answer must be simple and to the point.
+        - Return ONLY a JSON array with one answer string per question, in the same order.
         """
-    # Ask llm to construct final answer
-    answer = ask_google_llm(prompt2)
+    answers = parse_json_list(await ask_google_llm(prompt), len(items))
+    if answers is None:
+        answers = await asyncio.gather(*(ask_google_llm(build_answer_prompt(*item)) for item in items))
+    return answers
+
+async def answer_batch(req: AskBatchRequest) -> list:
+    store_id = req.store_id
+    with timed("sync"):
+        await ensure_snapshot(store_id, req.shopify_token)
+    results = [{"question": q} for q in req.questions]
+
+    # Fast path first; only the questions it can't answer go to the LLM
+    pending = []
+    with timed("intent"):
+        fast_answers = await asyncio.gather(*(answer_intent(store_id, q) for q in req.questions))
+    for i, fast in enumerate(fast_answers):
+        if fast:
+            results[i].update(sql=fast["sql"], meta=fast["meta"], answer=fast["answer"])
+        else:
+            pending.append(i)
+
+    # SQL: cached statements first, one LLM call for the rest
+    cache_keys = {i: sql_cache_key(req.questions[i]) for i in pending}
+    cached = await asyncio.gather(*(run_in_db_executor(SQL_CACHE.get, cache_keys[i]) for i in pending))
+    statements = dict(zip(pending, cached))
+    missing = [i for i in pending if statements[i] is None]
+    if missing:
+        with timed("llm_sql"):
+            generated = await generate_sql_batch([req.questions[i] for i in missing])
+        for i, sql in zip(missing, generated):
+            statements[i] = sql
+            if sql == "INVALID" or is_safe_sql(sql):
+                await run_in_db_executor(SQL_CACHE.put, cache_keys[i], sql)
+
+    # Execute every valid statement in parallel
+    runnable = []
+    for i in pending:
+        sql = statements[i]
+        if sql == "INVALID":
+            results[i]["answer"] = None
+        elif not is_safe_sql(sql):
+            results[i]["error"] = {"status": 400, "detail": "Unsafe SQL"}
+        else:
+            results[i]["sql"] = sql
+            runnable.append(i)
+    with timed("run_sql"):
+        executed = await asyncio.gather(
+            *(execute_sql(store_id, cache_keys[i], statements[i]) for i in runnable), return_exceptions=True
+        )
+
+    # Answers: no data, answer cache, or one LLM call for the rest
+    to_phrase = []
+    for i, result in zip(runnable, executed):
+        if isinstance(result, Exception):
+            status = result.status_code if isinstance(result, HTTPException) else 500
+            detail = result.detail if isinstance(result, HTTPException) else str(result)
+            results[i]["error"] = {"status": status, "detail": detail}
+            continue
+        meta = results[i]["meta"] = result_meta(result)
+        if not result["rows"]:
+            results[i]["answer"] = NO_DATA_ANSWER
+            continue
+        result_text = describe_result(result, meta)
+        answer_key = answer_cache_key(store_id, req.questions[i], statements[i], result)
+        answer = get_cached_answer(answer_key)
+        meta["answer_cached"] = answer is not None
+        if answer is not None:
+            results[i]["answer"] = answer
+        else:
+            to_phrase.append((i, answer_key, (req.questions[i], statements[i], result_text)))
+
+    if to_phrase:
+        with timed("llm_answer"):
+            answers = await phrase_answers_batch([item for _, _, item in to_phrase])
+        for (i, answer_key, _), answer in zip(to_phrase, answers):
+            results[i]["answer"] = answer
+            results[i]["meta"]["answer_tokens_est"] = estimate_tokens(answer)
+            cache_answer(answer_key, store_id, statements[i], answer)
+    return results
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/v1/ask")
+async def ask(req: AskRequest):
+    if not req.store_id or not req.question or not req.shopify_token:
+        raise HTTPException(status_code=400, detail="Missing fields")
+
+    async for event, data in answer_events(req):
+        if event == "answer":
+            return data
+
+@app.post("/api/v1/ask/batch")
+async def ask_batch(req: AskBatchRequest):
+    if not req.store_id or not req.questions or not req.shopify_token or not all(req.questions):
+        raise HTTPException(status_code=400, detail="Missing fields")
+    if len(req.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+
+    return {"answers": await answer_batch(req)}
+
+@app.post("/api/v1/ask/stream")
+async def ask_stream(req: AskRequest):
+    if not req.store_id or not req.question or not req.shopify_token:
+        raise HTTPException(status_code=400, detail="Missing fields")
+
+    async def events():
+        # Headers are already sent once streaming starts, so failures become an error event
+        try:
+            async for event, data in answer_events(req, stream=True):
+                if event == "answer":
+                    yield sse_event("done", data if data is not None else {"answer": None})
+                else:
+                    yield sse_event(event, data)
+        except HTTPException as e:
+            yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            yield sse_event("error", {"status": 500, "detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/v1/sync/{store_id}")
+async def trigger_sync(store_id: str, full: bool = False):
+    # On-demand sync of a known store; full=true forces a complete re-crawl
+    if store_id not in KNOWN_STORES:
+        raise HTTPException(status_code=404, detail="Unknown store")
+    if store_id in SCHEDULED_SYNCS and not full:
+        return {"status": "already scheduled", "full": full}
+    schedule_sync(store_id, full)
+    return {"status": "scheduled", "full": full}
+
+@app.put("/api/v1/sync/{store_id}/mode")
+def update_ingest_mode(store_id: str, mode: str):
+    if mode not in INGEST_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown ingest mode, expected one of: {', '.join(INGEST_MODES)}")
+    set_ingest_mode(store_id, mode)
+    return {"store_id": store_id, "mode": mode}
+
+@app.post("/api/v1/webhooks", status_code=202)
+async def receive_webhook(event: WebhookEvent):
+    if event.topic not in WEBHOOK_TOPICS:
+        raise HTTPException(status_code=400, detail=f"Unsupported webhook topic: {event.topic}")
+    queued = await asyncio.to_thread(enqueue_webhook, event)
+    WEBHOOK_EVENTS.inc(topic=event.topic, outcome="queued" if queued else "duplicate")
+    LAST_WEBHOOK[event.store_id] = datetime.utcnow()
+    WEBHOOK_WAKEUP.set()
+    return {"status": "queued" if queued else "duplicate"}
+
+@app.get("/api/v1/webhooks/status")
+def get_webhook_status(store_id: str = None):
+    return webhook_status(store_id)
+
+@app.post("/api/v1/webhooks/replay")
+def trigger_webhook_replay(store_id: str, since: str):
+    try:
+        datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be an ISO-8601 timestamp")
+    requeued = replay_webhooks(store_id, since)
+    WEBHOOK_WAKEUP.set()
+    return {"store_id": store_id, "requeued": requeued}
+
+@app.get("/api/v1/sync/status")
+def get_sync_status(store_id: str = None):
+    if store_id:
+        if store_id not in SYNC_STATUS:
+            raise HTTPException(status_code=404, detail="Unknown store")
+        return sync_status(store_id)
+    return {s: sync_status(s) for s in list(SYNC_STATUS)}
+
+@app.get("/api/v1/admin/query-report")
+def get_query_report(limit: int = 20):
+    return query_report(limit)
+
+@app.get("/api/v1/intents/stats")
+def get_intent_stats():
+    return intent_stats()
+
+@app.get("/api/v1/cache/stats")
+def get_cache_stats():
+    return {"sql": SQL_CACHE.stats(), "answer": ANSWER_CACHE.stats()}
+
+@app.get("/api/v1/profiles")
+def list_profiles():
+    return {
+        "enabled": PROFILE_REQUESTS,
+        "slow_ms": PROFILE_SLOW_MS,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "profiles": REQUEST_PROFILER.list(),
+    }
 
-    return answer
+@app.get("/api/v1/profiles/{request_id}")
+def get_profile(request_id: str, format: str = "json"):
+    # format=folded downloads the stack samples for flamegraph.pl / speedscope
+    profile = REQUEST_PROFILER.get(request_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No profile kept for this request")
+    if format == "folded":
+        folded = "".join(f"{stack} {n}\n" for stack, n in profile["stacks"].items())
+        return PlainTextResponse(folded, headers={"Content-Disposition": f'attachment; filename="{request_id}.folded"'})
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or folded")
+    return profile
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/helloworld")
 def helloworld():
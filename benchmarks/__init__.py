@@ -0,0 +1,3 @@
+"""Offline benchmarks for the backend: synthetic stores, a fake Shopify GraphQL API
+and a fake LLM, so sync and ask performance can be measured without a dev store or
+a Gemini key. Run with `python -m benchmarks.run --help`."""
@@ -0,0 +1,65 @@
+"""A fixed-latency stand-in for the Gemini calls (ask_google_llm / stream_google_llm).
+
+It recognizes the backend's prompts: a question's SQL prompt gets SQL picked by
+keyword, a phrasing prompt gets a canned answer, and the batch prompts get JSON
+arrays of either."""
+import asyncio
+import json
+import re
+
+# First keyword found in the question decides the SQL
+KEYWORD_SQL = [
+    ("vendor", "SELECT vendor, ROUND(SUM(revenue), 2) AS revenue FROM sales_daily GROUP BY vendor ORDER BY revenue DESC"),
+    ("customer", "SELECT customer_id, COUNT(*) AS orders FROM orders GROUP BY customer_id ORDER BY orders DESC LIMIT 10"),
+    ("average", "SELECT ROUND(AVG(total), 2) AS average_order_value FROM "
+                "(SELECT order_id, SUM(quantity * price) AS total FROM order_items GROUP BY order_id)"),
+    ("location", "SELECT location_id, SUM(available) AS available FROM inventory GROUP BY location_id"),
+    ("line item", "SELECT * FROM order_items"),
+    ("price", "SELECT p.title, v.price FROM variants v JOIN products p ON p.product_id = v.product_id ORDER BY v.price DESC LIMIT 10"),
+]
+DEFAULT_SQL = "SELECT COUNT(*) AS products FROM products"
+ANSWER = "Based on the query result, here is the answer to your question."
+
+
+def sql_for(question: str) -> str:
+    question = question.lower()
+    for keyword, sql in KEYWORD_SQL:
+        if keyword in question:
+            return sql
+    return DEFAULT_SQL
+
+
+class FakeLLM:
+    def __init__(self, latency: float = 0.5, stream_chunks: int = 8):
+        self.latency = latency
+        self.stream_chunks = stream_chunks
+        self.calls = 0
+
+    def install(self, backend):
+        # Replaces the backend module's Gemini calls with this fake
+        backend.ask_google_llm = self.ask
+        backend.stream_google_llm = self.stream
+
+    def reply(self, prompt: str) -> str:
+        if "JSON array with one string per question" in prompt:
+            questions = re.findall(r"^\s*\d+\. (.*)$", prompt, re.MULTILINE)
+            return json.dumps([sql_for(q) for q in questions])
+        if "JSON array with one answer string per question" in prompt:
+            return json.dumps([ANSWER] * len(re.findall(r"^\s*Question \d+:$", prompt, re.MULTILINE)))
+        if "database schema below" in prompt:
+            question = [line for line in prompt.strip().splitlines() if line.strip()][-1]
+            return sql_for(question)
+        return ANSWER
+
+    async def ask(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.reply(prompt)
+
+    async def stream(self, prompt: str):
+        self.calls += 1
+        words = self.reply(prompt).split(" ")
+        size = max(1, len(words) // self.stream_chunks)
+        for start in range(0, len(words), size):
+            await asyncio.sleep(self.latency / self.stream_chunks)
+            yield " ".join(words[start:start + size]) + " "
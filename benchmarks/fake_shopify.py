@@ -0,0 +1,195 @@
+"""A local stand-in for the Shopify Admin GraphQL API, serving a SyntheticStore.
+
+It answers the queries the backend sends (Shop, Orders, Products and the nested
+follow-ups), adds a fixed latency per request and meters requests with Shopify's
+leaky bucket: each response reports extensions.cost, and a request that costs more
+than the bucket holds gets a THROTTLED error.
+
+Bulk operations (bulkOperationRunQuery, then node(id) polling) complete at once;
+the status carries the url of the JSONL result, served by the same server."""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .synthetic import SyntheticStore, connection, gid, gid_number
+
+
+def connection_cost(first: int, node_cost: float) -> float:
+    # Shopify's requested cost: 2 per connection plus the cost of each node it may return
+    return 2 + (first or 1) * node_cost
+
+
+def requested_cost(query: str, v: dict) -> float:
+    if "mutation BulkRun" in query:
+        return 10
+    levels = connection_cost(v.get("levelsFirst", 0), 1)
+    variant = 1 + levels
+    if "query Orders" in query:
+        return connection_cost(v["first"], 1 + connection_cost(v["lineItemsFirst"], 1))
+    if "query Products" in query:
+        return connection_cost(v["first"], 1 + connection_cost(v["variantsFirst"], variant))
+    if "query OrderLineItems" in query or "query InventoryLevels" in query:
+        return 1 + connection_cost(v["first"], 1)
+    if "query ProductVariants" in query:
+        return 1 + connection_cost(v["first"], variant)
+    return 1
+
+
+class FakeShopify:
+    def __init__(self, store: SyntheticStore, latency: float = 0.0, bucket_size: float = 1000.0,
+                 restore_rate: float = 50.0, throttle: bool = True):
+        self.store = store
+        self.latency = latency
+        self.bucket_size = bucket_size
+        self.restore_rate = restore_rate
+        self.throttle = throttle
+        self.available = bucket_size
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.bulk_operations = {}   # operation number -> "orders" / "products"
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        # SHOPIFY_GRAPHQL_URL template for the backend
+        return f"http://127.0.0.1:{self.server.server_port}/{{store_id}}/graphql.json"
+
+    def bulk_url(self, number: int) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/bulk/{number}.jsonl"
+
+    def start(self) -> "FakeShopify":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True   # headers and body go out as separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                body = json.dumps(fake.handle(request["query"], request.get("variables") or {})).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                # Bulk operation results
+                match = re.fullmatch(r"/bulk/(\d+)\.jsonl", self.path)
+                kind = fake.bulk_operations.get(int(match.group(1))) if match else None
+                if kind is None:
+                    self.send_error(404)
+                    return
+                if fake.latency:
+                    time.sleep(fake.latency)
+                lines = getattr(fake.store, f"bulk_{kind}")()
+                body = "".join(json.dumps(obj) + "\n" for obj in lines).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/jsonl")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def charge(self, cost: float):
+        # Returns the throttle status after charging cost, or None when throttled
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            self.available = min(self.bucket_size, self.available + (now - self.updated) * self.restore_rate)
+            self.updated = now
+            if self.throttle and cost > self.available:
+                self.throttled += 1
+                return None
+            self.available = max(0.0, self.available - cost)
+            return self.available
+
+    def handle(self, query: str, v: dict) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        cost = requested_cost(query, v)
+        available = self.charge(cost)
+        throttle_status = {
+            "maximumAvailable": self.bucket_size,
+            "currentlyAvailable": self.available,
+            "restoreRate": self.restore_rate,
+        }
+        extensions = {"cost": {"requestedQueryCost": cost, "actualQueryCost": cost if available is not None else None,
+                               "throttleStatus": throttle_status}}
+        if available is None:
+            return {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}], "extensions": extensions}
+        return {"data": self.resolve(query, v), "extensions": extensions}
+
+    def run_bulk_operation(self, bulk_query: str) -> dict:
+        # The benchmark always exports everything, so search filters are ignored here too
+        match = re.match(r"\s*\{\s*(\w+)", bulk_query)
+        kind = match.group(1) if match else None
+        if kind not in ("orders", "products"):
+            return {"bulkOperation": None, "userErrors": [{"field": ["query"], "message": f"Unsupported bulk query: {kind}"}]}
+        with self.lock:
+            number = len(self.bulk_operations) + 1
+            self.bulk_operations[number] = kind
+        return {"bulkOperation": {"id": gid("BulkOperation", number), "status": "CREATED"}, "userErrors": []}
+
+    def bulk_operation(self, operation_id: str) -> dict | None:
+        number = gid_number(operation_id)
+        kind = self.bulk_operations.get(number)
+        if kind is None:
+            return None
+        rows = self.store.expected_rows()
+        tables = ("orders", "order_items") if kind == "orders" else ("products", "variants", "inventory")
+        return {
+            "id": operation_id, "status": "COMPLETED", "errorCode": None,
+            "objectCount": str(sum(rows[t] for t in tables)), "url": self.bulk_url(number),
+        }
+
+    def resolve(self, query: str, v: dict) -> dict:
+        store = self.store
+        if "mutation BulkRun" in query:
+            return {"bulkOperationRunQuery": self.run_bulk_operation(v["query"])}
+        if "query BulkStatus" in query:
+            return {"node": self.bulk_operation(v["id"])}
+        if "query Shop" in query:
+            return {"shop": store.shop()}
+        if "query OrderLineItems" in query:
+            edges = store.line_item_edges(gid_number(v["id"]))
+            return {"order": {"lineItems": connection(edges, v["first"], v.get("after"))}}
+        if "query ProductVariants" in query:
+            edges = store.variant_edges(gid_number(v["id"]), v["levelsFirst"])
+            return {"product": {"variants": connection(edges, v["first"], v.get("after"))}}
+        if "query InventoryLevels" in query:
+            edges = store.level_edges(gid_number(v["id"]))
+            return {"inventoryItem": {"inventoryLevels": connection(edges, v["first"], v.get("after"))}}
+
+        # Top-level pages; the benchmark always crawls everything, so search filters are ignored
+        start, first = int(v.get("after") or 0), v["first"]
+        if "query Orders" in query:
+            total = len(store.orders)
+            edges = [{"node": store.order(i, v["lineItemsFirst"])} for i in range(start, min(total, start + first))]
+            kind = "orders"
+        elif "query Products" in query:
+            total = len(store.products)
+            edges = [
+                {"node": store.product(p, v["variantsFirst"], v["levelsFirst"])}
+                for p in range(start, min(total, start + first))
+            ]
+            kind = "products"
+        else:
+            raise ValueError(f"Unsupported query: {query[:80]}")
+        return {kind: {"pageInfo": {"hasNextPage": start + first < total, "endCursor": str(start + first)}, "edges": edges}}
@@ -0,0 +1,202 @@
+"""Micro-benchmark of the ingest hot loop: decoding Shopify's page responses and turning
+them into bind-ready rows, before and after the tuple-based normalizers.
+
+    python -m benchmarks.normalize
+    python -m benchmarks.normalize --products 5000 --orders 50000 --repeat 5
+
+"before" is the previous implementation, kept below as a reference: stdlib json, a
+dict per row built with chained .get() calls and uncached GID splits, then converted
+to tuples by column name for executemany. "after" is the backend's own path: orjson
+when installed, rows emitted directly as tuples, cached parsing of referenced GIDs. Both must produce
+the same rows; the benchmark checks that before timing anything."""
+import argparse
+import gc
+import json
+import shutil
+import tempfile
+import time
+from operator import itemgetter
+from pathlib import Path
+
+from .run import load_backend, per_second
+from .synthetic import SyntheticStore
+
+
+# Reference: the dict-based normalizers the tuple ones replaced
+def ref_strip_gid(gid):
+    if not gid:
+        return None
+    return gid.split("/")[-1]
+
+
+def ref_normalize_orders(raw_orders):
+    orders, order_items = [], []
+    for edge in raw_orders.get("edges", []):
+        o = edge.get("node")
+        if not o:
+            continue
+        order = {
+            "order_id": ref_strip_gid(o.get("id")),
+            "created_at": o.get("createdAt"),
+            "customer_id": ref_strip_gid(o.get("customer", {}).get("id")) if o.get("customer") else None,
+            "updated_at": o.get("updatedAt"),
+        }
+        orders.append(order)
+        for li_edge in o.get("lineItems", {}).get("edges", []):
+            li = li_edge.get("node")
+            if not li:
+                continue
+            order_items.append({
+                "order_id": order["order_id"],
+                "product_id": ref_strip_gid(li.get("product", {}).get("id")) if li.get("product") else None,
+                "variant_id": ref_strip_gid(li.get("variant", {}).get("id")) if li.get("variant") else None,
+                "quantity": int(li.get("quantity", 0)),
+                "price": float(li.get("originalUnitPriceSet", {}).get("shopMoney", {}).get("amount", 0)),
+            })
+    return {"orders": orders, "order_items": order_items}
+
+
+def ref_normalize_products(raw_products):
+    products, variants, inventory = [], [], []
+    for edge in raw_products.get("edges", []):
+        p = edge.get("node")
+        if not p:
+            continue
+        product = {
+            "product_id": ref_strip_gid(p.get("id")),
+            "title": p.get("title"),
+            "vendor": p.get("vendor"),
+            "product_type": p.get("productType"),
+            "created_at": p.get("createdAt"),
+            "updated_at": p.get("updatedAt"),
+        }
+        products.append(product)
+        for v_edge in p.get("variants", {}).get("edges", []):
+            v = v_edge.get("node")
+            if not v:
+                continue
+            inventory_item = v.get("inventoryItem") or {}
+            inventory_item_id = ref_strip_gid(inventory_item.get("id"))
+            if not inventory_item_id:
+                continue
+            variants.append({
+                "variant_id": ref_strip_gid(v.get("id")),
+                "product_id": product["product_id"],
+                "sku": v.get("sku"),
+                "price": float(v.get("price", 0)),
+                "inventory_item_id": inventory_item_id,
+            })
+            for il_edge in inventory_item.get("inventoryLevels", {}).get("edges", []):
+                il = il_edge.get("node", {})
+                available = 0
+                for q in il.get("quantities", []):
+                    if q.get("name") == "available":
+                        available = int(q.get("quantity", 0))
+                inventory.append({
+                    "inventory_item_id": inventory_item_id,
+                    "location_id": ref_strip_gid(il.get("location", {}).get("id")),
+                    "available": available,
+                    "updated_at": il.get("updatedAt"),
+                })
+    return {"products": products, "variants": variants, "inventory": inventory}
+
+
+def pages(connection: dict, kind: str, page_size: int) -> list:
+    # Response bodies as Shopify sends them, page_size edges each
+    edges = connection["edges"]
+    return [
+        json.dumps({"data": {kind: {"edges": edges[i:i + page_size]}}}).encode()
+        for i in range(0, len(edges), page_size)
+    ]
+
+
+def all_rows(bodies: dict, loads, normalizers: dict, to_rows) -> dict:
+    rows = {}
+    for kind, kind_bodies in bodies.items():
+        for body in kind_bodies:
+            for table, table_rows in normalizers[kind](loads(body)["data"][kind]).items():
+                rows.setdefault(table, []).extend(to_rows(table, table_rows))
+    return rows
+
+
+def run_path(bodies: dict, loads, normalizers: dict, to_rows) -> tuple:
+    # Returns (decode seconds, normalize seconds, rows). Like a sync, each page's rows
+    # are dropped before the next page, so the heap (and GC work) stays that of one page.
+    decode = normalize = 0.0
+    total = 0
+    for kind, kind_bodies in bodies.items():
+        for body in kind_bodies:
+            started = time.perf_counter()
+            page = loads(body)["data"][kind]
+            decoded = time.perf_counter()
+            for table, table_rows in normalizers[kind](page).items():
+                total += len(to_rows(table, table_rows))
+            normalize += time.perf_counter() - decoded
+            decode += decoded - started
+            del page   # freed outside the timings
+    return decode, normalize, total
+
+
+def measure(name: str, repeat: int, prepare, *args) -> dict:
+    best = None
+    for _ in range(repeat):
+        prepare()
+        result = run_path(*args)
+        if best is None or sum(result[:2]) < sum(best[:2]):
+            best = result
+    decode, normalize, total = best
+    return {
+        "path": name,
+        "rows": total,
+        "decode_s": round(decode, 3),
+        "normalize_s": round(normalize, 3),
+        "rows_per_s": per_second(total, decode + normalize),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode + normalize micro-benchmark")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=250, help="edges per page, Shopify's maximum by default")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Nothing is fetched or written; the backend only needs somewhere to create its databases
+    data_dir = Path(tempfile.mkdtemp(prefix="shopify-bench-"))
+    try:
+        backend = load_backend(data_dir, "http://127.0.0.1:9/{store_id}/graphql.json")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    store = SyntheticStore(products=args.products, orders=args.orders, seed=args.seed)
+    bodies = {
+        "orders": pages(store.orders_connection(), "orders", args.page_size),
+        "products": pages(store.products_connection(), "products", args.page_size),
+    }
+    print(f"{sum(len(b) for b in bodies.values())} pages, {sum(map(len, (x for b in bodies.values() for x in b))) / 1e6:.1f} MB")
+
+    def by_column(table, rows):
+        return list(map(itemgetter(*backend.UPSERT_SQL[table][0]), rows))
+
+    before = (json.loads, {"orders": ref_normalize_orders, "products": ref_normalize_products}, by_column)
+    after = (backend.json_loads, {"orders": backend.normalize_orders, "products": backend.normalize_products},
+             lambda table, rows: rows)
+    if all_rows(bodies, *before) != all_rows(bodies, *after):
+        raise SystemExit("The two paths produced different rows")
+
+    # The synthetic store stays alive throughout; keep the collector from rescanning it
+    gc.collect()
+    gc.freeze()
+    before = measure("before", args.repeat, lambda: None, bodies, *before)
+    after = measure("after", args.repeat, backend.GID_CACHE.clear, bodies, *after)
+
+    print(f"json decoder: {'orjson' if backend.orjson else 'stdlib json'}")
+    print(f"{'path':<8} {'rows':>9} {'decode s':>9} {'normalize s':>12} {'rows/s':>10}")
+    for r in (before, after):
+        print(f"{r['path']:<8} {r['rows']:>9} {r['decode_s']:>9} {r['normalize_s']:>12} {r['rows_per_s']:>10}")
+    print(f"speedup: {after['rows_per_s'] / before['rows_per_s']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Runs the offline benchmarks and saves the results for regression comparison.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --products 1000 --orders 20000 --asks 500 --concurrency 50
+    python -m benchmarks.run --ingest-mode bulk
+    python -m benchmarks.run --compare benchmarks/results/<earlier run>.json
+
+Stages:
+- ingest: a full sync of a synthetic store from the fake Shopify API (fetch, normalize
+  and write, as in production), by cursor pages or, with --ingest-mode bulk, through
+  a bulk operation and its JSONL result;
+- normalize: normalize_orders / normalize_products over the whole store in memory;
+- upsert: BulkWriter writes of the normalized rows into an empty shard;
+- ask: questions through /api/v1/ask with the fake LLM, reporting latency percentiles.
+
+Everything is written to a temporary DATA_DIR, never to the backend's own databases."""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from .fake_llm import FakeLLM
+from .fake_shopify import FakeShopify
+from .synthetic import SyntheticStore
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+STORE_ID = "benchmark.myshopify.com"
+TOKEN = "benchmark-token"
+
+# A dashboard-like mix: fast-path templates and free-form questions for the LLM path
+QUESTIONS = [
+    "How many snowboards do I have?",
+    "What was my revenue in the last 30 days?",
+    "Top 5 products by units sold",
+    "How many orders did I get in the last 7 days?",
+    "Which products are out of stock?",
+    "Which vendor brings in the most revenue?",
+    "Who are my best customers?",
+    "What is the average order value?",
+    "How much stock is at each location?",
+    "What are my most expensive products?",
+]
+
+# (stage, metric, True if higher is better)
+COMPARED_METRICS = [
+    ("ingest", "rows_per_s", True),
+    ("ingest", "seconds", False),
+    ("normalize", "seconds", False),
+    ("upsert", "rows_per_s", True),
+    ("ask", "p50_ms", False),
+    ("ask", "p95_ms", False),
+    ("ask", "p99_ms", False),
+    ("ask", "throughput_qps", True),
+]
+
+
+def load_backend(data_dir: Path, shopify_url: str):
+    # The backend reads its configuration at import time
+    os.environ["DATA_DIR"] = str(data_dir)
+    os.environ["SHOPIFY_GRAPHQL_URL"] = shopify_url
+    os.environ["SQL_CACHE_PERSIST"] = "0"
+    if not os.environ.get("GOOGLE_API_KEY"):
+        os.environ["GOOGLE_API_KEY"] = "benchmark"   # never used: the fake LLM replaces every call
+    sys.path.insert(0, str(ROOT / "backend"))
+    import main
+    return main
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def per_second(rows: int, seconds: float):
+    return round(rows / seconds) if seconds else None
+
+
+async def bench_ingest(backend, store: SyntheticStore, shopify: FakeShopify) -> dict:
+    backend.register_store(STORE_ID, TOKEN)
+    started = time.perf_counter()
+    await backend.sync_store(STORE_ID, TOKEN, full=True)
+    seconds = time.perf_counter() - started
+
+    status = backend.SYNC_STATUS[STORE_ID]
+    if status["state"] == "error":
+        raise SystemExit(f"Sync failed: {status['last_error']}")
+    write = status["last_write"]
+    counts = {
+        table: backend.run_sql(STORE_ID, f"SELECT COUNT(*) FROM {table}")["rows"][0][0]
+        for table in store.expected_rows()
+    }
+    return {
+        "seconds": round(seconds, 3),
+        "rows": write["rows_written"],
+        "rows_per_s": per_second(write["rows_written"], seconds),
+        "writer_seconds": write["seconds"],
+        "requests": shopify.requests,
+        "throttled": shopify.throttled,
+        "complete": counts == store.expected_rows(),
+    }
+
+
+def bench_normalize(backend, store: SyntheticStore):
+    orders, products = store.orders_connection(), store.products_connection()
+    started = time.perf_counter()
+    normalized_orders = backend.normalize_orders(orders)
+    normalized_products = backend.normalize_products(products)
+    seconds = time.perf_counter() - started
+
+    rows = sum(len(v) for v in normalized_orders.values()) + sum(len(v) for v in normalized_products.values())
+    return {"seconds": round(seconds, 3), "rows": rows, "rows_per_s": per_second(rows, seconds)}, (normalized_orders, normalized_products)
+
+
+def bench_upsert(backend, normalized) -> dict:
+    normalized_orders, normalized_products = normalized
+    started = time.perf_counter()
+    with backend.BulkWriter(backend.store_db_file("upsert." + STORE_ID)) as w:
+        w.write("orders", normalized_orders["orders"])
+        w.replace_order_items(normalized_orders["orders"], normalized_orders["order_items"])
+        w.write("products", normalized_products["products"])
+        w.write("variants", normalized_products["variants"])
+        w.write("inventory", normalized_products["inventory"])
+        rows = w.stats()["rows_written"]
+    seconds = time.perf_counter() - started
+    return {"seconds": round(seconds, 3), "rows": rows, "rows_per_s": per_second(rows, seconds)}
+
+
+async def bench_ask(backend, llm: FakeLLM, asks: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    llm.calls = 0
+
+    async def ask(client, question):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            r = await client.post("/api/v1/ask", json={"store_id": STORE_ID, "question": question, "shopify_token": TOKEN})
+            latencies.append((time.perf_counter() - started) * 1000)
+            if r.status_code != 200:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=300) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(ask(client, QUESTIONS[i % len(QUESTIONS)]) for i in range(asks)))
+        seconds = time.perf_counter() - started
+
+    return {
+        "asks": asks,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "throughput_qps": round(asks / seconds, 1),
+        "llm_calls": llm.calls,
+        "intent_hit_rate": backend.intent_stats()["hit_rate"],
+        "sql_cache_hit_rate": backend.SQL_CACHE.stats()["hit_rate"],
+        "answer_cache_hit_rate": backend.ANSWER_CACHE.stats()["hit_rate"],
+    }
+
+
+def compare(results: dict, baseline: dict):
+    print(f"\nCompared with {baseline['timestamp']}:")
+    ignored = {"out", "compare", "data_dir"}
+    differing = sorted(k for k, v in results["config"].items() if k not in ignored and baseline["config"].get(k) != v)
+    if differing:
+        print(f"  (configurations differ: {', '.join(differing)})")
+    for stage, metric, higher_is_better in COMPARED_METRICS:
+        before, after = baseline.get(stage, {}).get(metric), results.get(stage, {}).get(metric)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        better = (change > 0) == higher_is_better
+        verdict = "" if abs(change) < 5 else ("better" if better else "WORSE")
+        print(f"  {stage + '.' + metric:<22} {before:>12} -> {after:>12}  {change:+7.1f}%  {verdict}")
+
+
+async def run(args) -> dict:
+    store = SyntheticStore(
+        products=args.products, variants_per_product=args.variants, levels_per_variant=args.levels,
+        orders=args.orders, items_per_order=args.items, seed=args.seed,
+    )
+    shopify = FakeShopify(store, latency=args.shopify_latency, bucket_size=args.bucket_size,
+                          restore_rate=args.restore_rate, throttle=not args.no_throttle).start()
+    data_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp(prefix="shopify-bench-"))
+    try:
+        backend = load_backend(data_dir, shopify.url)
+        llm = FakeLLM(latency=args.llm_latency)
+        llm.install(backend)
+        backend.INTENT_FAST_PATH = not args.no_fast_path
+        if args.no_cache:
+            backend.SQL_CACHE.max_entries = backend.ANSWER_CACHE.max_entries = 0
+
+        results = {"timestamp": datetime.now().isoformat(timespec="seconds"), "config": vars(args),
+                   "store": store.expected_rows()}
+        backend.set_ingest_mode(STORE_ID, args.ingest_mode)
+        results["ingest"] = await bench_ingest(backend, store, shopify)
+        results["normalize"], normalized = bench_normalize(backend, store)
+        results["upsert"] = bench_upsert(backend, normalized)
+        results["ask"] = await bench_ask(backend, llm, args.asks, args.concurrency)
+        backend.STORE_ROUTER.close()
+        return results
+    finally:
+        shopify.stop()
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline backend benchmarks")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--variants", type=int, default=3, help="average variants per product")
+    parser.add_argument("--levels", type=int, default=2, help="average inventory levels per variant")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=3, help="average line items per order")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--shopify-latency", type=float, default=0.05, help="seconds per Shopify request")
+    # Defaults to a large plan's bucket so ingest measures the pipeline rather than the
+    # rate limit; --bucket-size 1000 --restore-rate 50 is the standard plan
+    parser.add_argument("--bucket-size", type=float, default=20000.0)
+    parser.add_argument("--restore-rate", type=float, default=1000.0, help="Shopify cost points restored per second")
+    parser.add_argument("--no-throttle", action="store_true", help="never answer THROTTLED")
+    parser.add_argument("--ingest-mode", choices=["pages", "bulk"], default="pages", help="how the store is synced")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake LLM call")
+    parser.add_argument("--asks", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--no-fast-path", action="store_true", help="send every question to the LLM path")
+    parser.add_argument("--no-cache", action="store_true", help="disable the SQL and answer caches")
+    parser.add_argument("--data-dir", help="keep the databases here instead of a temporary directory")
+    parser.add_argument("--out", help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps({k: v for k, v in results.items() if k != "config"}, indent=2))
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{results['timestamp'].replace(':', '-')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print(f"\nSaved to {out}")
+
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
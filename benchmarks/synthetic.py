@@ -0,0 +1,162 @@
+"""Synthetic Shopify stores, built in the exact GraphQL shapes the backend's sync and
+normalize_orders / normalize_products consume."""
+import random
+from datetime import datetime, timedelta, timezone
+
+VENDORS = ["Hydrogen Vendor", "Snowdevil", "Alpine Co", "Polar Goods", "Summit Supply"]
+PRODUCT_TYPES = ["snowboard", "ski wax", "goggles", "jacket", "gloves", "helmet", "hoodie"]
+VARIANT_ID_STRIDE = 1000   # variant / inventory item id = product index * stride + variant index
+
+
+def gid(kind: str, number) -> str:
+    return f"gid://shopify/{kind}/{number}"
+
+
+def gid_number(value: str) -> int:
+    return int(value.rsplit("/", 1)[-1])
+
+
+def connection(edges: list, first: int = None, after: str = None) -> dict:
+    # Cursors are plain offsets into the full edge list
+    start = int(after or 0)
+    first = len(edges) if first is None else first
+    return {
+        "pageInfo": {"hasNextPage": start + first < len(edges), "endCursor": str(start + first)},
+        "edges": edges[start:start + first],
+    }
+
+
+class SyntheticStore:
+    # Sizes are averages; each product / order draws its own count around them, so nested
+    # connections overflow their first page now and then, as on a real store.
+    def __init__(self, products: int = 200, variants_per_product: int = 3, levels_per_variant: int = 2,
+                 orders: int = 2000, items_per_order: int = 3, days: int = 90, seed: int = 1):
+        rng = random.Random(seed)
+        self.now = datetime(2025, 6, 30, 12, tzinfo=timezone.utc)
+        self.products = []   # (title, vendor, product_type, [ (price, [available per location]) ])
+        for i in range(products):
+            product_type = rng.choice(PRODUCT_TYPES)
+            variants = [
+                (round(rng.uniform(5, 500), 2), [rng.randint(-2, 100) for _ in range(rng.randint(1, 2 * levels_per_variant - 1))])
+                for _ in range(rng.randint(1, min(2 * variants_per_product - 1, VARIANT_ID_STRIDE)))
+            ]
+            self.products.append((f"The {product_type.title()} {i}", rng.choice(VENDORS), product_type, variants))
+        self.orders = []     # (created_at, [ (product, variant, quantity) ])
+        for _ in range(orders):
+            created = self.now - timedelta(seconds=rng.randint(0, days * 86400))
+            items = []
+            for _ in range(rng.randint(1, 2 * items_per_order - 1)):
+                p = rng.randrange(products)
+                items.append((p, rng.randrange(len(self.products[p][3])), rng.randint(1, 5)))
+            self.orders.append((created.strftime("%Y-%m-%dT%H:%M:%SZ"), items))
+
+    def expected_rows(self) -> dict:
+        variants = [v for p in self.products for v in p[3]]
+        return {
+            "shop": 1,
+            "products": len(self.products),
+            "variants": len(variants),
+            "inventory": sum(len(levels) for _, levels in variants),
+            "orders": len(self.orders),
+            "order_items": sum(len(items) for _, items in self.orders),
+        }
+
+    # Nodes
+    def shop(self) -> dict:
+        return {
+            "id": gid("Shop", 1), "name": "Benchmark Store", "currencyCode": "USD",
+            "timezone": "UTC", "createdAt": "2024-01-01T00:00:00Z",
+        }
+
+    def line_item_edges(self, i: int) -> list:
+        edges = []
+        for j, (p, v, quantity) in enumerate(self.orders[i][1]):
+            variant_id = p * VARIANT_ID_STRIDE + v
+            edges.append({"node": {
+                "id": gid("LineItem", i * VARIANT_ID_STRIDE + j),
+                "quantity": quantity,
+                "originalUnitPriceSet": {"shopMoney": {"amount": str(self.products[p][3][v][0])}},
+                "product": {"id": gid("Product", p)},
+                "variant": {"id": gid("ProductVariant", variant_id), "inventoryItem": {"id": gid("InventoryItem", variant_id)}},
+            }})
+        return edges
+
+    def order(self, i: int, line_items_first: int = None) -> dict:
+        created_at = self.orders[i][0]
+        return {
+            "id": gid("Order", i),
+            "createdAt": created_at,
+            "updatedAt": created_at,
+            "customer": {"id": gid("Customer", i % 500)},
+            "lineItems": connection(self.line_item_edges(i), line_items_first),
+        }
+
+    def level_edges(self, variant_id: int) -> list:
+        p, v = divmod(variant_id, VARIANT_ID_STRIDE)
+        return [
+            {"node": {
+                "updatedAt": "2025-06-01T00:00:00Z",
+                "location": {"id": gid("Location", k), "name": f"Warehouse {k}"},
+                "quantities": [{"name": "available", "quantity": available}],
+            }}
+            for k, available in enumerate(self.products[p][3][v][1])
+        ]
+
+    def variant_edges(self, p: int, levels_first: int = None) -> list:
+        edges = []
+        for v, (price, _) in enumerate(self.products[p][3]):
+            variant_id = p * VARIANT_ID_STRIDE + v
+            edges.append({"node": {
+                "id": gid("ProductVariant", variant_id),
+                "sku": f"SKU-{variant_id}",
+                "price": str(price),
+                "inventoryItem": {
+                    "id": gid("InventoryItem", variant_id),
+                    "inventoryLevels": connection(self.level_edges(variant_id), levels_first),
+                },
+            }})
+        return edges
+
+    def product(self, p: int, variants_first: int = None, levels_first: int = None) -> dict:
+        title, vendor, product_type, _ = self.products[p]
+        return {
+            "id": gid("Product", p),
+            "title": title,
+            "vendor": vendor,
+            "productType": product_type,
+            "createdAt": "2024-01-01T00:00:00Z",
+            "updatedAt": "2025-06-01T00:00:00Z",
+            "variants": connection(self.variant_edges(p, levels_first), variants_first),
+        }
+
+    # Whole connections, as normalize_orders / normalize_products take them
+    def orders_connection(self) -> dict:
+        return {"edges": [{"node": self.order(i)} for i in range(len(self.orders))]}
+
+    def products_connection(self) -> dict:
+        return {"edges": [{"node": self.product(p)} for p in range(len(self.products))]}
+
+    # Bulk operation results: one JSONL object per node, each nested connection's nodes
+    # on the lines after their parent, pointing back at it through __parentId
+    def bulk_orders(self):
+        for i in range(len(self.orders)):
+            order = self.order(i)
+            line_items = order.pop("lineItems")["edges"]
+            yield order
+            for edge in line_items:
+                item = edge["node"]
+                item["variant"] = {"id": item["variant"]["id"]}
+                yield dict(item, __parentId=order["id"])
+
+    def bulk_products(self):
+        # Inventory levels are nested under the variant's inventoryItem; their parent is the variant
+        for p in range(len(self.products)):
+            product = self.product(p)
+            variants = product.pop("variants")["edges"]
+            yield product
+            for edge in variants:
+                variant = edge["node"]
+                levels = variant["inventoryItem"].pop("inventoryLevels")["edges"]
+                yield dict(variant, __parentId=product["id"])
+                for level in levels:
+                    yield dict(level["node"], __parentId=variant["id"])
@@ -1,12 +1,26 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
 from pydantic import BaseModel
-import requests
+import httpx
+import asyncio
 import secrets
 import os
+import sys
 import json
+import base64
+import hashlib
+import hmac
 from pathlib import Path
 import time
+import uuid
+import random
+import threading
+import contextvars
+from collections import deque
+from datetime import datetime
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # Get environment variables
@@ -17,14 +31,266 @@ class QuestionRequest(BaseModel):
     store_id: str
     question: str
 
+class BatchQuestionRequest(BaseModel):
+    store_id: str
+    questions: list[str]
+
+
+# One pooled client for the whole process, so calls to the AI service and Shopify reuse
+# keep-alive connections instead of opening one per question
+AI_SERVICE_TIMEOUT_SECONDS = float(os.getenv("AI_SERVICE_TIMEOUT_SECONDS", "60"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("GATEWAY_MAX_CONNECTIONS", "200"))
+http_client = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=AI_SERVICE_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+        ),
+    )
+    yield
+    await http_client.aclose()
+
+app = FastAPI(title="Shopify Gateway API", lifespan=lifespan)
+
+# Metrics
+# Request latency and the gateway -> AI service hop as Prometheus histograms on
+# GET /metrics. Every request gets an ID (X-Request-ID, kept if the client sent one)
+# that is forwarded to the AI service; the Server-Timing header combines the gateway's
+# own stages with the AI service's, prefixed "backend-".
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS = []
+
+def format_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}   # sorted label items -> cumulative bucket counts, count, sum
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.series.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self) -> list:
+        def line(suffix, labels, value):
+            label_text = ",".join(f'{k}="{format_label_value(v)}"' for k, v in labels)
+            return f"{self.name}{suffix}{{{label_text}}} {value}" if label_text else f"{self.name}{suffix} {value}"
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, counts in self.series.items():
+                lines.extend(line("_bucket", labels + (("le", b),), n) for b, n in zip(self.buckets, counts))
+                lines.append(line("_bucket", labels + (("le", "+Inf"),), counts[-2]))
+                lines.append(line("_count", labels, counts[-2]))
+                lines.append(line("_sum", labels, round(counts[-1], 6)))
+        return lines
+
+HTTP_SECONDS = Histogram("gateway_http_request_duration_seconds", "Request latency by route and status")
+AI_SERVICE_SECONDS = Histogram("gateway_ai_service_duration_seconds", "Latency of calls to the AI service (until its headers)")
+
+REQUEST_CONTEXT = contextvars.ContextVar("request_context", default=None)
+
+# Request profiler (opt-in: PROFILE_REQUESTS=1), the AI service's sampler
+# While a request runs, one thread samples the event loop's thread every
+# PROFILE_INTERVAL_MS: the Python stack while the request's task is running, the stage
+# it waits in (ai_service) otherwise. Requests slower than PROFILE_SLOW_MS, plus a
+# PROFILE_SAMPLE_RATE fraction of the rest, are kept with their stages, the AI service's
+# Server-Timing and the stack samples in a ring buffer served by /api/v1/profiles. The
+# AI service keeps its own profile (SQL, query plans, tokens) under the same request ID.
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "2000"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "200"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+def frame_stack(frame) -> list:
+    # Root-first "function (file:line)" entries, without the event loop's own frames
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.endswith(("asyncio/events.py", "asyncio/base_events.py")):
+            break
+        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return stack[::-1]
+
+class RequestProfiler:
+    def __init__(self, interval_ms: float, buffer_size: int):
+        self.interval = interval_ms / 1000
+        self.profiles = {}   # request task -> profile being recorded
+        self.kept = deque(maxlen=buffer_size)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self, scope, context: dict) -> dict:
+        context["tasks"].add(asyncio.current_task())
+        profile = {
+            "context": context,
+            "task": asyncio.current_task(),
+            "loop": asyncio.get_running_loop(),
+            "thread_id": threading.get_ident(),
+            "method": scope["method"],
+            "samples": 0,
+            "stacks": {},
+        }
+        with self.lock:
+            self.profiles[profile["task"]] = profile
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="request-profiler", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return profile
 
-app = FastAPI(title="Shopify Gateway API")
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                profiles = list(self.profiles.values())
+                if not profiles:
+                    self.wakeup.clear()
+                    continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                if asyncio.current_task(profile["loop"]) in profile["context"]["tasks"]:
+                    stack = frame_stack(frames.get(profile["thread_id"]))
+                else:
+                    active = profile["context"]["active"]
+                    stack = ["<waiting>", active[-1] if active else "other"]
+                key = ";".join(stack)
+                profile["stacks"][key] = profile["stacks"].get(key, 0) + 1
+                profile["samples"] += 1
+            time.sleep(self.interval)
+
+    def finish(self, profile: dict, path: str, status: int, elapsed: float):
+        with self.lock:
+            self.profiles.pop(profile["task"], None)
+        duration_ms = elapsed * 1000
+        if duration_ms >= PROFILE_SLOW_MS:
+            reason = "slow"
+        elif random.random() < PROFILE_SAMPLE_RATE:
+            reason = "sampled"
+        else:
+            return
+        context = profile["context"]
+        record = {
+            "request_id": context["id"],
+            "method": profile["method"],
+            "path": path,
+            "status": status,
+            "started_at": context["started_at"],
+            "duration_ms": round(duration_ms, 1),
+            "reason": reason,
+            "stages_ms": {stage: round(s * 1000, 1) for stage, s in context["stages"].items()},
+            "ai_service_timing": context["upstream"],
+            "interval_ms": self.interval * 1000,
+            "samples": profile["samples"],
+            "stacks": dict(sorted(profile["stacks"].items(), key=lambda item: -item[1])),
+        }
+        with self.lock:
+            self.kept.append(record)
+
+    def list(self) -> list:
+        summary_keys = ("request_id", "method", "path", "status", "started_at", "duration_ms", "reason", "stages_ms", "ai_service_timing")
+        with self.lock:
+            return [{k: r[k] for k in summary_keys} for r in reversed(self.kept)]
+
+    def get(self, request_id: str):
+        with self.lock:
+            return next((r for r in reversed(self.kept) if r["request_id"] == request_id), None)
+
+REQUEST_PROFILER = RequestProfiler(PROFILE_INTERVAL_MS, PROFILE_BUFFER_SIZE)
+
+class RequestInstrumentation:
+    # Plain ASGI middleware, so streamed responses are timed to their last byte
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = dict(scope["headers"]).get(b"x-request-id")
+        context = {
+            "id": request_id.decode("latin-1") if request_id else uuid.uuid4().hex,
+            "started_at": datetime.utcnow().isoformat(),
+            "stages": {},
+            "upstream": None,
+            "active": [],     # stages being awaited, for the profiler
+            "tasks": set(),   # tasks working for this request
+        }
+        REQUEST_CONTEXT.set(context)
+        profile = REQUEST_PROFILER.start(scope, context) if PROFILE_REQUESTS else None
+        started = time.perf_counter()
+        status = 500
+
+        async def send_instrumented(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in context["stages"].items()]
+                timings.append(f"total;dur={(time.perf_counter() - started) * 1000:.1f}")
+                if context["upstream"]:
+                    timings.extend("backend-" + t.strip() for t in context["upstream"].split(","))
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-ID"] = context["id"]
+                headers["Server-Timing"] = ", ".join(timings)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_instrumented)
+        finally:
+            elapsed = time.perf_counter() - started
+            path = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(elapsed, method=scope["method"], path=path, status=status)
+            if profile is not None:
+                REQUEST_PROFILER.finish(profile, path, status, elapsed)
+
+app.add_middleware(RequestInstrumentation)
 
 # My credentials for the app
 CLIENT_ID = os.getenv("SHOPIFY_CLIENT_ID")
 CLIENT_SECRET = os.getenv("SHOPIFY_CLIENT_SECRET")
 
 AI_SERVICE_URL = "http://localhost:9000/api/v1/ask"
+AI_SERVICE_STREAM_URL = AI_SERVICE_URL + "/stream"
+AI_SERVICE_BATCH_URL = AI_SERVICE_URL + "/batch"
+
+async def call_ai_service(url: str, payload: dict, stream: bool = False) -> httpx.Response:
+    # Forwards the request ID, times the hop and keeps the AI service's Server-Timing
+    context = REQUEST_CONTEXT.get()
+    request = http_client.build_request("POST", url, json=payload, headers={"X-Request-ID": context["id"]})
+    path = request.url.path
+    started = time.perf_counter()
+    context["active"].append("ai_service")
+    try:
+        response = await http_client.send(request, stream=stream)
+    except httpx.TimeoutException:
+        AI_SERVICE_SECONDS.observe(time.perf_counter() - started, path=path, status="timeout")
+        raise HTTPException(status_code=504, detail="AI service timed out")
+    finally:
+        context["active"].remove("ai_service")
+    elapsed = time.perf_counter() - started
+    AI_SERVICE_SECONDS.observe(elapsed, path=path, status=response.status_code)
+    context["stages"]["ai_service"] = elapsed
+    context["upstream"] = response.headers.get("Server-Timing")
+    return response
 
 # Storage
 BASE_DIR = Path(__file__).resolve().parent
@@ -71,7 +337,7 @@ def install(shop: str):
     return RedirectResponse(install_url)
 
 @app.get("/auth/callback")
-def callback(shop: str, code: str, state: str):
+async def callback(shop: str, code: str, state: str):
     # Validate OAuth state
     if shop not in oauth_states or oauth_states[shop] != state:
         raise HTTPException(status_code=400, detail="Invalid OAuth state")
@@ -85,7 +351,7 @@ def callback(shop: str, code: str, state: str):
         "code": code
     }
 
-    r = requests.post(token_url, json=payload)
+    r = await http_client.post(token_url, json=payload)
 
     if r.status_code != 200:
         raise HTTPException(400, detail="OAuth token request failed")
@@ -99,11 +365,89 @@ def callback(shop: str, code: str, state: str):
     token_data[shop] = access_token
     save_dict(token_data)
 
+    await subscribe_webhooks(shop, access_token)
     return {"status": "installed"}
 
+# Webhooks
+# Shopify pushes order, product and inventory changes here, so the AI service can apply
+# them as deltas instead of waiting for its next poll. Subscriptions are created on
+# install when WEBHOOK_CALLBACK_URL (a public URL routed to /webhooks/shopify) is set.
+WEBHOOK_CALLBACK_URL = os.getenv("WEBHOOK_CALLBACK_URL")
+AI_SERVICE_WEBHOOK_URL = "http://localhost:9000/api/v1/webhooks"
+SHOPIFY_API_VERSION = "2024-01"
+WEBHOOK_TOPICS = {
+    "orders/create": "ORDERS_CREATE",
+    "orders/updated": "ORDERS_UPDATED",
+    "products/update": "PRODUCTS_UPDATE",
+    "inventory_levels/update": "INVENTORY_LEVELS_UPDATE",
+}
+
+WEBHOOK_SUBSCRIPTION_MUTATION = """
+mutation webhookSubscriptionCreate($topic: WebhookSubscriptionTopic!, $webhookSubscription: WebhookSubscriptionInput!) {
+  webhookSubscriptionCreate(topic: $topic, webhookSubscription: $webhookSubscription) {
+    webhookSubscription { id }
+    userErrors { field message }
+  }
+}
+"""
+
+async def subscribe_webhooks(shop: str, access_token: str):
+    # A failed subscription only means that topic keeps relying on polling
+    if not WEBHOOK_CALLBACK_URL:
+        return
+    url = f"https://{shop}/admin/api/{SHOPIFY_API_VERSION}/graphql.json"
+    for topic in WEBHOOK_TOPICS.values():
+        variables = {"topic": topic, "webhookSubscription": {"callbackUrl": WEBHOOK_CALLBACK_URL, "format": "JSON"}}
+        try:
+            r = await http_client.post(
+                url,
+                json={"query": WEBHOOK_SUBSCRIPTION_MUTATION, "variables": variables},
+                headers={"X-Shopify-Access-Token": access_token},
+            )
+            errors = r.json().get("data", {}).get("webhookSubscriptionCreate", {}).get("userErrors") if r.status_code == 200 else r.text
+        except (httpx.HTTPError, ValueError, AttributeError) as e:
+            errors = str(e)
+        if errors:
+            print(f"Webhook subscription {topic} failed for {shop}:", errors)
+
+def verify_webhook(body: bytes, signature: str | None) -> bool:
+    # X-Shopify-Hmac-Sha256 is the base64 HMAC-SHA256 of the raw body, keyed with the app secret
+    if not CLIENT_SECRET or not signature:
+        return False
+    digest = base64.b64encode(hmac.new(CLIENT_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(digest, signature)
+
+@app.post("/webhooks/shopify")
+async def shopify_webhook(request: Request):
+    body = await request.body()
+    if not verify_webhook(body, request.headers.get("X-Shopify-Hmac-Sha256")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    # Anything else is acknowledged and dropped, so Shopify stops retrying it
+    topic = request.headers.get("X-Shopify-Topic")
+    shop = request.headers.get("X-Shopify-Shop-Domain")
+    if topic not in WEBHOOK_TOPICS or shop not in token_data:
+        return {"status": "ignored"}
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not JSON")
+
+    # A failure here is answered with an error so Shopify delivers the webhook again later
+    response = await call_ai_service(AI_SERVICE_WEBHOOK_URL, {
+        "store_id": shop,
+        "topic": topic,
+        "webhook_id": request.headers.get("X-Shopify-Webhook-Id"),
+        "payload": payload,
+    })
+    if response.status_code >= 300:
+        raise HTTPException(status_code=502, detail="AI service did not accept the webhook")
+    return response.json()
+
 # this is the main function, which will be called to ask questions
 @app.post("/api/v1/questions")
-def ask_question(req: QuestionRequest):
+async def ask_question(req: QuestionRequest):
     # Validate input
     if not req.store_id or not req.question:
         raise HTTPException(status_code=401, detail="Question / store_id not found")
@@ -120,10 +464,89 @@ def ask_question(req: QuestionRequest):
         "shopify_token": SHOPIFY_TOKEN
     }
 
-    response = requests.post(AI_SERVICE_URL, json=payload, timeout=60)
+    response = await call_ai_service(AI_SERVICE_URL, payload)
     # Return AI service response to user
     return response.json()
 
+# Batch variant: several questions for one store in a single backend round trip
+@app.post("/api/v1/questions/batch")
+async def ask_questions_batch(req: BatchQuestionRequest):
+    if not req.store_id or not req.questions:
+        raise HTTPException(status_code=401, detail="Questions / store_id not found")
+
+    if req.store_id not in token_data:
+        raise HTTPException(status_code=401, detail=f"Please authenticate via this link: http://localhost:8000/auth/install?shop={req.store_id}")
+
+    payload = {
+        "store_id": req.store_id,
+        "questions": req.questions,
+        "shopify_token": token_data[req.store_id]
+    }
+
+    response = await call_ai_service(AI_SERVICE_BATCH_URL, payload)
+    return response.json()
+
+# Streaming variant: relays the AI service's server-sent events chunk by chunk
+@app.post("/api/v1/questions/stream")
+async def ask_question_stream(req: QuestionRequest):
+    if not req.store_id or not req.question:
+        raise HTTPException(status_code=401, detail="Question / store_id not found")
+
+    if req.store_id not in token_data:
+        raise HTTPException(status_code=401, detail=f"Please authenticate via this link: http://localhost:8000/auth/install?shop={req.store_id}")
+
+    payload = {
+        "store_id": req.store_id,
+        "question": req.question,
+        "shopify_token": token_data[req.store_id]
+    }
+
+    response = await call_ai_service(AI_SERVICE_STREAM_URL, payload, stream=True)
+
+    # Errors before the stream starts keep their status code
+    if response.status_code != 200:
+        body = await response.aread()
+        await response.aclose()
+        try:
+            detail = json.loads(body).get("detail", body.decode())
+        except (ValueError, AttributeError):
+            detail = body.decode(errors="replace")
+        raise HTTPException(status_code=response.status_code, detail=detail)
+
+    return StreamingResponse(
+        response.aiter_raw(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(response.aclose),
+    )
+
+@app.get("/api/v1/profiles")
+def list_profiles():
+    return {
+        "enabled": PROFILE_REQUESTS,
+        "slow_ms": PROFILE_SLOW_MS,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "profiles": REQUEST_PROFILER.list(),
+    }
+
+@app.get("/api/v1/profiles/{request_id}")
+def get_profile(request_id: str, format: str = "json"):
+    # format=folded downloads the stack samples for flamegraph.pl / speedscope
+    profile = REQUEST_PROFILER.get(request_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No profile kept for this request")
+    if format == "folded":
+        folded = "".join(f"{stack} {n}\n" for stack, n in profile["stacks"].items())
+        return PlainTextResponse(folded, headers={"Content-Disposition": f'attachment; filename="{request_id}.folded"'})
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or folded")
+    return profile
+
+@app.get("/metrics")
+def get_metrics():
+    text = "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
 @app.get("/helloworld")
 def helloworld():
     return {"hello world :DD"}
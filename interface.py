@@ -1,4 +1,9 @@
 import requests
+import json
+import sys
+
+# Run with --stream to print the answer as it is generated
+stream = "--stream" in sys.argv[1:]
 
 # Ask user for inputs
 question = input("Enter your question: ")
@@ -15,16 +20,45 @@ payload = {
     "store_id": store_id
 }
 
+def print_stream(response):
+    # Server-sent events: "event: <name>" and "data: <json>" lines, blank line between events
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data = json.loads(line[len("data:"):])
+            if event == "status":
+                print(f"[{data['stage']}]")
+            elif event == "sql":
+                print(f"[sql] {data['sql']}")
+            elif event == "rows":
+                shown = f" (first {data['rows_in_prompt']} used)" if data.get("truncated") else ""
+                print(f"[rows] {data['rows_total']}{shown}")
+            elif event == "token":
+                print(data["text"], end="", flush=True)
+            elif event == "done":
+                print()
+            elif event == "error":
+                print(f"\nBackend Error. Status code: {data['status']}")
+                print("Response:", data["detail"])
+
 try:
-    # Send POST request
-    response = requests.post(url, json=payload)
-    # Check response
-    if response.status_code == 200:
-        print("Server response:", response.json())
+    if stream:
+        response = requests.post(url + "/stream", json=payload, stream=True)
+        if response.status_code == 200:
+            print_stream(response)
+        else:
+            print(f"Backend Error. Status code: {response.status_code}")
+            print("Response:", response.json())
     else:
-        print(f"Backend Error. Status code: {response.status_code}")
-        print("Response:", response.json())
+        # Send POST request
+        response = requests.post(url, json=payload)
+        # Check response
+        if response.status_code == 200:
+            print("Server response:", response.json())
+        else:
+            print(f"Backend Error. Status code: {response.status_code}")
+            print("Response:", response.json())
 except requests.exceptions.RequestException as e:
     print("Error connecting to gateway server:\n", e)
-
-
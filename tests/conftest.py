@@ -0,0 +1,70 @@
+"""Fixtures shared by the backend tests: the backend loaded against a temporary DATA_DIR,
+with Shopify replaced by the benchmarks' fake GraphQL API serving a synthetic store.
+
+    python -m pytest -q"""
+import asyncio
+import sqlite3
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fake_shopify import FakeShopify
+from benchmarks.run import load_backend
+from benchmarks.synthetic import SyntheticStore
+
+TOKEN = "test-token"
+
+
+@pytest.fixture(scope="session")
+def store():
+    return SyntheticStore(products=30, orders=200, seed=7)
+
+
+@pytest.fixture(scope="session")
+def shopify(store):
+    # One bucket serves every test's store, so it is sized for the whole session
+    shopify = FakeShopify(store, bucket_size=1_000_000, restore_rate=100_000).start()
+    yield shopify
+    shopify.stop()
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory, shopify):
+    # The backend reads its configuration at import time, so every test shares one import
+    backend = load_backend(tmp_path_factory.mktemp("data"), shopify.url)
+    yield backend
+    backend.STORE_ROUTER.close()
+
+
+@pytest.fixture
+def store_id(backend):
+    # A fresh shard per test
+    store_id = f"test-{uuid.uuid4().hex[:8]}.myshopify.com"
+    backend.register_store(store_id, TOKEN)
+    return store_id
+
+
+@pytest.fixture
+def synced_store(backend, store_id):
+    asyncio.run(backend.sync_store(store_id, TOKEN, full=True))
+    assert backend.SYNC_STATUS[store_id]["state"] != "error", backend.SYNC_STATUS[store_id]["last_error"]
+    return store_id
+
+
+@pytest.fixture
+def shard(backend):
+    # Opens a store's shard for direct inspection
+    connections = []
+
+    def open_shard(store_id: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(backend.store_db_file(store_id))
+        connections.append(conn)
+        return conn
+
+    yield open_shard
+    for conn in connections:
+        conn.close()
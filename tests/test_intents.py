@@ -0,0 +1,86 @@
+"""The intent fast path: which questions the templates take, and what they answer."""
+import asyncio
+from datetime import date
+
+import pytest
+
+TODAY = date(2025, 6, 30)
+
+
+@pytest.mark.parametrize("question, intent, params", [
+    ("How many products do I have?", "product_count", ()),
+    ("Please tell me the number of products", "product_count", ()),
+    ("How much inventory do we have?", "total_inventory", ()),
+    ("How many snowboards do I have left?", "inventory_count", ("%snowboard%", "%snowboard%")),
+    ("How many orders did I get?", "order_count", ()),
+    ("What is my total revenue?", "revenue", ()),
+    ("Top products", "top_products", (5,)),
+    ("Top 3 products by revenue", "top_products", (3,)),
+    ("What are my top ten best selling products?", "top_products", (10,)),
+    ("Best sellers", "top_products", (5,)),
+    ("Which products are out of stock?", "out_of_stock", ()),
+])
+def test_matches(backend, question, intent, params):
+    name, sql, matched_params, answer = backend.match_intent(question)
+    assert (name, matched_params) == (intent, params)
+
+
+@pytest.mark.parametrize("question", [
+    "Top a products",                           # "a" is not a count
+    "Top foo products",
+    "Top 60 products",                          # above INTENT_MAX_TOP_N
+    "What was my revenue in the last 100 years?",
+    "What was my revenue in the last 0 days?",
+    "How many orders did I get in the last a week?",
+    "How many products do I have this month?",  # counts have no time range
+    "How many orders do I have per customer?",
+    "Which vendor brings in the most revenue?",
+])
+def test_falls_through_to_llm(backend, question):
+    assert backend.match_intent(question) is None
+
+
+@pytest.mark.parametrize("question, time_range", [
+    ("revenue today", ("2025-06-30", "2025-07-01", "today")),
+    ("revenue yesterday", ("2025-06-29", "2025-06-30", "yesterday")),
+    ("revenue this week", ("2025-06-30", "2025-07-01", "this week")),
+    ("revenue this month", ("2025-06-01", "2025-07-01", "this month")),
+    ("revenue in the last 7 days", ("2025-06-24", "2025-07-01", "in the last 7 days")),
+    ("revenue over the past two weeks", ("2025-06-17", "2025-07-01", "in the past two weeks")),
+    ("revenue last week", ("2025-06-24", "2025-07-01", "in the last week")),
+    ("revenue last month", ("2025-05-01", "2025-06-01", "in May 2025")),
+    ("revenue last year", ("2024-01-01", "2025-01-01", "in 2024")),
+    ("revenue in the last 3 months", ("2025-04-02", "2025-07-01", "from 2025-04-02 to 2025-06-30")),
+    ("revenue in the last 10 years", ("2015-07-04", "2025-07-01", "from 2015-07-04 to 2025-06-30")),
+])
+def test_time_ranges(backend, question, time_range):
+    assert backend.parse_time_range(question, TODAY) == ("revenue", time_range)
+
+
+def test_time_range_too_long(backend):
+    assert backend.parse_time_range("revenue in the last 11 years", TODAY) is None
+
+
+def ask(backend, store_id: str, question: str):
+    return asyncio.run(backend.answer_intent(store_id, question))
+
+
+def test_answers(backend, store, synced_store):
+    expected = store.expected_rows()
+    assert ask(backend, synced_store, "How many products do I have?")["answer"] == f"You have {expected['products']:,} products."
+    assert ask(backend, synced_store, "How many orders did I get?")["answer"] == f"You received {expected['orders']:,} orders."
+
+    # The top products come from the sales_daily rollup; they must agree with the line items
+    top = ask(backend, synced_store, "Top 3 products by units sold")
+    assert top["intent"] == "top_products" and top["meta"]["rows_total"] == 3
+    units = backend.run_sql(synced_store, """
+        SELECT product_id, SUM(quantity) AS units FROM order_items
+        GROUP BY product_id ORDER BY units DESC, product_id LIMIT 3
+    """)["rows"]
+    assert [line.split(": ")[1].split(" units")[0] for line in top["answer"].splitlines()[1:]] == [f"{u:,}" for _, u in units]
+
+
+def test_unknown_product_is_declined(backend, synced_store):
+    # The template matches, but no product is called that
+    assert backend.match_intent("How many unicorns do I have?")[0] == "inventory_count"
+    assert ask(backend, synced_store, "How many unicorns do I have?") is None
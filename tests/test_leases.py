@@ -0,0 +1,85 @@
+"""Store leases: one worker writes a store's shard at a time, and a lease that expired
+under its holder stops the holder's writes."""
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from fastapi import HTTPException
+
+
+def expire_lease(backend, store_id: str):
+    conn = sqlite3.connect(backend.DB_FILE)
+    conn.execute("UPDATE sync_leases SET expires_at = ? WHERE store_id = ?", (time.time() - 1, store_id))
+    conn.commit()
+    conn.close()
+
+
+def leases_lost(backend, purpose: str) -> int:
+    return backend.LEASES_LOST.series.get((("purpose", purpose),), 0)
+
+
+def test_expired_lease_passes_to_another_worker(backend, store_id, monkeypatch):
+    monkeypatch.setattr(backend, "WORKER_ID", "worker-a")
+    assert backend.acquire_lease(store_id, "sync")
+
+    monkeypatch.setattr(backend, "WORKER_ID", "worker-b")
+    assert not backend.acquire_lease(store_id, "sync")
+    expire_lease(backend, store_id)
+    assert backend.acquire_lease(store_id, "sync")
+    assert backend.load_leases()[store_id]["owner"] == "worker-b"
+
+    # The old holder can no longer renew it
+    monkeypatch.setattr(backend, "WORKER_ID", "worker-a")
+    assert not backend.renew_lease(store_id)
+
+
+def test_lost_lease_stops_writes(backend, store_id, shard, monkeypatch):
+    # Renewed every 0.1s
+    monkeypatch.setattr(backend, "SYNC_LEASE_SECONDS", 0.3)
+    lost_before = leases_lost(backend, "test")
+
+    async def write_after_losing_lease():
+        async with backend.store_lease(store_id, "test"):
+            # Another worker takes the shard over
+            conn = sqlite3.connect(backend.DB_FILE)
+            conn.execute("UPDATE sync_leases SET owner = 'other-worker' WHERE store_id = ?", (store_id,))
+            conn.commit()
+            conn.close()
+            await asyncio.sleep(0.5)
+            assert backend.HELD_LEASE.get()["lost"]
+            with pytest.raises(HTTPException) as e:
+                with backend.BulkWriter(backend.store_db_file(store_id)) as w:
+                    w.write("orders", [("1", "2025-06-01T00:00:00Z", None, "2025-06-01T00:00:00Z")])
+            assert e.value.status_code == 409
+
+    asyncio.run(write_after_losing_lease())
+    assert leases_lost(backend, "test") == lost_before + 1
+    assert shard(store_id).execute("SELECT COUNT(*) FROM orders").fetchone() == (0,)
+    # The holder released nothing it no longer owned
+    conn = sqlite3.connect(backend.DB_FILE)
+    assert conn.execute("SELECT owner FROM sync_leases WHERE store_id = ?", (store_id,)).fetchone() == ("other-worker",)
+    conn.close()
+
+
+def test_lease_waits_for_the_holder(backend, store_id, monkeypatch):
+    monkeypatch.setattr(backend, "LEASE_POLL_SECONDS", 0.05)
+    monkeypatch.setattr(backend, "WORKER_ID", "other-worker")
+    assert backend.acquire_lease(store_id, "sync")
+    monkeypatch.setattr(backend, "WORKER_ID", "this-worker")
+
+    owners = []
+
+    async def sync():
+        async with backend.store_lease(store_id, "sync"):
+            owners.append(backend.load_leases()[store_id]["owner"])
+
+    async def main():
+        task = asyncio.create_task(sync())
+        await asyncio.sleep(0.2)
+        assert not owners
+        expire_lease(backend, store_id)
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert owners == ["this-worker"]
@@ -0,0 +1,90 @@
+"""Webhooks and sync pages may arrive out of order; the row with the later updated_at wins."""
+import json
+
+from benchmarks.synthetic import VARIANT_ID_STRIDE, gid
+
+OLD, NEW, NEWER = "2029-01-01T00:00:00Z", "2030-01-01T00:00:00Z", "2031-01-01T00:00:00Z"
+
+
+def event(event_id: int, topic: str, payload: dict) -> tuple:
+    return event_id, topic, json.dumps(payload)
+
+
+def order_payload(updated_at: str, quantity: int) -> dict:
+    return {
+        "id": 0, "created_at": "2025-06-30T08:00:00Z", "updated_at": updated_at,
+        "line_items": [{"quantity": quantity, "price": "1", "product_id": 1, "variant_id": VARIANT_ID_STRIDE}],
+    }
+
+
+def order_page(updated_at: str, quantity: int) -> list:
+    # One order as a sync page holds it
+    return [{"node": {
+        "id": gid("Order", 0), "createdAt": "2025-06-30T08:00:00Z", "updatedAt": updated_at,
+        "lineItems": {"edges": [{"node": {
+            "quantity": quantity,
+            "originalUnitPriceSet": {"shopMoney": {"amount": "1"}},
+            "product": {"id": gid("Product", 1)},
+            "variant": {"id": gid("ProductVariant", VARIANT_ID_STRIDE)},
+        }}]},
+    }}]
+
+
+def stored_order(conn) -> tuple:
+    updated_at, = conn.execute("SELECT updated_at FROM orders WHERE order_id = '0'").fetchone()
+    quantities = [q for q, in conn.execute("SELECT quantity FROM order_items WHERE order_id = '0'")]
+    return updated_at, quantities
+
+
+def test_later_webhook_in_batch_wins(backend, synced_store, shard):
+    backend.write_webhook_batch(synced_store, [
+        event(1, "orders/updated", order_payload(NEW, 3)),
+        event(2, "orders/updated", order_payload(OLD, 9)),
+    ])
+    assert stored_order(shard(synced_store)) == (NEW, [3])
+
+
+def test_stale_webhook_is_ignored(backend, synced_store, shard):
+    backend.write_webhook_batch(synced_store, [event(1, "orders/updated", order_payload(NEW, 3))])
+    stats, errors = backend.write_webhook_batch(synced_store, [event(2, "orders/updated", order_payload(OLD, 9))])
+    assert not errors and stats["rows_changed_by_table"]["order_items"] == 0
+    assert stored_order(shard(synced_store)) == (NEW, [3])
+
+
+def test_stale_product_keeps_its_variants(backend, synced_store, shard):
+    conn = shard(synced_store)
+    before = conn.execute("SELECT * FROM variants WHERE product_id = '1' ORDER BY variant_id").fetchall()
+    backend.write_webhook_batch(synced_store, [event(1, "products/update", {
+        "id": 1, "title": "Old title", "updated_at": "2020-01-01T00:00:00Z",
+        "variants": [{"id": VARIANT_ID_STRIDE, "sku": "OLD", "price": "1", "inventory_item_id": VARIANT_ID_STRIDE}],
+    })])
+    assert conn.execute("SELECT title FROM products WHERE product_id = '1'").fetchone() != ("Old title",)
+    assert conn.execute("SELECT * FROM variants WHERE product_id = '1' ORDER BY variant_id").fetchall() == before
+
+
+def test_inventory_level_ordering(backend, synced_store, shard):
+    level = {"inventory_item_id": VARIANT_ID_STRIDE, "location_id": 0, "available": 5}
+    conn = shard(synced_store)
+
+    def available():
+        return conn.execute(
+            "SELECT available FROM inventory WHERE inventory_item_id = ? AND location_id = '0'", (str(VARIANT_ID_STRIDE),)
+        ).fetchone()[0]
+
+    synced = available()
+    backend.write_webhook_batch(synced_store, [event(1, "inventory_levels/update", dict(level, updated_at="2020-01-01T00:00:00Z"))])
+    assert available() == synced
+    backend.write_webhook_batch(synced_store, [event(2, "inventory_levels/update", dict(level, updated_at=NEW))])
+    assert available() == 5
+
+
+def test_sync_page_older_than_webhook(backend, synced_store, shard):
+    # A page fetched before an orders/updated webhook is written after it
+    backend.write_webhook_batch(synced_store, [event(1, "orders/updated", order_payload(NEW, 3))])
+    with backend.BulkWriter(backend.store_db_file(synced_store)) as w:
+        backend.load_orders_page(w, order_page(OLD, 7), {})
+    assert stored_order(shard(synced_store)) == (NEW, [3])
+
+    with backend.BulkWriter(backend.store_db_file(synced_store)) as w:
+        backend.load_orders_page(w, order_page(NEWER, 7), {})
+    assert stored_order(shard(synced_store)) == (NEWER, [7])
@@ -0,0 +1,74 @@
+"""The incrementally maintained rollups must equal a full recompute after every kind of write."""
+import json
+
+from benchmarks.synthetic import VARIANT_ID_STRIDE
+
+
+def rollups(conn) -> dict:
+    # Revenue is rounded: the two paths may add the same amounts in a different order
+    return {
+        "inventory_totals": sorted(conn.execute("SELECT * FROM inventory_totals")),
+        "sales_daily": sorted(conn.execute(
+            "SELECT day, product_id, variant_id, vendor, orders, units, ROUND(revenue, 6) FROM sales_daily"
+        )),
+    }
+
+
+def assert_matches_full_rebuild(backend, conn):
+    incremental = rollups(conn)
+    assert incremental["inventory_totals"] and incremental["sales_daily"]
+    try:
+        backend.refresh_rollups(conn)
+        assert rollups(conn) == incremental
+    finally:
+        conn.rollback()
+
+
+def event(event_id: int, topic: str, payload: dict) -> tuple:
+    return event_id, topic, json.dumps(payload)
+
+
+def test_sync(backend, synced_store, shard):
+    assert_matches_full_rebuild(backend, shard(synced_store))
+
+
+def test_bulk_chunks(backend, store, store_id, shard):
+    # Small chunks commit (and refresh the rollups) many times, splitting days and products
+    with backend.BulkWriter(backend.store_db_file(store_id), chunk_size=7) as w:
+        for kind, load in (("products", backend.load_bulk_products), ("orders", backend.load_bulk_orders)):
+            lines, state = list(getattr(store, f"bulk_{kind}")()), {}
+            for start in range(0, len(lines), 7):
+                load(w, lines[start:start + 7], state)
+    assert_matches_full_rebuild(backend, shard(store_id))
+
+
+def test_webhooks(backend, store, synced_store, shard):
+    p, v = store.orders[0][1][0][:2]
+    variant_id = p * VARIANT_ID_STRIDE + v
+    events = [
+        # An order moved to another day with new line items, and a new order
+        event(1, "orders/updated", {
+            "id": 0, "created_at": "2025-01-02T10:00:00Z", "updated_at": "2030-01-01T00:00:00Z",
+            "line_items": [{"quantity": 4, "price": "2.50", "product_id": p, "variant_id": variant_id}],
+        }),
+        event(2, "orders/create", {
+            "id": 999999, "created_at": "2025-06-30T23:59:59Z", "updated_at": "2025-06-30T23:59:59Z",
+            "line_items": [{"quantity": 1, "price": "10", "product_id": p, "variant_id": variant_id}],
+        }),
+        # A new vendor, denormalized into sales_daily
+        event(3, "products/update", {
+            "id": p, "title": "Renamed", "vendor": "New Vendor", "product_type": "snowboard",
+            "updated_at": "2030-01-01T00:00:00Z",
+            "variants": [{"id": variant_id, "sku": "SKU", "price": "1", "inventory_item_id": variant_id}],
+        }),
+        event(4, "inventory_levels/update", {
+            "inventory_item_id": variant_id, "location_id": 0, "available": 1234, "updated_at": "2030-01-01T00:00:00Z",
+        }),
+    ]
+    stats, errors = backend.write_webhook_batch(synced_store, events)
+    assert not errors
+
+    conn = shard(synced_store)
+    assert conn.execute("SELECT vendor FROM sales_daily WHERE product_id = ? LIMIT 1", (str(p),)).fetchone() == ("New Vendor",)
+    assert conn.execute("SELECT units FROM sales_daily WHERE day = '2025-01-02'").fetchall() == [(4,)]
+    assert_matches_full_rebuild(backend, conn)